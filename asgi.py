@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+
+from url_shortener import get_app_and_db
+from url_shortener.asgi import ASGIApplication
+
+app, _ = get_app_and_db('URL_SHORTENER_CONFIGURATION', from_envvar=True)
+application = ASGIApplication(app)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""A benchmark comparing strategies of generating new aliases.
+
+For example:
+
+.. code:: bash
+
+    $ python benchmarks/alias_strategies.py --min-length 3 \\
+        --max-length 5 -n 100000
+
+For each strategy, the benchmark reports the time of creating an alias,
+the number of distinct aliases among the created ones and
+the distribution of their lengths.
+"""
+import argparse
+from collections import Counter
+import os
+from string import ascii_lowercase, digits
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from url_shortener.alias_strategies import (  # noqa: E402
+    STRATEGY_NAMES, get_alias_strategy
+)
+from url_shortener.domain_and_persistence import AliasFactory  # noqa: E402
+
+
+def run(name, min_length, max_length, number):
+    """Create aliases with a strategy and measure the time.
+
+    :param name: a name of the strategy
+    :param min_length: a minimum length of the aliases
+    :param max_length: a maximum length of the aliases
+    :param number: a number of aliases to be created
+    :returns: a tuple containing total time in seconds and a list of
+    the created aliases
+    """
+    factory = AliasFactory(digits + ascii_lowercase, min_length, max_length)
+    factory.strategy = get_alias_strategy(name, factory, 'benchmark key')
+    create = factory.create_random
+    start = perf_counter()
+    aliases = [create() for _ in range(number)]
+    return perf_counter() - start, aliases
+
+
+def main():
+    """Run the benchmark for all strategies and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--min-length', type=int, default=3)
+    parser.add_argument('--max-length', type=int, default=5)
+    parser.add_argument('-n', '--number', type=int, default=100000)
+    args = parser.parse_args()
+
+    lengths = range(args.min_length, args.max_length + 1)
+    print('{:20} {:>10} {:>10}  {}'.format(
+        'strategy', 'us/alias', 'distinct',
+        ' '.join('{:>6}'.format('len ' + str(length)) for length in lengths)
+    ))
+    for name in STRATEGY_NAMES:
+        elapsed, aliases = run(
+            name,
+            args.min_length,
+            args.max_length,
+            args.number
+        )
+        length_counts = Counter(len(a) for a in aliases)
+        print('{:20} {:10.2f} {:10}  {}'.format(
+            name,
+            elapsed / args.number * 1e6,
+            len(set(aliases)),
+            ' '.join(
+                '{:6.1%}'.format(length_counts[length] / args.number)
+                for length in lengths
+            )
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""A benchmark comparing WSGI and ASGI serving modes.
+
+Both applications must be served before running the benchmark, for
+example:
+
+.. code:: bash
+
+    $ gunicorn -w 4 -b 127.0.0.1:8000 passenger_wsgi
+    $ uvicorn --workers 4 --port 8001 asgi:application
+    $ python benchmarks/serving_modes.py /abc \\
+        http://127.0.0.1:8000 http://127.0.0.1:8001 -c 512 -n 20000
+
+The benchmark sends GET requests for the same path to each server,
+keeping the given number of connections busy, and reports throughput
+and latency percentiles.
+"""
+import argparse
+import asyncio
+from time import perf_counter
+from urllib.parse import urlsplit
+
+
+async def _request(host, port, path):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(
+            'GET {} HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n\r\n'.format(
+                path, host
+            ).encode('latin-1')
+        )
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def run(base_url, path, concurrency, number):
+    """Send requests to a server and measure their latency.
+
+    :param base_url: a base URL of the server
+    :param path: a path to be requested
+    :param concurrency: a number of requests sent at the same time
+    :param number: a total number of requests
+    :returns: a tuple containing total time in seconds, a sorted list
+    of latencies and a number of failed requests
+    """
+    location = urlsplit(base_url)
+    remaining = iter(range(number))
+    latencies = []
+    failures = [0]
+
+    async def worker():
+        for _ in remaining:
+            start = perf_counter()
+            try:
+                status = await _request(
+                    location.hostname,
+                    location.port or 80,
+                    location.path.rstrip('/') + path
+                )
+            except OSError:
+                status = None
+            latencies.append(perf_counter() - start)
+            if status is None or status >= 500:
+                failures[0] += 1
+
+    start = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return perf_counter() - start, sorted(latencies), failures[0]
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('path', help='a path to be requested, like /abc')
+    parser.add_argument('wsgi_url', help='a base URL of the WSGI server')
+    parser.add_argument('asgi_url', help='a base URL of the ASGI server')
+    parser.add_argument('-c', '--concurrency', type=int, default=256)
+    parser.add_argument('-n', '--number', type=int, default=10000)
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    for mode, url in (('WSGI', args.wsgi_url), ('ASGI', args.asgi_url)):
+        elapsed, latencies, failures = loop.run_until_complete(
+            run(url, args.path, args.concurrency, args.number)
+        )
+        print(
+            '{}: {:.0f} req/s, p50 {:.1f} ms, p99 {:.1f} ms, '
+            '{} failed'.format(
+                mode,
+                len(latencies) / elapsed,
+                _percentile(latencies, 0.5) * 1000,
+                _percentile(latencies, 0.99) * 1000,
+                failures
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,18 @@
 # -*- coding: utf-8 -*-
+import datetime
+import subprocess
+import sys
+from time import sleep
+from timeit import default_timer
+
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
 from url_shortener import get_app_and_db
+from url_shortener.domain_and_persistence import (
+    target_url_class, click_count_table, HashRing,
+    rebalance_shards as rebalance
+)
 
 app, db = get_app_and_db('URL_SHORTENER_CONFIGURATION', from_envvar=True)
 
@@ -11,5 +21,275 @@ manager = Manager(app)
 
 manager.add_command('db', MigrateCommand)
 
+
+@manager.command
+def create_db():
+    """Create all database tables that don't exist yet.
+
+    The table of target URLs is also created on each shard.
+    """
+    db.create_all()
+    table = app.extensions['injector'].get(target_url_class).__table__
+    for bind in app.config['SHARD_BINDS']:
+        table.create(db.get_engine(app, bind), checkfirst=True)
+
+
+@manager.option(
+    '-r',
+    '--retired',
+    dest='retired',
+    default='',
+    help='A comma-separated list of binds removed from SHARD_BINDS'
+    ' whose target URLs are to be moved to the remaining shards'
+)
+@manager.option(
+    '-b',
+    '--batch-size',
+    dest='batch_size',
+    type=int,
+    default=1000,
+    help='A maximum number of rows read at once'
+)
+def rebalance_shards(retired, batch_size):
+    """Move target URLs to shards assigned to their aliases."""
+    shard_binds = app.config['SHARD_BINDS']
+    binds = list(shard_binds) + [b for b in retired.split(',') if b]
+    moved = rebalance(
+        HashRing(shard_binds),
+        {bind: db.get_engine(app, bind) for bind in binds},
+        app.extensions['injector'].get(target_url_class).__table__,
+        batch_size
+    )
+    print('{} target URLs moved.'.format(moved))
+
+
+@manager.option(
+    '-n',
+    '--limit',
+    dest='limit',
+    type=int,
+    default=20,
+    help='A number of the slowest imports to be listed'
+)
+def profile_startup(limit):
+    """Profile imports performed when starting a worker process.
+
+    The application is created in a new interpreter, as it would be by
+    passenger_wsgi.py, with import time profiling enabled.
+    """
+    code = (
+        'from url_shortener import get_app_and_db;'
+        "get_app_and_db('URL_SHORTENER_CONFIGURATION', from_envvar=True)"
+    )
+    start = default_timer()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True
+    )
+    duration = default_timer() - start
+
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.strip()))
+
+    print('Worker startup took {:.3f} s.'.format(duration))
+    print('The slowest imports (cumulative time in ms):')
+    for cumulative, name in sorted(imports, reverse=True)[:limit]:
+        print('{:10.1f}  {}'.format(cumulative / 1000, name))
+
+
+def _get_click_archive():
+    from url_shortener.click_archive import ClickArchive
+    directory = app.config['CLICK_ARCHIVE_DIR']
+    if directory is None:
+        sys.exit('CLICK_ARCHIVE_DIR option is not set.')
+    return ClickArchive(directory)
+
+
+@manager.option(
+    '-p',
+    '--prune',
+    dest='prune',
+    action='store_true',
+    help='Delete archived per-minute counts from the database'
+)
+def archive_clicks(prune):
+    """Archive daily click counts of all days before the current one."""
+    from url_shortener.click_archive import archive_click_counts, to_day
+    archive = _get_click_archive()
+    table = app.extensions['injector'].get(click_count_table)
+    engine = db.get_engine(app)
+    until = to_day(datetime.datetime.utcnow().date())
+
+    rows = archive_click_counts(engine, table, archive, until, prune=prune)
+    print('{} per-minute counts archived{}.'.format(
+        rows,
+        ' and deleted' if prune else ''
+    ))
+
+
+@manager.option(
+    '-a',
+    '--alias',
+    dest='alias',
+    default=None,
+    help='An alias whose daily clicks are to be listed'
+)
+@manager.option(
+    '-d',
+    '--days',
+    dest='days',
+    type=int,
+    default=30,
+    help='A number of archived days included in the report'
+)
+@manager.option(
+    '-n',
+    '--limit',
+    dest='limit',
+    type=int,
+    default=10,
+    help='A number of the most clicked aliases to be listed'
+)
+def click_report(limit, days, alias):
+    """Report the most clicked aliases or daily clicks of an alias."""
+    from url_shortener.click_archive import to_day
+    archive = _get_click_archive()
+    alias_type = app.extensions['injector'].get(
+        target_url_class
+    ).__table__.c.alias.type
+    last_day = to_day(datetime.datetime.utcnow().date()) - 1
+    first_day = last_day - days + 1
+
+    if alias is not None:
+        series = archive.time_series(
+            alias_type.process_bind_param(alias, None),
+            first_day,
+            last_day
+        )
+        for day, clicks in enumerate(series, first_day):
+            date = datetime.date(1970, 1, 1) + datetime.timedelta(days=day)
+            print('{}  {:10}'.format(date, clicks))
+        return
+
+    for integer, clicks in archive.top(limit, first_day, last_day):
+        print('{:12}  {:10}'.format(
+            alias_type.process_result_value(integer, None),
+            clicks
+        ))
+
+
+@manager.option(
+    '-l',
+    '--access-log',
+    dest='access_log',
+    default=None,
+    help='A path to an access log from which requests for aliases are'
+    ' counted instead of recorded clicks'
+)
+@manager.option(
+    '-H',
+    '--hours',
+    dest='hours',
+    type=int,
+    default=24,
+    help='A number of recent hours whose recorded clicks are counted'
+)
+@manager.option(
+    '-n',
+    '--limit',
+    dest='limit',
+    type=int,
+    default=1000,
+    help='A number of the most requested target URLs to be loaded'
+)
+def warm_cache(limit, hours, access_log):
+    """Load the most requested target URLs into the shared cache.
+
+    Worker processes find the loaded target URLs in the shared store
+    instead of querying the database for them.
+    """
+    from url_shortener.cache_warming import warm_caches
+    if (
+            app.config['SHARED_CACHE_URL'] is None or
+            'target_urls' not in app.config['SHARED_CACHE_NAMESPACES']
+    ):
+        sys.exit(
+            'The cache of target URLs is not shared by worker processes. '
+            'Set SHARED_CACHE_URL option and add "target_urls" to '
+            'SHARED_CACHE_NAMESPACES, or use CACHE_WARMING_LIMIT option '
+            'to warm the cache of each process when it starts.'
+        )
+    with app.app_context():
+        stored = warm_caches(
+            app,
+            app.extensions['injector'],
+            limit,
+            hours,
+            access_log
+        )
+    print('{} target URLs loaded.'.format(stored))
+
+
+@manager.option(
+    '-i',
+    '--interval',
+    dest='interval',
+    type=float,
+    default=0,
+    help='A number of seconds between subsequent exports. By default,'
+    ' the snapshot is exported once.'
+)
+@manager.option(
+    '-b',
+    '--batch-size',
+    dest='batch_size',
+    type=int,
+    default=1000,
+    help='A maximum number of rows read at once'
+)
+def export_snapshot(interval, batch_size):
+    """Export target URLs to the snapshot set by SNAPSHOT_FILE option.
+
+    Target URLs are read from shards, if they are configured, or from
+    the first read replica or the primary database. If an export fails,
+    the previous snapshot is left in place.
+    """
+    from sqlalchemy.exc import SQLAlchemyError
+    from url_shortener.snapshot import export_snapshot as export
+    path = app.config['SNAPSHOT_FILE']
+    if path is None:
+        sys.exit('SNAPSHOT_FILE option is not set.')
+    binds = (
+        app.config['SHARD_BINDS'] or
+        app.config['READ_REPLICA_BINDS'][:1] or
+        [None]
+    )
+    engines = [db.get_engine(app, bind) for bind in binds]
+    table = app.extensions['injector'].get(target_url_class).__table__
+    while True:
+        start = default_timer()
+        try:
+            exported, selected = export(path, engines, table, batch_size)
+        except (SQLAlchemyError, OSError) as error:
+            message = 'Exporting the snapshot failed: {!r}'.format(error)
+            if not interval:
+                sys.exit(message)
+            print(message)
+        else:
+            print(
+                '{} target URLs exported, {} of them selected, in {:.3f}'
+                ' s.'.format(exported, selected, default_timer() - start)
+            )
+        if not interval:
+            break
+        sleep(interval)
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,28 @@
+"""Add a table of click counts
+
+Revision ID: 2f7b9c14e5d8
+Revises: 6c0e2d41b7a3
+Create Date: 2026-10-19 10:04:51.227306
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2f7b9c14e5d8'
+down_revision = '6c0e2d41b7a3'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'clickCount',
+        sa.Column('alias', sa.BigInteger(), nullable=False),
+        sa.Column('minute', sa.DateTime(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('alias', 'minute')
+    )
+
+
+def downgrade():
+    op.drop_table('clickCount')
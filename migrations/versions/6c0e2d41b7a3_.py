@@ -0,0 +1,42 @@
+"""Store aliases as 64 bit integers
+
+Revision ID: 6c0e2d41b7a3
+Revises: fd263851b989
+Create Date: 2026-10-19 09:12:05.418213
+
+The alias column is widened, and existing values are not changed. They
+are positional values of aliases, which are read in the same way by
+the default 'positional' alias encoding, so short URLs issued before
+the upgrade - including those with leading zero characters - still
+refer to the same target URLs.
+
+Downgrading fails if there are aliases represented by integers larger
+than max int32.
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6c0e2d41b7a3'
+down_revision = 'fd263851b989'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def alter_alias_type(existing_type, type_):
+    # integers stored by SQLite always have up to 64 bits
+    if op.get_bind().dialect.name != 'sqlite':
+        op.alter_column(
+            'targetURL',
+            'alias',
+            existing_type=existing_type,
+            type_=type_,
+            existing_nullable=False
+        )
+
+
+def upgrade():
+    alter_alias_type(sa.Integer(), sa.BigInteger())
+
+
+def downgrade():
+    alter_alias_type(sa.BigInteger(), sa.Integer())
@@ -54,6 +54,7 @@ setup(
     },
     include_package_data=True,
     install_requires=install_requires,
+    python_requires='>=3.7',
     license=_license,
     classifiers=(
         'Development Status :: 4 - Beta',
@@ -61,7 +62,9 @@ setup(
         'Framework :: Flask',
         'Natural Language :: English',
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
         'Topic :: Internet :: WWW/HTTP',
         'Topic :: Internet :: WWW/HTTP :: Dynamic Content',
         'Topic :: Internet :: WWW/HTTP :: Site Management',
@@ -70,6 +73,8 @@ setup(
     keywords='url-shortener',
     tests_require=tests_require,
     extras_require={
-        'test': tests_require
+        'test': tests_require,
+        'analytics': ['numpy'],
+        'shared_cache': ['redis']
     },
 )
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Tests for strategies of generating new aliases."""
+from itertools import product
+import unittest
+from unittest.mock import patch
+
+from nose_parameterized import parameterized
+
+from url_shortener.alias_strategies import (
+    AliasSpace, FeistelPermutation, RandomIndexStrategy,
+    ScrambledCounterStrategy, SecureRandomIndexStrategy, get_alias_strategy
+)
+from url_shortener.domain_and_persistence import AliasFactory
+
+
+class AliasSpaceTest(unittest.TestCase):
+    """Tests for AliasSpace class.
+
+    :ivar factory: an instance of AliasFactory whose homoglyphs are
+    excluded from the space
+    :ivar tested_instance: an instance of AliasSpace to be tested
+    """
+
+    def setUp(self):
+        self.factory = AliasFactory('0123acimnrvw', 1, 3)
+        self.tested_instance = AliasSpace(
+            self.factory.alphabet,
+            self.factory.homoglyphs,
+            2,
+            3
+        )
+
+    def _get_canonical_aliases(self):
+        """Get all canonical aliases of the space by brute force."""
+        aliases = []
+        for length in 2, 3:
+            for characters in product(self.factory.alphabet, repeat=length):
+                alias = ''.join(characters)
+                if self.factory.from_string(alias) == alias:
+                    aliases.append(alias)
+        return aliases
+
+    def test_size_is_number_of_canonical_aliases(self):
+        """Test if all canonical aliases are counted."""
+        expected = self._get_canonical_aliases()
+
+        self.assertEqual(len(expected), self.tested_instance.size)
+        self.assertEqual(12 ** 2 - 3, self.tested_instance.count(2))
+
+    def test_unrank_returns_canonical_aliases_in_order(self):
+        """Test if indexes are mapped to aliases by length and order."""
+        actual = [
+            self.tested_instance.unrank(i)
+            for i in range(self.tested_instance.size)
+        ]
+
+        self.assertEqual(self._get_canonical_aliases(), actual)
+
+    def test_rank_is_inverse_of_unrank(self):
+        """Test if rank returns the index of each alias."""
+        for index in range(self.tested_instance.size):
+            alias = self.tested_instance.unrank(index)
+
+            self.assertEqual(index, self.tested_instance.rank(alias))
+
+    @parameterized.expand([
+        ('negative', -1),
+        ('too_large', 1798)
+    ])
+    def test_unrank_raises_index_error_for(self, _, index):
+        """Test if IndexError is raised for indexes out of range.
+
+        :param index: the index
+        """
+        self.assertRaises(IndexError, self.tested_instance.unrank, index)
+
+    @parameterized.expand([
+        ('homoglyph', 'arn'),
+        ('unsupported_character', 'ab'),
+        ('too_short', 'a'),
+        ('too_long', 'aaaa')
+    ])
+    def test_rank_raises_value_error_for(self, _, alias):
+        """Test if ValueError is raised for aliases out of the space.
+
+        :param alias: the alias
+        """
+        self.assertRaises(ValueError, self.tested_instance.rank, alias)
+
+    def test_space_without_homoglyphs(self):
+        """Test if all strings are included without homoglyphs."""
+        space = AliasSpace('0123', (), 1, 2)
+
+        self.assertEqual(20, space.size)
+        self.assertEqual('01', space.unrank(5))
+
+
+class FeistelPermutationTest(unittest.TestCase):
+    """Tests for FeistelPermutation class."""
+
+    @parameterized.expand([(1,), (2,), (7,), (100,), (1000,)])
+    def test_permutation_is_bijective(self, size):
+        """Test if each integer in the range is mapped to another one.
+
+        :param size: a size of the range
+        """
+        permutation = FeistelPermutation(size, 'key')
+
+        actual = sorted(permutation(i) for i in range(size))
+
+        self.assertEqual(list(range(size)), actual)
+
+    def test_permutation_depends_on_key(self):
+        """Test if different keys produce different permutations."""
+        first = FeistelPermutation(1000, 'first key')
+        second = FeistelPermutation(1000, b'second key')
+
+        self.assertNotEqual(
+            [first(i) for i in range(20)],
+            [second(i) for i in range(20)]
+        )
+
+    def test_permutation_scrambles_order(self):
+        """Test if consecutive integers are not mapped in order."""
+        permutation = FeistelPermutation(1000, 'key')
+
+        actual = [permutation(i) for i in range(20)]
+
+        self.assertNotEqual(sorted(actual), actual)
+
+    def test_permutation_raises_value_error(self):
+        """Test if ValueError is raised for values out of range."""
+        self.assertRaises(ValueError, FeistelPermutation(10, 'key'), 10)
+
+
+class IndexStrategyTest(unittest.TestCase):
+    """Tests for strategies choosing indexes of aliases.
+
+    :ivar space: an instance of AliasSpace used by the strategies
+    """
+
+    def setUp(self):
+        self.space = AliasSpace('0123', (), 1, 2)
+
+    @patch('url_shortener.alias_strategies.randrange')
+    def test_random_index_strategy(self, randrange_mock):
+        """Test if an alias with a random index is returned.
+
+        :param randrange_mock: a mock of random.randrange function
+        """
+        randrange_mock.return_value = 5
+
+        actual = RandomIndexStrategy(self.space)()
+
+        randrange_mock.assert_called_once_with(20)
+        self.assertEqual('01', actual)
+
+    @patch('url_shortener.alias_strategies.randbelow')
+    def test_secure_random_index_strategy(self, randbelow_mock):
+        """Test if an alias with a securely chosen index is returned.
+
+        :param randbelow_mock: a mock of secrets.randbelow function
+        """
+        randbelow_mock.return_value = 19
+
+        actual = SecureRandomIndexStrategy(self.space)()
+
+        randbelow_mock.assert_called_once_with(20)
+        self.assertEqual('33', actual)
+
+    def test_scrambled_counter_strategy_creates_unique_aliases(self):
+        """Test if all aliases are used before any is repeated."""
+        strategy = ScrambledCounterStrategy(self.space, 'key', start=7)
+
+        first_cycle = [strategy() for _ in range(self.space.size)]
+
+        self.assertEqual(self.space.size, len(set(first_cycle)))
+        self.assertEqual(first_cycle[0], strategy())
+
+
+class GetAliasStrategyTest(unittest.TestCase):
+    """Tests for get_alias_strategy function.
+
+    :ivar factory: an instance of AliasFactory
+    """
+
+    def setUp(self):
+        self.factory = AliasFactory('0123456789acdefhijkmnoprtuvwxy', 3, 5)
+
+    @parameterized.expand([
+        ('random_index', RandomIndexStrategy),
+        ('secure_random_index', SecureRandomIndexStrategy),
+        ('scrambled_counter', ScrambledCounterStrategy)
+    ])
+    def test_get_alias_strategy_returns(self, name, strategy_class):
+        """Test if a strategy creating valid aliases is returned.
+
+        :param name: a name of the strategy
+        :param strategy_class: an expected class of the strategy
+        """
+        self.factory.strategy = get_alias_strategy(name, self.factory, 'k')
+
+        self.assertIsInstance(self.factory.strategy, strategy_class)
+        for _ in range(100):
+            alias = self.factory.create_random()
+            self.assertEqual(alias, self.factory.from_string(alias))
+            self.assertTrue(3 <= len(alias) <= 5)
+
+    def test_get_alias_strategy_returns_character_strategy(self):
+        """Test if the default strategy of the factory is returned."""
+        actual = get_alias_strategy('random_characters', self.factory, 'k')
+
+        self.assertEqual(self.factory.create_from_characters, actual)
+
+    def test_get_alias_strategy_raises_value_error(self):
+        """Test if ValueError is raised for an unknown name."""
+        self.assertRaises(
+            ValueError,
+            get_alias_strategy,
+            'unknown',
+            self.factory,
+            'k'
+        )
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Tests for click analytics."""
+import datetime
+import unittest
+from unittest.mock import Mock
+
+from sqlalchemy import (
+    create_engine, BigInteger, Column, DateTime, Integer, MetaData, Table
+)
+from sqlalchemy.exc import OperationalError
+
+from url_shortener.analytics import (
+    ClickEvent, ClickEventBuffer, aggregate, ClickCountStore,
+    ClickCountFlusher
+)
+
+
+def get_event(alias='abc', timestamp=0):
+    """Get a click event for tests."""
+    return ClickEvent(alias, timestamp, None, 'agent')
+
+
+class ClickEventBufferTest(unittest.TestCase):
+    """Tests for ClickEventBuffer class."""
+
+    def test_push_stores_events(self):
+        """Test if events are stored until the buffer is drained."""
+        tested_instance = ClickEventBuffer(3)
+        events = [get_event(str(i)) for i in range(3)]
+
+        for event in events:
+            self.assertTrue(tested_instance.push(event))
+
+        self.assertEqual(events, tested_instance.drain())
+        self.assertEqual(0, len(tested_instance))
+
+    def test_push_drops_events_when_full(self):
+        """Test if events are dropped and counted when buffer is full."""
+        tested_instance = ClickEventBuffer(2)
+        for _ in range(2):
+            tested_instance.push(get_event())
+
+        actual = tested_instance.push(get_event())
+
+        self.assertFalse(actual)
+        self.assertEqual(1, tested_instance.dropped)
+        self.assertEqual(2, len(tested_instance))
+
+    def test_push_does_nothing_without_capacity(self):
+        """Test if a buffer with no capacity ignores events."""
+        tested_instance = ClickEventBuffer(0)
+
+        self.assertFalse(tested_instance.push(get_event()))
+        self.assertEqual(0, tested_instance.dropped)
+
+
+class AggregateTest(unittest.TestCase):
+    """Tests for aggregate function."""
+
+    def test_aggregate(self):
+        """Test if events are counted per alias and minute."""
+        events = [
+            get_event('abc', 60), get_event('abc', 119.5),
+            get_event('abc', 120), get_event('xyz', 61)
+        ]
+        minute = datetime.datetime(1970, 1, 1, 0, 1)
+        next_minute = datetime.datetime(1970, 1, 1, 0, 2)
+
+        actual = aggregate(events)
+
+        self.assertEqual(
+            {
+                ('abc', minute): 2,
+                ('abc', next_minute): 1,
+                ('xyz', minute): 1
+            },
+            dict(actual)
+        )
+
+
+class ClickCountStoreTest(unittest.TestCase):
+    """Tests for ClickCountStore class.
+
+    :ivar engine: an engine connected to an in-memory SQLite database
+    :ivar table: a table of click counts
+    :ivar tested_instance: an instance of ClickCountStore to be tested
+    """
+
+    MINUTE = datetime.datetime(2016, 10, 1, 12, 30)
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.table = Table(
+            'clickCount',
+            MetaData(),
+            Column('alias', BigInteger, primary_key=True),
+            Column('minute', DateTime, primary_key=True),
+            Column('count', Integer, nullable=False)
+        )
+        self.table.create(self.engine)
+        alias_type = Mock()
+        alias_type.process_bind_param.side_effect = lambda a, _: int(a)
+        self.tested_instance = ClickCountStore(
+            self.engine,
+            self.table,
+            alias_type
+        )
+
+    def _get_counts(self):
+        rows = self.engine.execute(self.table.select())
+        return {(r.alias, r.minute): r.count for r in rows}
+
+    def test_add_inserts_new_counts(self):
+        """Test if counts are inserted for new aliases and minutes."""
+        self.tested_instance.add({('1', self.MINUTE): 3})
+
+        self.assertEqual({(1, self.MINUTE): 3}, self._get_counts())
+
+    def test_add_increases_existing_counts(self):
+        """Test if existing counts are increased."""
+        self.tested_instance.add({('1', self.MINUTE): 3})
+
+        self.tested_instance.add({
+            ('1', self.MINUTE): 2,
+            ('2', self.MINUTE): 1
+        })
+
+        self.assertEqual(
+            {(1, self.MINUTE): 5, (2, self.MINUTE): 1},
+            self._get_counts()
+        )
+
+    def test_add_merges_equivalent_aliases(self):
+        """Test if counts of aliases with the same integer are merged."""
+        self.tested_instance.add({
+            ('1', self.MINUTE): 2,
+            ('01', self.MINUTE): 1
+        })
+
+        self.assertEqual({(1, self.MINUTE): 3}, self._get_counts())
+
+
+class ClickCountFlusherTest(unittest.TestCase):
+    """Tests for ClickCountFlusher class."""
+
+    def setUp(self):
+        self.events = ClickEventBuffer(1)
+        self.store_mock = Mock()
+        self.logger_mock = Mock()
+        self.tested_instance = ClickCountFlusher(
+            self.events,
+            self.store_mock,
+            10,
+            self.logger_mock
+        )
+
+    def test_flush_adds_aggregated_events(self):
+        """Test if buffered events are counted and stored."""
+        self.events.push(get_event('abc', 0))
+
+        self.tested_instance.flush()
+
+        self.store_mock.add.assert_called_once_with(
+            {('abc', datetime.datetime(1970, 1, 1)): 1}
+        )
+        self.assertEqual(0, len(self.events))
+
+    def test_flush_skips_empty_buffer(self):
+        """Test if nothing is stored when there are no events."""
+        self.tested_instance.flush()
+
+        self.assertFalse(self.store_mock.add.called)
+
+    def test_flush_reports_dropped_events_once(self):
+        """Test if a warning is logged for newly dropped events."""
+        self.events.push(get_event())
+        self.events.push(get_event())
+
+        self.tested_instance.flush()
+        self.tested_instance.flush()
+
+        self.assertEqual(1, self.logger_mock.warning.call_count)
+
+    def test_flush_keeps_counts_after_error(self):
+        """Test if counts not stored because of an error are kept."""
+        self.events.push(get_event('abc', 0))
+        self.store_mock.add.side_effect = [
+            OperationalError('', {}, None),
+            None
+        ]
+        self.assertRaises(OperationalError, self.tested_instance.flush)
+        self.events.push(get_event('abc', 1))
+
+        self.tested_instance.flush()
+
+        self.store_mock.add.assert_called_with(
+            {('abc', datetime.datetime(1970, 1, 1)): 2}
+        )
+
+    def test_flush_forgets_stored_counts(self):
+        """Test if counts are not stored again after being added."""
+        self.events.push(get_event('abc', 0))
+        self.tested_instance.flush()
+
+        self.tested_instance.flush()
+
+        self.assertEqual(1, self.store_mock.add.call_count)
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
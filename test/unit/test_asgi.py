@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Tests for the ASGI entry point."""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import unittest
+from unittest.mock import Mock, ANY
+
+from flask import Flask
+from werkzeug.exceptions import NotFound
+
+from url_shortener.analytics import click_event_buffer
+from url_shortener.asgi import ASGIApplication, get_environ
+from url_shortener.caching import (
+    preview_cache, redirect_cache, target_url_cache, TTLCache
+)
+from url_shortener.domain_and_persistence import target_url_class
+from url_shortener.validation import BlacklistValidator
+from url_shortener.views import url_shortener
+
+
+def get_scope(path, method='GET', headers=None):
+    """Get a connection scope of an HTTP request."""
+    return {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'root_path': '',
+        'query_string': b'a=1',
+        'http_version': '1.1',
+        'scheme': 'http',
+        'server': ('example.com', 80),
+        'headers': headers or [(b'host', b'example.com')]
+    }
+
+
+class GetEnvironTest(unittest.TestCase):
+    """Tests for get_environ function."""
+
+    def test_get_environ(self):
+        """Test if request data is converted to a WSGI environment."""
+        scope = get_scope('/abc', 'POST', [
+            (b'host', b'example.com'),
+            (b'content-type', b'text/plain'),
+            (b'x-test', b'1'),
+            (b'x-test', b'2')
+        ])
+
+        actual = get_environ(scope, b'body')
+
+        self.assertEqual('POST', actual['REQUEST_METHOD'])
+        self.assertEqual('/abc', actual['PATH_INFO'])
+        self.assertEqual('a=1', actual['QUERY_STRING'])
+        self.assertEqual('text/plain', actual['CONTENT_TYPE'])
+        self.assertEqual('4', actual['CONTENT_LENGTH'])
+        self.assertEqual('1,2', actual['HTTP_X_TEST'])
+        self.assertEqual(b'body', actual['wsgi.input'].read())
+
+
+class ASGIApplicationTest(unittest.TestCase):
+    """Tests for ASGIApplication class.
+
+    :ivar dependencies: a dictionary of mocks of objects provided by
+    the injector
+    :ivar wsgi_app_mock: a mock of the WSGI application of Flask
+    :ivar tested_instance: an instance of ASGIApplication to be tested
+    """
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.register_blueprint(url_shortener)
+        app.config['CLICK_BUFFER_SIZE'] = 0
+        app.config['MISSING_ALIAS_CACHE_TIMEOUT'] = 10
+
+        self.dependencies = {
+            target_url_class: Mock(),
+            BlacklistValidator: Mock(),
+            preview_cache: Mock(),
+            redirect_cache: Mock(),
+            target_url_cache: TTLCache(10, 60),
+            click_event_buffer: Mock()
+        }
+        self.dependencies[preview_cache].get.return_value = None
+        self.dependencies[redirect_cache].get.return_value = None
+        validator = self.dependencies[BlacklistValidator]
+        validator.get_verdict.return_value = (None, False)
+        target_url_cls = self.dependencies[target_url_class]
+        target_url_cls.get_record_or_404.return_value = 'http://target.com'
+
+        injector_mock = Mock()
+        injector_mock.get.side_effect = self.dependencies.get
+        app.extensions['injector'] = injector_mock
+
+        def wsgi_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [b'WSGI']
+
+        self.wsgi_app_mock = Mock(side_effect=wsgi_app)
+        app.wsgi_app = self.wsgi_app_mock
+
+        self.tested_instance = ASGIApplication(
+            app,
+            ThreadPoolExecutor(2)
+        )
+
+    def tearDown(self):
+        self.tested_instance.executor.shutdown()
+
+    def _call(self, scope):
+        """Call the tested instance and collect sent messages."""
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            sent.append(message)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(
+                self.tested_instance(scope, receive, send)
+            )
+        finally:
+            loop.close()
+        return sent
+
+    def _get_headers(self, message):
+        return {k: v for k, v in message['headers']}
+
+    def test_redirects(self):
+        """Test if a redirect is sent for an alias."""
+        start, _ = self._call(get_scope('/abc'))
+
+        self.assertEqual(302, start['status'])
+        self.assertEqual(
+            b'http://target.com',
+            self._get_headers(start)[b'Location']
+        )
+        self.assertFalse(self.wsgi_app_mock.called)
+        self.dependencies[click_event_buffer].push.assert_called_once_with(
+            ANY
+        )
+
+    def test_redirects_for_cached_page(self):
+        """Test if a cached page is used without a lookup."""
+        page = self.dependencies[preview_cache].get.return_value = Mock()
+        page.warning = None
+        page.target_url = 'http://cached.com'
+
+        start, _ = self._call(get_scope('/abc'))
+
+        self.assertEqual(
+            b'http://cached.com',
+            self._get_headers(start)[b'Location']
+        )
+        target_url_cls = self.dependencies[target_url_class]
+        self.assertFalse(target_url_cls.get_record_or_404.called)
+
+    def test_redirects_for_cached_record(self):
+        """Test if a cached record of a target URL is used."""
+        self.dependencies[target_url_cache].set('abc', 'http://cached.com')
+
+        start, _ = self._call(get_scope('/abc'))
+
+        self.assertEqual(
+            b'http://cached.com',
+            self._get_headers(start)[b'Location']
+        )
+        target_url_cls = self.dependencies[target_url_class]
+        self.assertFalse(target_url_cls.get_record_or_404.called)
+
+    def test_caches_record(self):
+        """Test if a record found by a lookup is cached."""
+        self._call(get_scope('/abc'))
+
+        self.assertEqual(
+            'http://target.com',
+            self.dependencies[target_url_cache].get('abc')
+        )
+
+    def test_caches_redirect(self):
+        """Test if a redirect is offered to the redirect cache."""
+        self._call(get_scope('/abc'))
+
+        key, serialized, _ = self.dependencies[redirect_cache].set.call_args[0]
+        self.assertEqual(('example.com', 'abc'), key)
+        self.assertIn(('Location', 'http://target.com'), serialized.headers)
+
+    def test_does_not_cache_degraded_redirect(self):
+        """Test if a redirect based on a degraded verdict isn't cached."""
+        validator = self.dependencies[BlacklistValidator]
+        validator.get_verdict.return_value = (None, True)
+
+        start, _ = self._call(get_scope('/abc'))
+
+        self.assertEqual(302, start['status'])
+        self.assertFalse(self.dependencies[redirect_cache].set.called)
+
+    def test_serves_cached_redirect(self):
+        """Test if a cached redirect is sent without a lookup."""
+        self.dependencies[redirect_cache].get.return_value = (
+            302,
+            [('Location', 'http://cached.com')],
+            b'redirect'
+        )
+
+        start, body = self._call(get_scope('/abc', 'HEAD'))
+
+        self.assertEqual(302, start['status'])
+        self.assertEqual(
+            b'http://cached.com',
+            self._get_headers(start)[b'Location']
+        )
+        self.assertEqual(b'', body['body'])
+        target_url_cls = self.dependencies[target_url_class]
+        self.assertFalse(target_url_cls.get_record_or_404.called)
+        self.assertTrue(self.dependencies[click_event_buffer].push.called)
+
+    def _assert_delegated(self, scope):
+        _, body = self._call(scope)
+
+        self.assertTrue(self.wsgi_app_mock.called)
+        self.assertEqual({'type': 'http.response.body', 'body': b'WSGI'}, body)
+
+    def test_delegates_spam(self):
+        """Test if requests for spam URLs are passed to WSGI app."""
+        validator = self.dependencies[BlacklistValidator]
+        validator.get_verdict.return_value = ('This is spam', False)
+
+        self._assert_delegated(get_scope('/abc'))
+
+    def test_delegates_missing_alias(self):
+        """Test if requests for missing aliases are passed to WSGI app."""
+        target_url_cls = self.dependencies[target_url_class]
+        target_url_cls.get_record_or_404.side_effect = NotFound
+
+        self._assert_delegated(get_scope('/abc'))
+
+    def test_caches_missing_alias(self):
+        """Test if a missing alias is looked up once."""
+        target_url_cls = self.dependencies[target_url_class]
+        target_url_cls.get_record_or_404.side_effect = NotFound
+
+        self._call(get_scope('/abc'))
+        self._assert_delegated(get_scope('/abc'))
+
+        self.assertEqual(1, target_url_cls.get_record_or_404.call_count)
+
+    def test_delegates_preview(self):
+        """Test if requests for previews are passed to WSGI app."""
+        self._assert_delegated(get_scope('/preview/abc'))
+
+    def test_delegates_form(self):
+        """Test if requests for the form are passed to WSGI app."""
+        self._assert_delegated(get_scope('/', 'POST'))
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
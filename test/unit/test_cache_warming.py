@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Tests for warming of the cache of target URLs."""
+import datetime
+import unittest
+from unittest.mock import Mock, patch
+
+from sqlalchemy import (
+    create_engine, BigInteger, Column, DateTime, Integer, MetaData, Table
+)
+from sqlalchemy.exc import OperationalError
+
+from url_shortener.cache_warming import (
+    get_logged_clicks, get_recorded_clicks, normalize_aliases,
+    warm_caches, warm_target_url_cache
+)
+from url_shortener.caching import TTLCache
+from url_shortener.domain_and_persistence import (
+    AliasFactory, BigIntegerAlias, TargetURLRecord
+)
+
+
+class GetLoggedClicksTest(unittest.TestCase):
+    """Tests for get_logged_clicks function."""
+
+    def test_get_logged_clicks_counts_successful_requests(self):
+        """Test if requests for short and preview URLs are counted."""
+        template = (
+            '127.0.0.1 - - [19/Oct/2026:08:00:00 +0000] "{} HTTP/1.1" {} 209'
+            ' "-" "agent"'
+        )
+        lines = [
+            template.format('GET /abc', 302),
+            template.format('GET /abc?x=1', 302),
+            template.format('HEAD /preview/abc', 200),
+            template.format('GET /xyz', 302),
+            template.format('GET /missing', 404),
+            template.format('POST /', 302),
+            template.format('GET /static/style.css', 200)
+        ]
+
+        actual = get_logged_clicks(lines)
+
+        self.assertEqual({'abc': 3, 'xyz': 1}, actual)
+
+
+class AliasConversionTest(unittest.TestCase):
+    """Tests for functions converting aliases.
+
+    :ivar alias_type: an instance of BigIntegerAlias
+    """
+
+    def setUp(self):
+        self.alias_type = BigIntegerAlias(
+            AliasFactory('0123456789acdefhijkmnopqrtuvwxy', 1, 5)
+        )
+
+    def test_normalize_aliases(self):
+        """Test if homoglyphs are replaced and invalid aliases skipped."""
+        counts = {'acm': 2, 'acrn': 3, 'static.css': 7, 'ACD': 1, 'x': 1}
+
+        actual = normalize_aliases(counts, self.alias_type)
+
+        self.assertEqual({'acm': 5, 'x': 1}, actual)
+
+    def test_get_recorded_clicks_returns_most_clicked_aliases(self):
+        """Test if recent clicks are summed and decoded."""
+        table = Table(
+            'clickCount',
+            MetaData(),
+            Column('alias', BigInteger, primary_key=True),
+            Column('minute', DateTime, primary_key=True),
+            Column('count', Integer, nullable=False)
+        )
+        engine = create_engine('sqlite://')
+        table.create(engine)
+        now = datetime.datetime(2026, 10, 19, 8)
+        rows = [
+            ('acd', now, 2), ('acd', now - datetime.timedelta(hours=1), 3),
+            ('xy0', now, 4), ('def', now, 1),
+            ('def', now - datetime.timedelta(days=2), 100)
+        ]
+        engine.execute(table.insert(), [
+            {
+                'alias': self.alias_type.process_bind_param(a, None),
+                'minute': m,
+                'count': c
+            }
+            for a, m, c in rows
+        ])
+
+        actual = get_recorded_clicks(
+            engine,
+            table,
+            self.alias_type,
+            now - datetime.timedelta(days=1),
+            2
+        )
+
+        self.assertEqual({'acd': 5, 'xy0': 4}, actual)
+
+
+class WarmTargetURLCacheTest(unittest.TestCase):
+    """Tests for warm_target_url_cache function.
+
+    :ivar target_url_cls_mock: a mock of a target URL class
+    """
+
+    def setUp(self):
+        self.target_url_cls_mock = Mock()
+        self.target_url_cls_mock.get_records.side_effect = lambda aliases: [
+            TargetURLRecord(a, 'http://{}.com'.format(a))
+            for a in aliases if a != 'missing'
+        ]
+
+    def test_warm_target_url_cache_stores_records(self):
+        """Test if existing target URLs are stored in the cache."""
+        cache = TTLCache(10, 60)
+
+        actual = warm_target_url_cache(
+            self.target_url_cls_mock,
+            cache,
+            ['abc', 'missing', 'xyz']
+        )
+
+        self.assertEqual(2, actual)
+        self.assertEqual('http://abc.com', cache.get('abc').value)
+        self.assertIsNone(cache.get('missing'))
+
+    def test_warm_target_url_cache_selects_batches(self):
+        """Test if target URLs are selected in batches."""
+        aliases = [str(i) for i in range(5)]
+
+        warm_target_url_cache(
+            self.target_url_cls_mock,
+            TTLCache(10, 60),
+            aliases,
+            2
+        )
+
+        self.assertEqual(
+            [aliases[0:2], aliases[2:4], aliases[4:]],
+            [
+                c[0][0]
+                for c in self.target_url_cls_mock.get_records.call_args_list
+            ]
+        )
+
+    def test_warm_target_url_cache_keeps_most_requested(self):
+        """Test if the most requested target URLs fit in the cache."""
+        cache = TTLCache(2, 60)
+
+        warm_target_url_cache(
+            self.target_url_cls_mock,
+            cache,
+            ['a', 'b', 'c']
+        )
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+        self.assertIsNone(cache.get('c'))
+
+
+class WarmCachesTest(unittest.TestCase):
+    """Tests for warm_caches function.
+
+    :ivar app_mock: a mock of Flask application object
+    :ivar injector_mock: a mock of an injector
+    """
+
+    def setUp(self):
+        self.app_mock = Mock()
+        self.injector_mock = Mock()
+        self.injector_mock.get.return_value.__table__ = Mock()
+        self.registry_patcher = patch(
+            'url_shortener.cache_warming.get_cache_registry'
+        )
+        self.registry_patcher.start()
+
+    def tearDown(self):
+        self.registry_patcher.stop()
+
+    @patch('url_shortener.cache_warming.get_recorded_clicks')
+    def test_warm_caches_logs_database_errors(self, clicks_mock):
+        """Test if database errors don't prevent startup.
+
+        :param clicks_mock: a mock of get_recorded_clicks function
+        """
+        clicks_mock.side_effect = OperationalError('statement', {}, None)
+
+        actual = warm_caches(self.app_mock, self.injector_mock, 10, 24)
+
+        self.assertEqual(0, actual)
+        self.assertTrue(self.app_mock.logger.warning.called)
+
+    def test_warm_caches_logs_missing_access_log(self):
+        """Test if a missing access log doesn't prevent startup."""
+        actual = warm_caches(
+            self.app_mock,
+            self.injector_mock,
+            10,
+            24,
+            '/nonexistent/access.log'
+        )
+
+        self.assertEqual(0, actual)
+        self.assertTrue(self.app_mock.logger.warning.called)
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
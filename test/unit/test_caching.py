@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Tests for caching-related classes and functions."""
+import pickle
+import unittest
+from unittest.mock import Mock
+
+from nose_parameterized import parameterized
+
+from url_shortener import default_config
+from url_shortener.caching import (
+    AdmissionCache, CacheRegistry, FrequencySketch, SharedStore,
+    TieredCache, TTLCache, estimate_size, get_cache_registry
+)
+from url_shortener.domain_and_persistence import TargetURLRecord
+
+
+class TTLCacheTest(unittest.TestCase):
+    """Tests for TTLCache class.
+
+    :cvar MAXSIZE: a maximum size of tested instance
+    :cvar TTL: a number of seconds after which items stored by
+    tested instance expire
+    :ivar timer_mock: a mock of a timer function used by tested
+    instance
+    :ivar tested_instance: instance of TTLCache to be used
+    during tests
+    """
+
+    MAXSIZE = 3
+    TTL = 10
+
+    def setUp(self):
+        self.timer_mock = Mock()
+        self.timer_mock.return_value = 0
+        self.tested_instance = TTLCache(
+            self.MAXSIZE,
+            self.TTL,
+            self.timer_mock
+        )
+
+    def test_get_returns_stored_value(self):
+        """Test if a stored value is returned."""
+        self.tested_instance.set('key', 'value')
+
+        self.assertEqual('value', self.tested_instance.get('key'))
+
+    def test_get_returns_default(self):
+        """Test if the default is returned for a missing value."""
+        self.assertEqual('x', self.tested_instance.get('key', 'x'))
+
+    def test_get_returns_default_for_expired_value(self):
+        """Test if expired values are not returned."""
+        self.tested_instance.set('key', 'value')
+        self.timer_mock.return_value = self.TTL
+
+        self.assertIsNone(self.tested_instance.get('key'))
+        self.assertEqual(0, len(self.tested_instance))
+
+    def test_get_returns_default_for_value_expired_with_own_ttl(self):
+        """Test if a value expires after a ttl passed to set."""
+        self.tested_instance.set('key', 'value', ttl=1)
+        self.timer_mock.return_value = 1
+
+        self.assertIsNone(self.tested_instance.get('key'))
+
+    def test_set_evicts_least_recently_used_value(self):
+        """Test if the least recently used value is evicted."""
+        for i in range(self.MAXSIZE):
+            self.tested_instance.set(i, i)
+        self.tested_instance.get(0)
+
+        self.tested_instance.set('new', 'value')
+
+        self.assertIsNone(self.tested_instance.get(1))
+        self.assertEqual(0, self.tested_instance.get(0))
+        self.assertEqual(self.MAXSIZE, len(self.tested_instance))
+
+    def test_set_does_not_store_for_zero_maxsize(self):
+        """Test if a cache with no capacity doesn't store values."""
+        cache = TTLCache(0, self.TTL, self.timer_mock)
+
+        cache.set('key', 'value')
+
+        self.assertIsNone(cache.get('key'))
+
+    def test_delete(self):
+        """Test if a deleted value is no longer returned."""
+        self.tested_instance.set('key', 'value')
+
+        self.tested_instance.delete('key')
+
+        self.assertIsNone(self.tested_instance.get('key'))
+
+    def test_as_dict_reports_statistics(self):
+        """Test if hits, misses, evictions and sizes are reported."""
+        for i in range(self.MAXSIZE + 1):
+            self.tested_instance.set(i, 'value', 10)
+        self.tested_instance.get(0)
+        self.tested_instance.get(1)
+        self.timer_mock.return_value = self.TTL
+        self.tested_instance.get(2)
+
+        actual = self.tested_instance.as_dict()
+
+        self.assertEqual(
+            {'hits': 1, 'misses': 2, 'evictions': 1, 'expirations': 1,
+             'items': 2, 'bytes': 20},
+            actual
+        )
+
+
+class EstimateSizeTest(unittest.TestCase):
+    """Tests for estimate_size function."""
+
+    def test_estimate_size_includes_items_of_containers(self):
+        """Test if sizes of items are added to the size of a tuple."""
+        value = 'x' * 1000
+
+        self.assertGreater(estimate_size((value,)), 1000)
+        self.assertGreater(estimate_size({'key': value}), 1000)
+
+
+class FrequencySketchTest(unittest.TestCase):
+    """Tests for FrequencySketch class."""
+
+    def test_estimate_counts_accesses(self):
+        """Test if estimated frequencies follow recorded accesses."""
+        sketch = FrequencySketch(64)
+        for _ in range(3):
+            sketch.increment('hot')
+        sketch.increment('cold')
+
+        self.assertEqual(3, sketch.estimate('hot'))
+        self.assertEqual(1, sketch.estimate('cold'))
+
+    def test_increment_halves_counts_after_sample(self):
+        """Test if counts are halved after the sample size is reached."""
+        sketch = FrequencySketch(64, sample_size=8)
+        for _ in range(8):
+            sketch.increment('hot')
+
+        self.assertEqual(4, sketch.estimate('hot'))
+
+    def test_estimate_is_bounded(self):
+        """Test if counts don't exceed their maximum."""
+        sketch = FrequencySketch(64, sample_size=100)
+        for _ in range(50):
+            sketch.increment('hot')
+
+        self.assertEqual(FrequencySketch.MAX_COUNT, sketch.estimate('hot'))
+
+
+class AdmissionCacheTest(unittest.TestCase):
+    """Tests for AdmissionCache class.
+
+    :ivar timer_mock: a mock of a timer function used by tested
+    instance
+    :ivar tested_instance: instance of AdmissionCache to be used
+    during tests
+    """
+
+    def setUp(self):
+        self.timer_mock = Mock()
+        self.timer_mock.return_value = 0
+        self.tested_instance = AdmissionCache(2, 100, 10, self.timer_mock)
+
+    def _request(self, key, count=1):
+        for _ in range(count):
+            self.tested_instance.get(key)
+
+    def test_get_returns_stored_value(self):
+        """Test if a stored value is returned and counted as a hit."""
+        self.tested_instance.set('key', 'value', 10)
+
+        self.assertEqual('value', self.tested_instance.get('key'))
+        self.assertEqual(1, self.tested_instance.as_dict()['hits'])
+
+    def test_get_returns_default_for_expired_value(self):
+        """Test if expired values are not returned."""
+        self.tested_instance.set('key', 'value', 10)
+        self.timer_mock.return_value = 10
+
+        self.assertIsNone(self.tested_instance.get('key'))
+        self.assertEqual(0, len(self.tested_instance))
+
+    def test_set_rejects_less_frequent_key(self):
+        """Test if popular values are not evicted for rare ones."""
+        for key in 'a', 'b':
+            self._request(key, 3)
+            self.tested_instance.set(key, key, 10)
+        self._request('c')
+
+        self.assertFalse(self.tested_instance.set('c', 'c', 10))
+        self.assertEqual('a', self.tested_instance.get('a'))
+        self.assertEqual(1, self.tested_instance.as_dict()['rejections'])
+
+    def test_set_admits_more_frequent_key(self):
+        """Test if the least recently used value is evicted."""
+        for key in 'a', 'b':
+            self._request(key)
+            self.tested_instance.set(key, key, 10)
+        self._request('c', 3)
+
+        self.assertTrue(self.tested_instance.set('c', 'c', 10))
+        self.assertIsNone(self.tested_instance.get('a'))
+        self.assertEqual(1, self.tested_instance.as_dict()['evictions'])
+
+    def test_set_respects_memory_limit(self):
+        """Test if values are evicted to stay within the byte limit."""
+        self.tested_instance.set('a', 'a', 60)
+        self._request('b', 3)
+
+        self.tested_instance.set('b', 'b', 60)
+
+        self.assertEqual(1, len(self.tested_instance))
+        self.assertEqual(60, self.tested_instance.as_dict()['bytes'])
+
+    def test_set_rejects_value_larger_than_limit(self):
+        """Test if a value exceeding the byte limit is not stored."""
+        self.assertFalse(self.tested_instance.set('a', 'a', 101))
+
+    def test_set_evicts_expired_value(self):
+        """Test if expired values are evicted regardless of frequency."""
+        self._request('a', 3)
+        self.tested_instance.set('a', 'a', 100)
+        self.timer_mock.return_value = 10
+
+        self.assertTrue(self.tested_instance.set('b', 'b', 100))
+
+    def test_set_does_not_store_for_zero_maxsize(self):
+        """Test if a cache with no capacity doesn't store values."""
+        cache = AdmissionCache(0, 100, 10, self.timer_mock)
+
+        cache.set('key', 'value', 10)
+
+        self.assertIsNone(cache.get('key'))
+
+
+class SharedStoreTest(unittest.TestCase):
+    """Tests for SharedStore class.
+
+    :ivar client_mock: a mock of a Redis client
+    :ivar logger_mock: a mock of a logger
+    :ivar tested_instance: an instance of SharedStore to be tested
+    """
+
+    def setUp(self):
+        self.client_mock = Mock()
+        self.logger_mock = Mock()
+        self.tested_instance = SharedStore(
+            self.client_mock,
+            'prefix',
+            1.5,
+            self.logger_mock,
+            (IOError,)
+        )
+
+    def test_set_stores_pickled_value(self):
+        """Test if a value and its size are stored with a timeout."""
+        self.tested_instance.set(('host', 'abc'), 'value', 10)
+
+        self.client_mock.set.assert_called_once_with(
+            "prefix:('host', 'abc')",
+            pickle.dumps(('value', 10), pickle.HIGHEST_PROTOCOL),
+            px=1500
+        )
+
+    def test_get_returns_stored_value(self):
+        """Test if an unpickled value and its size are returned."""
+        self.client_mock.get.return_value = pickle.dumps(('value', 10))
+
+        self.assertEqual(('value', 10), self.tested_instance.get('key'))
+        self.client_mock.get.assert_called_once_with("prefix:'key'")
+        self.assertEqual(1, self.tested_instance.as_dict()['hits'])
+
+    def test_get_returns_none_for_missing_value(self):
+        """Test if None is returned when the store has no value."""
+        self.client_mock.get.return_value = None
+
+        self.assertIsNone(self.tested_instance.get('key'))
+        self.assertEqual(1, self.tested_instance.as_dict()['misses'])
+
+    def test_get_treats_errors_as_misses(self):
+        """Test if errors of the store are logged and counted."""
+        self.client_mock.get.side_effect = IOError
+
+        self.assertIsNone(self.tested_instance.get('key'))
+        self.assertEqual(1, self.tested_instance.as_dict()['errors'])
+        self.assertTrue(self.logger_mock.warning.called)
+
+    def test_clear_deletes_keys_with_prefix(self):
+        """Test if all keys with the prefix are deleted."""
+        self.client_mock.scan_iter.return_value = iter(['prefix:1'])
+
+        self.tested_instance.clear()
+
+        self.client_mock.scan_iter.assert_called_once_with(match='prefix:*')
+        self.client_mock.delete.assert_called_once_with('prefix:1')
+
+
+class TieredCacheTest(unittest.TestCase):
+    """Tests for TieredCache class.
+
+    :ivar local: a local cache of tested instance
+    :ivar shared_mock: a mock of a shared store
+    :ivar tested_instance: an instance of TieredCache to be tested
+    """
+
+    def setUp(self):
+        self.local = TTLCache(10, 60)
+        self.shared_mock = Mock()
+        self.shared_mock.get.return_value = None
+        self.shared_mock.as_dict.return_value = {'hits': 0}
+        self.tested_instance = TieredCache(
+            'name',
+            self.local,
+            self.shared_mock
+        )
+
+    def test_get_returns_local_value(self):
+        """Test if the shared store is not queried after a local hit."""
+        self.local.set('key', 'value')
+
+        self.assertEqual('value', self.tested_instance.get('key'))
+        self.assertFalse(self.shared_mock.get.called)
+
+    def test_get_returns_shared_value(self):
+        """Test if a shared value is returned and cached locally."""
+        self.shared_mock.get.return_value = 'value', 10
+
+        self.assertEqual('value', self.tested_instance.get('key'))
+        self.assertEqual('value', self.local.get('key'))
+        self.assertEqual(10, self.local.as_dict()['bytes'])
+
+    @parameterized.expand([
+        ('with_shared_store', Mock(**{'get.return_value': None})),
+        ('without_shared_store', None)
+    ])
+    def test_get_returns_default(self, _, shared):
+        """Test if the default is returned when no tier has the value.
+
+        :param shared: a shared store of the cache, or None
+        """
+        cache = TieredCache('name', self.local, shared)
+
+        self.assertEqual('x', cache.get('key', 'x'))
+
+    def test_set_stores_value_in_both_tiers(self):
+        """Test if a value is stored locally and in the shared store."""
+        self.assertTrue(self.tested_instance.set('key', 'value', 10))
+
+        self.assertEqual('value', self.local.get('key'))
+        self.shared_mock.set.assert_called_once_with(
+            'key', 'value', 10, None
+        )
+
+    def test_set_passes_ttl_to_both_tiers(self):
+        """Test if a value can expire earlier than other values."""
+        self.tested_instance.set('key', 'value', 10, 0)
+
+        self.assertIsNone(self.local.get('key'))
+        self.shared_mock.set.assert_called_once_with('key', 'value', 10, 0)
+
+    def test_delete_removes_value_from_both_tiers(self):
+        """Test if a value is deleted from both tiers."""
+        self.tested_instance.set('key', 'value')
+
+        self.tested_instance.delete('key')
+
+        self.assertIsNone(self.local.get('key'))
+        self.shared_mock.delete.assert_called_once_with('key')
+
+    def test_as_dict_reports_hit_ratio_of_both_tiers(self):
+        """Test if hits of the shared store are included in the ratio."""
+        self.local.set('key', 'value')
+        self.tested_instance.get('key')
+        self.tested_instance.get('other')
+        self.tested_instance.get('another')
+        self.shared_mock.as_dict.return_value = {'hits': 1}
+
+        actual = self.tested_instance.as_dict()
+
+        self.assertAlmostEqual(2 / 3, actual['hit_ratio'])
+        self.assertEqual({'hits': 1}, actual['shared'])
+
+
+class CacheRegistryTest(unittest.TestCase):
+    """Tests for CacheRegistry class."""
+
+    def test_notify_commit_calls_hooks(self):
+        """Test if commit hooks receive records of target URLs."""
+        registry = CacheRegistry()
+        hook = Mock()
+        registry.add_commit_hook(hook)
+
+        registry.notify_commit(['record'])
+
+        hook.assert_called_once_with(['record'])
+
+    def test_as_dict_reports_all_namespaces(self):
+        """Test if statistics of each namespace are reported."""
+        registry = CacheRegistry()
+        registry.add(TieredCache('first', TTLCache(1, 1)))
+        registry.add(TieredCache('second', TTLCache(1, 1)))
+
+        self.assertEqual(['first', 'second'], sorted(registry.as_dict()))
+
+
+class GetCacheRegistryTest(unittest.TestCase):
+    """Tests for get_cache_registry function.
+
+    :ivar app_mock: a mock of Flask application object
+    """
+
+    def setUp(self):
+        self.app_mock = Mock()
+        self.app_mock.extensions = {}
+        self.app_mock.config = {
+            k: getattr(default_config, k) for k in dir(default_config)
+            if k.isupper()
+        }
+        self.app_mock.config['TARGET_URL_CACHE_SIZE'] = 10
+
+    def test_get_cache_registry_returns_the_same_instance(self):
+        """Test if caches are created once for an application."""
+        self.assertIs(
+            get_cache_registry(self.app_mock),
+            get_cache_registry(self.app_mock)
+        )
+
+    def test_commit_hook_caches_new_target_urls(self):
+        """Test if records of committed target URLs are cached."""
+        registry = get_cache_registry(self.app_mock)
+        record = TargetURLRecord('abc', 'http://x.com')
+
+        registry.notify_commit([record])
+
+        self.assertEqual(record, registry.get('target_urls').get('abc'))
+
+    def test_commit_hook_marks_recent_aliases(self):
+        """Test if aliases of committed target URLs are remembered."""
+        registry = get_cache_registry(self.app_mock)
+
+        registry.notify_commit([TargetURLRecord('abc', 'http://x.com')])
+
+        self.assertTrue(registry.get('recent_aliases').get('abc'))
+
+    def test_get_cache_registry_raises_value_error(self):
+        """Test if ValueError is raised for unshareable namespaces."""
+        self.app_mock.config['SHARED_CACHE_NAMESPACES'] = ['host_verdicts']
+
+        self.assertRaises(ValueError, get_cache_registry, self.app_mock)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Tests for protection against unavailable blacklist sources."""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+import unittest
+from unittest.mock import Mock
+
+from spam_lists.exceptions import InvalidURLError
+
+from url_shortener.circuit_breaker import (
+    CircuitBreaker, DegradedResult, GuardedRedirectResolver, GuardedTester,
+    SourceGuard, SourceUnavailableError, reset_degraded
+)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    """Tests for CircuitBreaker class.
+
+    :ivar now: a current time returned by the timer of tested instance
+    :ivar tested_instance: an instance of CircuitBreaker to be tested
+    """
+
+    def setUp(self):
+        self.now = 100
+        self.tested_instance = CircuitBreaker(2, 30, lambda: self.now)
+
+    def _fail(self, count):
+        for _ in range(count):
+            self.tested_instance.allow()
+            self.tested_instance.record_failure()
+
+    def test_circuit_stays_closed_below_threshold(self):
+        """Test if calls are allowed after fewer failures."""
+        self._fail(1)
+
+        self.assertEqual(CircuitBreaker.CLOSED, self.tested_instance.state)
+        self.assertTrue(self.tested_instance.allow())
+
+    def test_success_resets_failure_count(self):
+        """Test if only consecutive failures open the circuit."""
+        self._fail(1)
+        self.tested_instance.record_success()
+        self._fail(1)
+
+        self.assertTrue(self.tested_instance.allow())
+
+    def test_circuit_opens_after_threshold(self):
+        """Test if calls are rejected after consecutive failures."""
+        self._fail(2)
+
+        self.assertEqual(CircuitBreaker.OPEN, self.tested_instance.state)
+        self.assertFalse(self.tested_instance.allow())
+
+    def test_half_open_circuit_allows_single_probe(self):
+        """Test if only one call is allowed after the reset timeout."""
+        self._fail(2)
+        self.now += 30
+
+        self.assertEqual(CircuitBreaker.HALF_OPEN, self.tested_instance.state)
+        self.assertTrue(self.tested_instance.allow())
+        self.assertFalse(self.tested_instance.allow())
+
+    def test_successful_probe_closes_circuit(self):
+        """Test if the circuit is closed after a successful probe."""
+        self._fail(2)
+        self.now += 30
+        self.tested_instance.allow()
+
+        self.tested_instance.record_success()
+
+        self.assertEqual(CircuitBreaker.CLOSED, self.tested_instance.state)
+
+    def test_failed_probe_opens_circuit(self):
+        """Test if the circuit is opened again after a failed probe."""
+        self._fail(2)
+        self.now += 30
+        self.tested_instance.allow()
+
+        self.tested_instance.record_failure()
+
+        self.assertFalse(self.tested_instance.allow())
+        self.now += 30
+        self.assertTrue(self.tested_instance.allow())
+
+
+class SourceGuardTest(unittest.TestCase):
+    """Tests for SourceGuard class.
+
+    :ivar breaker: a circuit breaker used by tested instance
+    :ivar logger_mock: a mock of a logger
+    :ivar tested_instance: an instance of SourceGuard to be tested
+    """
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(1, 60)
+        self.logger_mock = Mock()
+        self.executor = ThreadPoolExecutor(2)
+        self.tested_instance = SourceGuard(
+            'source',
+            self.breaker,
+            0.05,
+            self.executor,
+            self.logger_mock,
+            (InvalidURLError,)
+        )
+
+    def tearDown(self):
+        self.executor.shutdown(wait=False)
+
+    def test_call_returns_result(self):
+        """Test if a result of a function is returned."""
+        actual = self.tested_instance.call(lambda x: x * 2, 3)
+
+        self.assertEqual(6, actual)
+        self.assertEqual(1, self.tested_instance.as_dict()['calls'])
+
+    def test_call_raises_error_on_timeout(self):
+        """Test if the guard stops waiting after the budget is spent."""
+        event = Event()
+        self.addCleanup(event.set)
+
+        with self.assertRaises(SourceUnavailableError):
+            self.tested_instance.call(event.wait)
+
+        metrics = self.tested_instance.as_dict()
+        self.assertEqual(1, metrics['timeouts'])
+        self.assertEqual(CircuitBreaker.OPEN, metrics['state'])
+        self.assertGreaterEqual(metrics['max_latency'], 0.05)
+
+    def test_call_raises_error_on_failure(self):
+        """Test if errors of the source are recorded as failures."""
+        function = Mock(side_effect=IOError)
+
+        with self.assertRaises(SourceUnavailableError):
+            self.tested_instance.call(function)
+
+        self.assertEqual(1, self.tested_instance.as_dict()['failures'])
+        self.assertTrue(self.logger_mock.warning.called)
+
+    def test_call_rejects_calls_when_circuit_is_open(self):
+        """Test if the source is not called when the circuit is open."""
+        self.breaker.record_failure()
+        function = Mock()
+
+        with self.assertRaises(SourceUnavailableError):
+            self.tested_instance.call(function)
+
+        self.assertFalse(function.called)
+        self.assertEqual(1, self.tested_instance.as_dict()['rejected'])
+
+    def test_call_passes_through_expected_errors(self):
+        """Test if passthrough errors are raised and not recorded."""
+        function = Mock(side_effect=InvalidURLError)
+
+        with self.assertRaises(InvalidURLError):
+            self.tested_instance.call(function)
+
+        self.assertEqual(CircuitBreaker.CLOSED, self.breaker.state)
+
+
+class GuardedTesterTest(unittest.TestCase):
+    """Tests for GuardedTester class.
+
+    :ivar tester_mock: a mock of a guarded URL tester
+    :ivar guard_mock: a mock of SourceGuard
+    """
+
+    def setUp(self):
+        reset_degraded()
+        self.tester_mock = Mock()
+        self.guard_mock = Mock()
+        self.guard_mock.call.side_effect = lambda function: function()
+        self.urls = ['http://first.com', 'http://second.com']
+
+    def test_lookup_matching_returns_tester_result(self):
+        """Test if items returned by the tester are returned."""
+        self.tester_mock.lookup_matching.return_value = iter(['item'])
+        tested_instance = GuardedTester(self.tester_mock, self.guard_mock)
+
+        actual = tested_instance.lookup_matching(self.urls)
+
+        self.assertEqual(['item'], actual)
+        self.assertFalse(getattr(actual, 'degraded', False))
+        self.assertFalse(reset_degraded())
+
+    def test_lookup_matching_passes_degraded_result(self):
+        """Test if a partial result of the tester is marked degraded."""
+        self.tester_mock.lookup_matching.return_value = DegradedResult(
+            ['item']
+        )
+        tested_instance = GuardedTester(self.tester_mock, self.guard_mock)
+
+        actual = tested_instance.lookup_matching(self.urls)
+
+        self.assertEqual(['item'], actual)
+        self.assertTrue(actual.degraded)
+        self.assertTrue(reset_degraded())
+
+    def test_lookup_matching_fails_open(self):
+        """Test if no URL is listed when a fail-open tester fails."""
+        self.guard_mock.call.side_effect = SourceUnavailableError
+        tested_instance = GuardedTester(self.tester_mock, self.guard_mock)
+
+        actual = tested_instance.lookup_matching(self.urls)
+
+        self.assertEqual([], actual)
+        self.assertTrue(actual.degraded)
+        self.assertTrue(reset_degraded())
+        self.assertFalse(tested_instance.any_match(self.urls))
+
+    def test_lookup_matching_fails_closed(self):
+        """Test if all URLs are listed when a fail-closed tester fails."""
+        self.guard_mock.call.side_effect = SourceUnavailableError
+        tested_instance = GuardedTester(
+            self.tester_mock,
+            self.guard_mock,
+            fail_open=False
+        )
+
+        actual = tested_instance.lookup_matching(self.urls)
+
+        self.assertEqual(self.urls, [i.value for i in actual])
+        self.assertTrue(all(i.source is tested_instance for i in actual))
+        self.assertTrue(actual.degraded)
+        self.assertEqual(
+            self.urls,
+            tested_instance.filter_matching(self.urls)
+        )
+
+
+class GuardedRedirectResolverTest(unittest.TestCase):
+    """Tests for GuardedRedirectResolver class."""
+
+    def test_get_urls_and_locations_falls_back_to_urls(self):
+        """Test if original URLs are returned when the resolver fails."""
+        guard_mock = Mock()
+        guard_mock.call.side_effect = SourceUnavailableError
+        tested_instance = GuardedRedirectResolver(Mock(), guard_mock)
+        urls = ['http://first.com', 'http://first.com']
+
+        actual = tested_instance.get_urls_and_locations(urls)
+
+        self.assertEqual(['http://first.com'], actual)
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
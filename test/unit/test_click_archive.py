@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Tests for the archive of daily click counts."""
+import datetime
+from tempfile import TemporaryDirectory
+import unittest
+
+from sqlalchemy import (
+    create_engine, BigInteger, Column, DateTime, Integer, MetaData, Table
+)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+else:
+    from url_shortener.click_archive import (
+        ClickArchive, sum_by_alias_and_day, archive_click_counts, to_day
+    )
+
+requires_numpy = unittest.skipUnless(
+    numpy,
+    'NumPy, provided by the analytics extra, is not installed'
+)
+
+
+@requires_numpy
+class SumByAliasAndDayTest(unittest.TestCase):
+    """Tests for sum_by_alias_and_day function."""
+
+    def test_sums_counts(self):
+        """Test if counts of equal aliases and days are summed."""
+        aliases, days, counts = sum_by_alias_and_day(
+            [2, 1, 2, 1, 2],
+            [5, 5, 4, 5, 5],
+            [1, 2, 3, 4, 5]
+        )
+
+        self.assertEqual([1, 2, 2], aliases.tolist())
+        self.assertEqual([5, 4, 5], days.tolist())
+        self.assertEqual([6, 3, 6], counts.tolist())
+
+    def test_accepts_empty_columns(self):
+        """Test if empty columns are returned for empty input."""
+        actual = sum_by_alias_and_day([], [], [])
+
+        self.assertEqual([[], [], []], [c.tolist() for c in actual])
+
+
+@requires_numpy
+class ClickArchiveTest(unittest.TestCase):
+    """Tests for ClickArchive class.
+
+    :ivar jan_31: a number of the day of January 31, 2016
+    :ivar feb_1: a number of the next day
+    :ivar directory: a temporary directory of the archive
+    :ivar tested_instance: an instance of ClickArchive to be tested
+    """
+
+    def setUp(self):
+        self.jan_31 = to_day(datetime.date(2016, 1, 31))
+        self.feb_1 = self.jan_31 + 1
+        self.directory = TemporaryDirectory()
+        self.tested_instance = ClickArchive(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_add_merges_counts(self):
+        """Test if counts added later are summed with stored ones."""
+        self.tested_instance.add([1, 2], [self.jan_31, self.feb_1], [3, 4])
+        self.tested_instance.add([1], [self.jan_31], [5])
+
+        aliases, days, counts = self.tested_instance.load(
+            self.jan_31,
+            self.feb_1
+        )
+
+        self.assertEqual([1, 2], aliases.tolist())
+        self.assertEqual([self.jan_31, self.feb_1], days.tolist())
+        self.assertEqual([8, 4], counts.tolist())
+
+    def test_load_filters_days(self):
+        """Test if only counts from the range of days are loaded."""
+        self.tested_instance.add([1, 1], [self.jan_31, self.feb_1], [3, 4])
+
+        _, days, _ = self.tested_instance.load(self.feb_1, self.feb_1)
+
+        self.assertEqual([self.feb_1], days.tolist())
+
+    def test_top(self):
+        """Test if the most clicked aliases are returned."""
+        self.tested_instance.add(
+            [1, 2, 3, 2],
+            [self.jan_31, self.jan_31, self.feb_1, self.feb_1],
+            [5, 3, 1, 4]
+        )
+
+        actual = self.tested_instance.top(2, self.jan_31, self.feb_1)
+
+        self.assertEqual([(2, 7), (1, 5)], actual)
+
+    def test_time_series(self):
+        """Test if daily counts of an alias are returned for each day."""
+        self.tested_instance.add([1, 2], [self.jan_31, self.jan_31], [5, 3])
+
+        actual = self.tested_instance.time_series(
+            1,
+            self.jan_31 - 1,
+            self.feb_1
+        )
+
+        self.assertEqual([0, 5, 0], actual.tolist())
+
+    def test_add_records_archived_until(self):
+        """Test if the first day that is not archived is recorded."""
+        self.assertIsNone(self.tested_instance.archived_until)
+
+        self.tested_instance.add([], [], [], until=self.feb_1)
+
+        self.assertEqual(self.feb_1, self.tested_instance.archived_until)
+
+
+@requires_numpy
+class ArchiveClickCountsTest(unittest.TestCase):
+    """Tests for archive_click_counts and related functions.
+
+    :ivar engine: an engine connected to an in-memory SQLite database
+    :ivar table: a table of per-minute click counts
+    :ivar directory: a temporary directory of the archive
+    :ivar archive: an instance of ClickArchive
+    """
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.table = Table(
+            'clickCount',
+            MetaData(),
+            Column('alias', BigInteger, primary_key=True),
+            Column('minute', DateTime, primary_key=True),
+            Column('count', Integer, nullable=False)
+        )
+        self.table.create(self.engine)
+        rows = [
+            (1, datetime.datetime(2016, 1, 31, 10), 2),
+            (1, datetime.datetime(2016, 1, 31, 11), 3),
+            (2, datetime.datetime(2016, 2, 1, 10), 4)
+        ]
+        self.engine.execute(
+            self.table.insert(),
+            [dict(zip(('alias', 'minute', 'count'), r)) for r in rows]
+        )
+        self.directory = TemporaryDirectory()
+        self.archive = ClickArchive(self.directory.name)
+        self.feb_1 = to_day(datetime.date(2016, 2, 1))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_archives_days_before_limit(self):
+        """Test if per-minute counts are archived as daily counts."""
+        actual = archive_click_counts(
+            self.engine,
+            self.table,
+            self.archive,
+            self.feb_1,
+            batch_size=1
+        )
+
+        self.assertEqual(2, actual)
+        self.assertEqual(
+            [(1, 5)],
+            self.archive.top(10, self.feb_1 - 1, self.feb_1)
+        )
+
+    def test_does_not_archive_twice(self):
+        """Test if days that have been archived are skipped."""
+        archive_click_counts(self.engine, self.table, self.archive, self.feb_1)
+
+        actual = archive_click_counts(
+            self.engine,
+            self.table,
+            self.archive,
+            self.feb_1 + 1
+        )
+
+        self.assertEqual(1, actual)
+        self.assertEqual(
+            [(1, 5), (2, 4)],
+            self.archive.top(10, self.feb_1 - 1, self.feb_1)
+        )
+
+    def test_prunes_archived_click_counts(self):
+        """Test if only archived counts are deleted."""
+        actual = archive_click_counts(
+            self.engine,
+            self.table,
+            self.archive,
+            self.feb_1,
+            batch_size=1,
+            prune=True
+        )
+
+        self.assertEqual(2, actual)
+        remaining = self.engine.execute(self.table.select()).fetchall()
+        self.assertEqual([2], [row.alias for row in remaining])
+
+    def test_prune_keeps_counts_that_were_not_archived(self):
+        """Test if counts stored late for archived days are kept."""
+        archive_click_counts(self.engine, self.table, self.archive, self.feb_1)
+        self.engine.execute(
+            self.table.insert(),
+            alias=3,
+            minute=datetime.datetime(2016, 1, 31),
+            count=1
+        )
+
+        archive_click_counts(
+            self.engine,
+            self.table,
+            self.archive,
+            self.feb_1 + 1,
+            prune=True
+        )
+
+        remaining = self.engine.execute(self.table.select()).fetchall()
+        self.assertEqual(
+            [1, 1, 3],
+            sorted(row.alias for row in remaining)
+        )
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
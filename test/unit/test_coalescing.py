@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Tests for coalescing of concurrent computations."""
+import asyncio
+import gc
+from threading import Event, Thread
+from time import sleep
+import unittest
+from unittest.mock import Mock
+
+from url_shortener.coalescing import AsyncSingleFlight, SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+    """Tests for SingleFlight class.
+
+    :ivar started: an event set when the tested computation starts
+    :ivar release: an event the tested computation waits for
+    :ivar function_mock: a mock of the tested computation
+    :ivar tested_instance: an instance of SingleFlight to be tested
+    """
+
+    def setUp(self):
+        self.started = Event()
+        self.release = Event()
+
+        def compute(value):
+            self.started.set()
+            self.release.wait(5)
+            return value
+
+        self.function_mock = Mock(side_effect=compute)
+        self.tested_instance = SingleFlight()
+
+    def _call_in_threads(self, number):
+        results = []
+
+        def call():
+            try:
+                results.append(
+                    self.tested_instance.do('key', self.function_mock, 'value')
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                results.append(error)
+
+        threads = [Thread(target=call) for _ in range(number)]
+        threads[0].start()
+        self.started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        sleep(0.1)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_do_coalesces_concurrent_calls(self):
+        """Test if concurrent callers share one computation."""
+        actual = self._call_in_threads(5)
+
+        self.assertEqual(['value'] * 5, actual)
+        self.assertEqual(1, self.function_mock.call_count)
+        self.assertEqual({}, self.tested_instance._calls)
+
+    def test_do_shares_exceptions(self):
+        """Test if an exception is raised for all waiting callers."""
+        error = ValueError()
+
+        def fail(_):
+            self.started.set()
+            self.release.wait(5)
+            raise error
+
+        self.function_mock.side_effect = fail
+        actual = self._call_in_threads(3)
+
+        self.assertEqual([error] * 3, actual)
+
+    def test_do_calls_function_again_after_completion(self):
+        """Test if results are not reused after a computation ends."""
+        self.release.set()
+
+        self.tested_instance.do('key', self.function_mock, 'a')
+        actual = self.tested_instance.do('key', self.function_mock, 'b')
+
+        self.assertEqual('b', actual)
+        self.assertEqual(2, self.function_mock.call_count)
+
+    def test_do_does_not_coalesce_different_keys(self):
+        """Test if computations for different keys are separate."""
+        self.release.set()
+        self.tested_instance.do('a', self.function_mock, 'value')
+        self.tested_instance.do('b', self.function_mock, 'value')
+
+        self.assertEqual(2, self.function_mock.call_count)
+
+
+class AsyncSingleFlightTest(unittest.TestCase):
+    """Tests for AsyncSingleFlight class."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.calls = 0
+        self.tested_instance = AsyncSingleFlight()
+
+    def tearDown(self):
+        self.loop.close()
+
+    async def _compute(self, value):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def _gather(self, *calls):
+        async def gather():
+            return await asyncio.gather(
+                *(self.tested_instance.do(k, self._compute, v)
+                  for k, v in calls),
+                return_exceptions=True
+            )
+        return self.loop.run_until_complete(gather())
+
+    def test_do_coalesces_concurrent_calls(self):
+        """Test if concurrent callers share one computation."""
+        actual = self._gather(('a', 1), ('a', 2), ('b', 3))
+
+        self.assertEqual([1, 1, 3], actual)
+        self.assertEqual(2, self.calls)
+        self.assertEqual(0, len(self.tested_instance))
+
+    def test_do_shares_exceptions(self):
+        """Test if an exception is raised for all waiting callers."""
+        error = ValueError()
+
+        actual = self._gather(('a', error), ('a', 1))
+
+        self.assertEqual([error, error], actual)
+
+    def test_do_retrieves_exception_without_callers(self):
+        """Test if an exception is not logged after callers cancel."""
+        handler = Mock()
+        self.loop.set_exception_handler(handler)
+
+        async def cancel_caller():
+            caller = asyncio.ensure_future(
+                self.tested_instance.do('a', self._compute, ValueError())
+            )
+            await asyncio.sleep(0)
+            caller.cancel()
+            await asyncio.sleep(0.02)
+
+        self.loop.run_until_complete(cancel_caller())
+        gc.collect()
+
+        self.assertFalse(handler.called)
+
+    def test_do_continues_after_cancellation_of_a_caller(self):
+        """Test if cancelling a caller doesn't cancel the computation."""
+        async def cancel_first():
+            first = asyncio.ensure_future(
+                self.tested_instance.do('a', self._compute, 1)
+            )
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(
+                self.tested_instance.do('a', self._compute, 2)
+            )
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        actual = self.loop.run_until_complete(cancel_first())
+
+        self.assertEqual(1, actual)
+        self.assertEqual(1, self.calls)
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
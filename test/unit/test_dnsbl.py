@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Tests for concurrent DNSBL queries."""
+import asyncio
+from collections import Counter
+from socketserver import BaseRequestHandler, UDPServer
+from threading import Thread
+import unittest
+from unittest.mock import patch
+
+import dns.message
+import dns.rcode
+import dns.rrset
+from spam_lists import SPAMHAUS_DBL, SPAMHAUS_ZEN
+from spam_lists.exceptions import InvalidURLError
+
+from url_shortener.dnsbl import (
+    AsyncResolver, DNSBLTester, EventLoopThread, IncompleteLookupError,
+    ResolverError, ResolverTimeout
+)
+
+
+class StubDNSServer(UDPServer):
+    """A DNS server answering queries with configured records.
+
+    :ivar records: a dictionary mapping names to tuples containing
+    a TTL and a list of IPv4 addresses. Other names don't exist.
+    :ivar ignored: a set of names whose queries are not answered
+    :ivar failing: a set of names whose queries are answered with
+    SERVFAIL
+    :ivar queries: a counter of received queries per name
+    """
+
+    class Handler(BaseRequestHandler):
+        """Handles a single query."""
+
+        def handle(self):
+            data, socket = self.request
+            self.server.answer(data, socket, self.client_address)
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), self.Handler)
+        self.records = {}
+        self.ignored = set()
+        self.failing = set()
+        self.queries = Counter()
+        Thread(
+            target=self.serve_forever,
+            args=(0.01,),
+            daemon=True
+        ).start()
+
+    @property
+    def port(self):
+        """Get the port of the server."""
+        return self.server_address[1]
+
+    def answer(self, data, socket, address):
+        """Answer a query."""
+        query = dns.message.from_wire(data)
+        name = query.question[0].name.to_text()
+        self.queries[name] += 1
+        if name in self.ignored:
+            return
+        response = dns.message.make_response(query)
+        if name in self.failing:
+            response.set_rcode(dns.rcode.SERVFAIL)
+        elif name in self.records:
+            ttl, addresses = self.records[name]
+            response.answer.append(
+                dns.rrset.from_text(name, ttl, 'IN', 'A', *addresses)
+            )
+        else:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            response.authority.append(
+                dns.rrset.from_text(
+                    'example.', 300, 'IN', 'SOA',
+                    'ns. admin. 1 3600 600 86400 30'
+                )
+            )
+        socket.sendto(response.to_wire(), address)
+
+    def stop(self):
+        """Stop the server."""
+        self.shutdown()
+        self.server_close()
+
+
+class AsyncResolverTest(unittest.TestCase):
+    """Tests for AsyncResolver class.
+
+    :ivar server: an instance of StubDNSServer
+    :ivar tested_instance: an instance of AsyncResolver to be tested
+    """
+
+    def setUp(self):
+        self.server = StubDNSServer()
+        self.tested_instance = AsyncResolver(
+            ['127.0.0.1'],
+            port=self.server.port,
+            retry_interval=0.1,
+            attempts=2
+        )
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        self.server.stop()
+
+    def _resolve(self, *names):
+        return self.loop.run_until_complete(
+            asyncio.gather(*(self.tested_instance.resolve(n) for n in names))
+        )
+
+    def test_resolve_returns_addresses(self):
+        """Test if addresses of a name are returned."""
+        self.server.records['a.example.'] = (60, ['127.0.0.2', '127.0.0.4'])
+
+        actual, = self._resolve('a.example')
+
+        self.assertCountEqual(('127.0.0.2', '127.0.0.4'), actual)
+
+    def test_resolve_returns_empty_tuple_for_missing_name(self):
+        """Test if no addresses are returned for a missing name."""
+        actual, = self._resolve('a.example')
+
+        self.assertEqual((), actual)
+
+    def test_resolve_caches_answers(self):
+        """Test if answers are cached until their TTL passes."""
+        self.server.records['a.example.'] = (60, ['127.0.0.2'])
+        self._resolve('a.example', 'b.example')
+
+        with patch('url_shortener.dnsbl.monotonic') as monotonic_mock:
+            monotonic_mock.return_value = 10 ** 9
+            self._resolve('a.example')
+
+        self._resolve('a.example', 'b.example')
+
+        self.assertEqual(2, self.server.queries['a.example.'])
+        self.assertEqual(1, self.server.queries['b.example.'])
+
+    def test_resolve_coalesces_identical_queries(self):
+        """Test if one query is sent for concurrently resolved names."""
+        self.server.records['a.example.'] = (0, ['127.0.0.2'])
+
+        actual = self._resolve('a.example', 'A.example.', 'a.example')
+
+        self.assertEqual([('127.0.0.2',)] * 3, actual)
+        self.assertEqual(1, self.server.queries['a.example.'])
+
+    def test_resolve_retries_and_raises_timeout(self):
+        """Test if ResolverTimeout is raised when there is no answer."""
+        self.server.ignored.add('a.example.')
+
+        with self.assertRaises(ResolverTimeout):
+            self._resolve('a.example')
+        self.assertEqual(2, self.server.queries['a.example.'])
+
+    def test_resolve_raises_error(self):
+        """Test if ResolverError is raised for a failure response."""
+        self.server.failing.add('a.example.')
+
+        with self.assertRaises(ResolverError):
+            self._resolve('a.example')
+
+
+class DNSBLTesterTest(unittest.TestCase):
+    """Tests for DNSBLTester class.
+
+    :ivar server: an instance of StubDNSServer
+    :ivar tested_instance: an instance of DNSBLTester to be tested
+    """
+
+    loop_thread = EventLoopThread()
+
+    def setUp(self):
+        self.server = StubDNSServer()
+        self.tested_instance = DNSBLTester(
+            (SPAMHAUS_ZEN, SPAMHAUS_DBL),
+            AsyncResolver(
+                ['127.0.0.1'],
+                port=self.server.port,
+                retry_interval=0.1,
+                attempts=5
+            ),
+            0.25,
+            self.loop_thread
+        )
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_lookup_matching_returns_listed_hosts(self):
+        """Test if items are returned for listed hosts of all services."""
+        self.server.records['spam.com.dbl.spamhaus.org.'] = (
+            60, ['127.0.1.2', '127.0.1.4']
+        )
+        self.server.records['2.0.0.127.zen.spamhaus.org.'] = (
+            60, ['127.0.0.2']
+        )
+
+        actual = self.tested_instance.lookup_matching([
+            'http://127.0.0.2/a',
+            'http://www.spam.com',
+            'http://spam.com/b',
+            'http://good.com'
+        ])
+
+        self.assertEqual(
+            [
+                ('127.0.0.2', SPAMHAUS_ZEN),
+                ('spam.com', SPAMHAUS_DBL)
+            ],
+            [(i.value, i.source) for i in actual]
+        )
+        self.assertEqual(
+            {'spam domain', 'phishing domain'},
+            actual[1].classification
+        )
+        self.assertEqual(1, self.server.queries['spam.com.dbl.spamhaus.org.'])
+
+    def test_lookup_matching_enforces_budget(self):
+        """Test if unanswered queries cause an error."""
+        self.server.ignored.add('slow.com.dbl.spamhaus.org.')
+
+        with self.assertRaises(IncompleteLookupError):
+            self.tested_instance.lookup_matching(['http://slow.com'])
+
+    def test_lookup_matching_returns_partial_result(self):
+        """Test if listed hosts are returned despite failed queries."""
+        self.server.records['spam.com.dbl.spamhaus.org.'] = (60, ['127.0.1.2'])
+        self.server.ignored.add('slow.com.dbl.spamhaus.org.')
+
+        actual = self.tested_instance.lookup_matching(
+            ['http://slow.com', 'http://spam.com']
+        )
+
+        self.assertEqual(['spam.com'], [i.value for i in actual])
+        self.assertTrue(actual.degraded)
+
+    def test_filter_matching_returns_partial_result(self):
+        """Test if URLs with listed hosts are returned despite errors."""
+        self.server.records['spam.com.dbl.spamhaus.org.'] = (60, ['127.0.1.2'])
+        self.server.failing.add('bad.com.dbl.spamhaus.org.')
+
+        actual = self.tested_instance.filter_matching(
+            ['http://bad.com', 'http://spam.com']
+        )
+
+        self.assertEqual(['http://spam.com'], actual)
+        self.assertTrue(actual.degraded)
+
+    def test_lookup_matching_raises_error_for_failed_query(self):
+        """Test if an error of a nameserver causes an error."""
+        self.server.failing.add('bad.com.dbl.spamhaus.org.')
+
+        with self.assertRaises(IncompleteLookupError):
+            self.tested_instance.filter_matching(['http://bad.com'])
+
+    def test_filter_matching(self):
+        """Test if URLs with listed hosts are returned."""
+        self.server.records['spam.com.dbl.spamhaus.org.'] = (60, ['127.0.1.2'])
+        urls = ['http://spam.com/a', 'http://good.com', 'http://spam.com/b']
+
+        actual = self.tested_instance.filter_matching(urls)
+
+        self.assertEqual([urls[0], urls[2]], actual)
+
+    def test_lookup_matching_raises_InvalidURLError(self):
+        """Test if InvalidURLError is raised for invalid URLs."""
+        with self.assertRaises(InvalidURLError):
+            self.tested_instance.lookup_matching(['invalid'])
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -3,17 +3,32 @@
 """Tests for domain and persistence-related classes and functions."""
 # pylint: disable=C0103
 from collections import OrderedDict
+import sqlite3
 import unittest
-from unittest.mock import Mock, patch, MagicMock
+import os
+from tempfile import TemporaryDirectory
+from unittest.mock import Mock, patch, MagicMock, call
 
+from flask import Flask, url_for
 from nose_parameterized import parameterized
+from sqlalchemy import create_engine, Column, Integer, MetaData, String, Table
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.exc import MultipleResultsFound
+from werkzeug.exceptions import NotFound
 
 from url_shortener.domain_and_persistence import (
     AliasValueError, AliasLengthValueError, IntegrityError, get_commit_changes,
-    AlphabetValueError, CharacterValueError, IntegerAlias, BaseTargetURL,
-    homoglyph_replacement_map, AliasFactory
+    AlphabetValueError, CharacterValueError, IntegerAlias, BigIntegerAlias,
+    LengthAwareAlias, get_alias_type, BaseTargetURL,
+    homoglyph_replacement_map, AliasFactory, PoolWaitMonitor,
+    MonitoredQueuePool, ConfiguredSQLAlchemy, HashRing,
+    ShardRouter, BaseShardedTargetURL, rebalance_shards, TargetURLRecord,
+    URLTemplate
 )
+from url_shortener.views import url_shortener
 
 
 class HomoglyphReplacementMapTest(unittest.TestCase):
@@ -291,6 +306,19 @@ class IntegerAliasTest(unittest.TestCase):
             Mock()
         )
 
+    def test_process_bind_param_raises_error_for_too_long_alias(self):
+        """Test if AliasValueError is raised for a too large integer."""
+        string = '9' * 10
+        self.alias_factory_mock.from_string.return_value = string
+        self.alphabet_mock.index.return_value = 9
+
+        self.assertRaises(
+            AliasValueError,
+            self.tested_instance.process_bind_param,
+            string,
+            Mock()
+        )
+
     def test_process_result_value(self):
         """Test if the method converts an integer to a string."""
         value = 3241
@@ -300,6 +328,148 @@ class IntegerAliasTest(unittest.TestCase):
         self.assertEqual(expected, actual)
 
 
+class BigIntegerAliasTest(unittest.TestCase):
+    """Tests for BigIntegerAlias class.
+
+    :ivar alias_factory: an instance of AliasFactory used by
+    the tested instance
+    :ivar tested_instance: an instance of BigIntegerAlias to be tested
+    """
+
+    def setUp(self):
+        self.alias_factory = AliasFactory('0123456789acdefh', 1, 15)
+        self.tested_instance = BigIntegerAlias(self.alias_factory)
+
+    def test_init_raises_alphabet_value_error(self):
+        """Test if aliases exceeding max int64 are refused."""
+        alias_factory = AliasFactory('0123456789acdefh', 1, 16)
+
+        self.assertRaises(
+            AlphabetValueError,
+            BigIntegerAlias,
+            alias_factory
+        )
+
+    def test_process_bind_param_matches_integer_alias(self):
+        """Test if integers stored by IntegerAlias remain valid."""
+        alias_factory = AliasFactory('0123456789acdefh', 1, 7)
+        expected = IntegerAlias(alias_factory).process_bind_param(
+            '0a7',
+            Mock()
+        )
+
+        actual = self.tested_instance.process_bind_param('0a7', Mock())
+
+        self.assertEqual(expected, actual)
+
+    def test_process_bind_param_for_long_alias(self):
+        """Test if aliases exceeding max int32 can be stored."""
+        actual = self.tested_instance.process_bind_param('h' * 15, Mock())
+
+        self.assertEqual(16**15 - 1, actual)
+
+    def test_process_result_value_strips_leading_zeros(self):
+        """Test if an alias is read back without leading zeros."""
+        integer = self.tested_instance.process_bind_param('007', Mock())
+
+        actual = self.tested_instance.process_result_value(integer, Mock())
+
+        self.assertEqual('7', actual)
+
+
+class LengthAwareAliasTest(unittest.TestCase):
+    """Tests for LengthAwareAlias class.
+
+    :ivar alias_factory: an instance of AliasFactory used by
+    the tested instance
+    :ivar tested_instance: an instance of LengthAwareAlias to be tested
+    """
+
+    def setUp(self):
+        self.alias_factory = AliasFactory('0123456789acdefh', 1, 15)
+        self.tested_instance = LengthAwareAlias(self.alias_factory)
+
+    def test_init_raises_alphabet_value_error(self):
+        """Test if too long aliases are refused.
+
+        With 16 characters in the alphabet, the number of aliases
+        up to 16 characters long exceeds max int64.
+        """
+        alias_factory = AliasFactory('0123456789acdefh', 1, 16)
+
+        self.assertRaises(
+            AlphabetValueError,
+            LengthAwareAlias,
+            alias_factory
+        )
+
+    @parameterized.expand([
+        ('one_character', '0', 0),
+        ('leading_zero', '00', 16),
+        ('second_length', '01', 17),
+        ('third_length', '000', 16 + 256)
+    ])
+    def test_process_bind_param_for(self, _, alias, expected):
+        """Test if aliases of different lengths are distinct."""
+        actual = self.tested_instance.process_bind_param(alias, Mock())
+
+        self.assertEqual(expected, actual)
+
+    @parameterized.expand([
+        ('empty', ''),
+        ('too_long', 'h' * 16)
+    ])
+    def test_process_bind_param_raises_alias_value_error_for(self, _, alias):
+        """Test if AliasValueError is raised for an invalid alias."""
+        self.assertRaises(
+            AliasValueError,
+            self.tested_instance.process_bind_param,
+            alias,
+            Mock()
+        )
+
+    @parameterized.expand([
+        ('one_character', '0'),
+        ('leading_zeros', '0007'),
+        ('last_of_length', 'hh'),
+        ('max_length', 'h' * 15)
+    ])
+    def test_process_result_value_reverses_bind_for(self, _, alias):
+        """Test if an integer is converted back to its alias."""
+        integer = self.tested_instance.process_bind_param(alias, Mock())
+
+        actual = self.tested_instance.process_result_value(integer, Mock())
+
+        self.assertEqual(alias, actual)
+
+
+class GetAliasTypeTest(unittest.TestCase):
+    """Tests for get_alias_type function."""
+
+    @parameterized.expand([
+        ('positional', BigIntegerAlias),
+        ('length_aware', LengthAwareAlias)
+    ])
+    def test_returns(self, encoding, expected):
+        """Test if an alias type is returned for a known encoding.
+
+        :param encoding: a name of the encoding
+        :param expected: the expected class of the alias type
+        """
+        actual = get_alias_type(encoding, AliasFactory('0123456789', 1, 5))
+
+        self.assertIsInstance(actual, expected)
+
+    def test_raises_value_error(self):
+        """Test if ValueError is raised for an unknown encoding."""
+        self.assertRaises(
+            ValueError,
+            get_alias_type,
+            'unknown',
+            AliasFactory('0123456789', 1, 5)
+        )
+
+
 class BaseTargetURLTest(unittest.TestCase):
     """Tests for BaseTargetURL class.
 
@@ -400,6 +570,607 @@ class BaseTargetURLTest(unittest.TestCase):
         )
 
 
+class BaseTargetURLReplicaTest(unittest.TestCase):
+    """Tests for lookups of BaseTargetURL performed on read replicas.
+
+    :ivar session_mock: a mock of the primary database session
+    :ivar replica_mocks: mocks of sessions connected to replicas
+    """
+
+    def setUp(self):
+        self.session_mock = MagicMock(spec=['query', 'add', 'no_autoflush'])
+        self.replica_mocks = (Mock(), Mock())
+        BaseTargetURL._session = self.session_mock
+        BaseTargetURL._replica_sessions = self.replica_mocks
+
+    def tearDown(self):
+        BaseTargetURL._session = None
+        BaseTargetURL._replica_sessions = ()
+        BaseTargetURL._recent_aliases = None
+
+    @staticmethod
+    def _get(session_mock):
+        return session_mock.query.return_value.get
+
+    def test_get_or_404_uses_replicas_in_turns(self):
+        """Test if subsequent lookups are performed on other replicas."""
+        BaseTargetURL.get_or_404('abc')
+        BaseTargetURL.get_or_404('abc')
+
+        for replica_mock in self.replica_mocks:
+            self._get(replica_mock).assert_called_once_with('abc')
+        self.assertFalse(self.session_mock.query.called)
+
+    def test_get_or_404_returns_url_from_replica(self):
+        """Test if a target URL found on a replica is returned."""
+        for replica_mock in self.replica_mocks:
+            self._get(replica_mock).return_value = 'target URL'
+
+        self.assertEqual('target URL', BaseTargetURL.get_or_404('abc'))
+
+    def test_get_or_404_falls_back_to_primary(self):
+        """Test if the primary database is used for a recent alias."""
+        for replica_mock in self.replica_mocks:
+            self._get(replica_mock).return_value = None
+        BaseTargetURL._recent_aliases = {'abc': True}
+        expected = self._get(self.session_mock).return_value
+
+        actual = BaseTargetURL.get_or_404('abc')
+
+        self.assertEqual(expected, actual)
+        self._get(self.session_mock).assert_called_once_with('abc')
+
+    def test_get_or_404_skips_primary_for_old_alias(self):
+        """Test if a replica miss of an old alias is final."""
+        for replica_mock in self.replica_mocks:
+            self._get(replica_mock).return_value = None
+        BaseTargetURL._recent_aliases = {'xyz': True}
+
+        self.assertRaises(NotFound, BaseTargetURL.get_or_404, 'abc')
+        self.assertFalse(self.session_mock.query.called)
+
+    def test_get_or_404_raises_not_found(self):
+        """Test if NotFound is raised for a missing target URL."""
+        for session_mock in self.replica_mocks + (self.session_mock,):
+            self._get(session_mock).return_value = None
+
+        self.assertRaises(NotFound, BaseTargetURL.get_or_404, 'abc')
+
+    def test_get_or_create_checks_replica_first(self):
+        """Test if a target URL found on a replica is reused."""
+        for replica_mock in self.replica_mocks:
+            filtered = replica_mock.query.return_value.filter_by.return_value
+            filtered.one_or_none.return_value = 'target URL'
+
+        actual = BaseTargetURL.get_or_create('http://xyz.com')
+
+        self.assertEqual('target URL', actual)
+        self.assertFalse(self.session_mock.query.called)
+        self.assertFalse(self.session_mock.add.called)
+
+    def test_get_or_create_checks_primary_after_replica(self):
+        """Test if the primary database is queried after replica miss."""
+        for replica_mock in self.replica_mocks:
+            filtered = replica_mock.query.return_value.filter_by.return_value
+            filtered.one_or_none.return_value = None
+        filtered = self.session_mock.query.return_value.filter_by()
+        filtered.one_or_none.return_value = None
+
+        target_url = BaseTargetURL.get_or_create('http://xyz.com')
+
+        self.session_mock.add.assert_called_once_with(target_url)
+
+
+class BaseTargetURLRecordTest(unittest.TestCase):
+    """Tests for lookups of read-only records of target URLs.
+
+    :ivar target_url_cls: a subclass of BaseTargetURL with a table
+    stored in an in-memory SQLite database
+    """
+
+    def setUp(self):
+        table = Table(
+            'targetURL',
+            MetaData(),
+            Column('alias', String, primary_key=True),
+            Column('value', String)
+        )
+        engine = create_engine('sqlite://')
+        table.create(engine)
+        engine.execute(table.insert(), alias='abc', value='http://x.com')
+        engine.execute(table.insert(), alias='def', value='http://y.com')
+
+        class TargetURL(BaseTargetURL):
+            __table__ = table
+            _session = sessionmaker(bind=engine)()
+
+        self.target_url_cls = TargetURL
+
+    def test_get_record_or_404_returns_record(self):
+        """Test if a record of a stored target URL is returned."""
+        actual = self.target_url_cls.get_record_or_404('abc')
+
+        self.assertEqual(TargetURLRecord('abc', 'http://x.com'), actual)
+        self.assertEqual('http://x.com', str(actual))
+
+    def test_get_record_or_404_raises_not_found(self):
+        """Test if NotFound is raised for a missing target URL."""
+        self.assertRaises(
+            NotFound,
+            self.target_url_cls.get_record_or_404,
+            'xyz'
+        )
+
+    def test_get_record_or_404_uses_replica(self):
+        """Test if a record found on a replica is returned."""
+        replica_mock = Mock()
+        replica_mock.execute.return_value.first.return_value = (
+            'abc', 'http://replica.com'
+        )
+        self.target_url_cls._replica_sessions = (replica_mock,)
+
+        actual = self.target_url_cls.get_record_or_404('abc')
+
+        self.assertEqual('http://replica.com', actual.value)
+
+    def test_get_record_or_404_falls_back_to_primary(self):
+        """Test if the primary database is used for a recent alias."""
+        replica_mock = Mock()
+        replica_mock.execute.return_value.first.return_value = None
+        self.target_url_cls._replica_sessions = (replica_mock,)
+        self.target_url_cls._recent_aliases = {'abc': True}
+
+        actual = self.target_url_cls.get_record_or_404('abc')
+
+        self.assertEqual('http://x.com', actual.value)
+
+    def test_get_record_or_404_skips_primary_for_old_alias(self):
+        """Test if a replica miss of an old alias is final."""
+        replica_mock = Mock()
+        replica_mock.execute.return_value.first.return_value = None
+        self.target_url_cls._replica_sessions = (replica_mock,)
+        self.target_url_cls._session = Mock()
+
+        self.assertRaises(
+            NotFound,
+            self.target_url_cls.get_record_or_404,
+            'abc'
+        )
+        self.assertFalse(self.target_url_cls._session.execute.called)
+
+    def test_get_records_returns_existing_records(self):
+        """Test if records of existing target URLs are returned."""
+        actual = self.target_url_cls.get_records(['abc', 'def', 'xyz'])
+
+        self.assertEqual(
+            {TargetURLRecord('abc', 'http://x.com'),
+             TargetURLRecord('def', 'http://y.com')},
+            set(actual)
+        )
+
+    def test_get_records_returns_empty_list(self):
+        """Test if the database is not queried without aliases."""
+        self.target_url_cls._session = Mock()
+
+        self.assertEqual([], self.target_url_cls.get_records([]))
+        self.assertFalse(self.target_url_cls._session.execute.called)
+
+    def test_get_records_selects_missing_records_on_primary(self):
+        """Test if recent aliases missing on a replica are selected."""
+        replica_mock = Mock()
+        replica_mock.execute.return_value = [('abc', 'http://replica.com')]
+        self.target_url_cls._replica_sessions = (replica_mock,)
+        self.target_url_cls._recent_aliases = {'def': True}
+
+        actual = self.target_url_cls.get_records(['abc', 'def', 'xyz'])
+
+        self.assertEqual(
+            [TargetURLRecord('abc', 'http://replica.com'),
+             TargetURLRecord('def', 'http://y.com')],
+            actual
+        )
+
+    def test_get_records_skips_primary_for_old_aliases(self):
+        """Test if old aliases missing on a replica are not selected."""
+        replica_mock = Mock()
+        replica_mock.execute.return_value = [('abc', 'http://replica.com')]
+        self.target_url_cls._replica_sessions = (replica_mock,)
+        self.target_url_cls._session = Mock()
+
+        actual = self.target_url_cls.get_records(['abc', 'def'])
+
+        self.assertEqual(
+            [TargetURLRecord('abc', 'http://replica.com')],
+            actual
+        )
+        self.assertFalse(self.target_url_cls._session.execute.called)
+
+    def test_sharded_get_records_queries_each_shard_once(self):
+        """Test if aliases are selected in one query per shard."""
+        router_mock = Mock()
+        router_mock.get_shard_for_alias.side_effect = lambda a: a[0]
+        session_mock = Mock()
+        session_mock.execute.return_value = [('abc', 'x')]
+
+        class ShardedTargetURL(BaseShardedTargetURL):
+            __table__ = self.target_url_cls.__table__
+            _session = session_mock
+            _shard_router = router_mock
+
+        ShardedTargetURL.get_records(['abc', 'acd', 'bcd'])
+
+        self.assertEqual(
+            [(['abc', 'acd'], 'a'), (['bcd'], 'b')],
+            [
+                (c[0][1]['aliases'], c[1]['shard_id'])
+                for c in session_mock.execute.call_args_list
+            ]
+        )
+
+    def test_sharded_lookup_uses_shard_of_alias(self):
+        """Test if a record is selected on the shard of its alias."""
+        router_mock = Mock()
+        session_mock = Mock()
+        session_mock.execute.return_value.first.return_value = ('abc', 'x')
+
+        class ShardedTargetURL(BaseShardedTargetURL):
+            __table__ = self.target_url_cls.__table__
+            _session = session_mock
+            _shard_router = router_mock
+
+        ShardedTargetURL.get_record_or_404('abc')
+
+        kwargs = session_mock.execute.call_args[1]
+        self.assertEqual(
+            router_mock.get_shard_for_alias.return_value,
+            kwargs['shard_id']
+        )
+        router_mock.get_shard_for_alias.assert_called_once_with('abc')
+
+
+class TargetURLRecordTest(unittest.TestCase):
+    """Tests for TargetURLRecord class.
+
+    :ivar app: a Flask application with registered views
+    """
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(url_shortener)
+
+    @parameterized.expand([
+        ('short_url', 'url_shortener.redirect_for'),
+        ('preview_url', 'url_shortener.preview')
+    ])
+    def test_url_matches_url_for(self, attribute, endpoint):
+        """Test if URLs built from prefixes match results of url_for.
+
+        :param attribute: a name of a property returning the URL
+        :param endpoint: an endpoint of the URL
+        """
+        record = TargetURLRecord('abc', 'http://x.com')
+        for base_url in 'http://a.com/', 'https://b.com/root/':
+            with self.app.test_request_context(base_url=base_url):
+                expected = url_for(endpoint, _external=True, alias='abc')
+
+                self.assertEqual(expected, getattr(record, attribute))
+
+    def test_record_has_no_instance_dictionary(self):
+        """Test if records don't allocate instance dictionaries."""
+        record = TargetURLRecord('abc', 'http://x.com')
+
+        self.assertFalse(hasattr(record, '__dict__'))
+
+
+class URLTemplateTest(unittest.TestCase):
+    """Tests for URLTemplate class and batch URL building.
+
+    :cvar ALIASES: aliases for which URLs are built
+    :ivar app: a Flask application with registered views
+    """
+
+    ALIASES = ['abc', 'x0', 'qwerty', '012345']
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(url_shortener)
+        self.app.add_url_rule(
+            '/info/<alias>/details',
+            'details',
+            lambda alias: alias
+        )
+
+    def _url_for_all(self, endpoint):
+        return [
+            url_for(endpoint, _external=True, alias=a) for a in self.ALIASES
+        ]
+
+    @parameterized.expand([
+        ('short_urls_for', 'url_shortener.redirect_for'),
+        ('preview_urls_for', 'url_shortener.preview')
+    ])
+    def test_urls_for_match_url_for(self, method, endpoint):
+        """Test if batch-built URLs match results of url_for.
+
+        :param method: a name of a method of BaseTargetURL building
+        the URLs
+        :param endpoint: an endpoint of the URLs
+        """
+        for base_url in 'http://a.com/', 'https://b.com:8080/root/':
+            with self.app.test_request_context(base_url=base_url):
+                actual = getattr(BaseTargetURL, method)(self.ALIASES)
+
+                self.assertEqual(self._url_for_all(endpoint), actual)
+
+    def test_short_urls_for_uses_server_name(self):
+        """Test if URLs are built for the server name outside requests."""
+        self.app.config['SERVER_NAME'] = 'short.com'
+        with self.app.app_context():
+            actual = BaseTargetURL.short_urls_for(self.ALIASES)
+
+            expected = self._url_for_all('url_shortener.redirect_for')
+        self.assertEqual(expected, actual)
+        self.assertTrue(actual[0].startswith('http://short.com/'))
+
+    def test_compile_supports_suffix(self):
+        """Test if URLs with a part following the alias are built."""
+        with self.app.test_request_context():
+            template = URLTemplate.compile('details')
+
+            self.assertEqual('/details', template.suffix)
+            self.assertEqual(
+                self._url_for_all('details'),
+                template.build_all(self.ALIASES)
+            )
+
+
+class HashRingTest(unittest.TestCase):
+    """Tests for HashRing class."""
+
+    KEYS = [str(i) for i in range(1000)]
+
+    def test_requires_nodes(self):
+        """Test if ValueError is raised for an empty list of nodes."""
+        self.assertRaises(ValueError, HashRing, [])
+
+    def test_get_node_is_stable(self):
+        """Test if rings with the same nodes assign keys the same way."""
+        first = HashRing(['a', 'b', 'c'])
+        second = HashRing(['c', 'b', 'a'])
+
+        for key in self.KEYS:
+            self.assertEqual(first.get_node(key), second.get_node(key))
+
+    def test_get_node_uses_all_nodes(self):
+        """Test if keys are distributed between all nodes."""
+        ring = HashRing(['a', 'b', 'c'])
+
+        nodes = {ring.get_node(key) for key in self.KEYS}
+
+        self.assertEqual({'a', 'b', 'c'}, nodes)
+
+    def test_adding_node_moves_keys_only_to_it(self):
+        """Test if a new node takes keys only from other nodes."""
+        old_ring = HashRing(['a', 'b', 'c'])
+        new_ring = HashRing(['a', 'b', 'c', 'd'])
+
+        for key in self.KEYS:
+            new_node = new_ring.get_node(key)
+            if new_node != old_ring.get_node(key):
+                self.assertEqual('d', new_node)
+
+
+class ShardRouterTest(unittest.TestCase):
+    """Tests for ShardRouter class.
+
+    :ivar alias_factory: an instance of AliasFactory used by
+    the tested instance
+    :ivar tested_instance: an instance of ShardRouter to be tested
+    """
+
+    def setUp(self):
+        self.alias_factory = AliasFactory('0123456789abcdef', 3, 4)
+        self.tested_instance = ShardRouter(
+            HashRing(['a', 'b', 'c']),
+            IntegerAlias(self.alias_factory),
+            self.alias_factory
+        )
+
+    def test_get_shard_for_alias_uses_integer(self):
+        """Test if equivalent alias strings are assigned to one shard.
+
+        Aliases are converted to the same integers, and therefore
+        assigned to the same shards, regardless of homoglyphs used
+        in them.
+        """
+        get_shard_for_alias = self.tested_instance.get_shard_for_alias
+
+        self.assertEqual(get_shard_for_alias('a0'), get_shard_for_alias('aO'))
+
+    def test_create_alias_matches_shard_of_value(self):
+        """Test if a new alias is assigned to the shard of the value."""
+        context = Mock()
+        for i in range(50):
+            value = 'http://example{}.com'.format(i)
+            context.current_parameters = {'value': value}
+
+            alias = self.tested_instance.create_alias(context)
+
+            self.assertEqual(
+                self.tested_instance.get_shard_for_value(value),
+                self.tested_instance.get_shard_for_alias(alias)
+            )
+
+
+class BaseShardedTargetURLTest(unittest.TestCase):
+    """Tests for BaseShardedTargetURL class.
+
+    :ivar session_mock: a mock of sharded database session
+    """
+
+    def setUp(self):
+        self.session_mock = MagicMock(spec=['query', 'add', 'no_autoflush'])
+        BaseShardedTargetURL._session = self.session_mock
+        BaseShardedTargetURL._shard_router = Mock()
+
+    def tearDown(self):
+        BaseShardedTargetURL._session = None
+        BaseShardedTargetURL._shard_router = None
+
+    def test_get_or_create_queries_shard_of_value(self):
+        """Test if a target URL is looked up on a single shard."""
+        router_mock = BaseShardedTargetURL._shard_router
+        set_shard_mock = self.session_mock.query.return_value.set_shard
+        filtered = set_shard_mock.return_value.filter_by.return_value
+
+        actual = BaseShardedTargetURL.get_or_create('http://xyz.com')
+
+        router_mock.get_shard_for_value.assert_called_once_with(
+            'http://xyz.com'
+        )
+        set_shard_mock.assert_called_once_with(
+            router_mock.get_shard_for_value.return_value
+        )
+        self.assertEqual(filtered.one_or_none.return_value, actual)
+
+
+class RebalanceShardsTest(unittest.TestCase):
+    """Tests for rebalance_shards function.
+
+    :ivar directory: a temporary directory containing database files
+    :ivar table: a table of target URLs
+    :ivar engines: a dictionary mapping names of shards to engines
+    connected to SQLite databases
+    """
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.table = Table(
+            'targetURL',
+            MetaData(),
+            Column('alias', Integer, primary_key=True),
+            Column('value', String(2083), unique=True, nullable=False)
+        )
+        self.engines = {}
+        for name in 'abc':
+            path = os.path.join(self.directory.name, name + '.db')
+            engine = create_engine('sqlite:///' + path)
+            self.table.create(engine)
+            self.engines[name] = engine
+
+    def tearDown(self):
+        for engine in self.engines.values():
+            engine.dispose()
+        self.directory.cleanup()
+
+    def _get_rows(self, name):
+        rows = self.engines[name].execute(self.table.select())
+        return {tuple(row) for row in rows}
+
+    def test_moves_rows_to_assigned_shards(self):
+        """Test if all rows end on shards assigned to their aliases."""
+        rows = [(i, 'http://example{}.com'.format(i)) for i in range(100)]
+        self.engines['a'].execute(
+            self.table.insert(),
+            [{'alias': a, 'value': v} for a, v in rows]
+        )
+        ring = HashRing(['b', 'c'])
+
+        moved = rebalance_shards(ring, self.engines, self.table, 7)
+
+        self.assertEqual(100, moved)
+        self.assertEqual(set(), self._get_rows('a'))
+        for name in 'bc':
+            expected = {r for r in rows if ring.get_node(str(r[0])) == name}
+            self.assertEqual(expected, self._get_rows(name))
+
+    def test_keeps_rows_on_assigned_shards(self):
+        """Test if rows already on their shards are not moved."""
+        ring = HashRing(['a', 'b', 'c'])
+        row = {'alias': 1, 'value': 'http://example.com'}
+        self.engines[ring.get_node('1')].execute(self.table.insert(), row)
+
+        moved = rebalance_shards(ring, self.engines, self.table)
+
+        self.assertEqual(0, moved)
+
+
+class ShardedShorteningTest(unittest.TestCase):
+    """Tests for shortening URLs stored on rebalanced shards.
+
+    :ivar directory: a temporary directory containing database files
+    :ivar engines: a dictionary mapping names of shards to engines
+    connected to SQLite databases
+    :ivar router: an instance of ShardRouter used by target URLs
+    :ivar target_url_cls: a subclass of BaseShardedTargetURL stored on
+    the shards
+    """
+
+    VALUES = ['http://example{}.com'.format(i) for i in range(30)]
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.engines = {
+            name: create_engine(
+                'sqlite:///' + os.path.join(self.directory.name, name)
+            )
+            for name in 'abc'
+        }
+        alias_factory = AliasFactory('0123456789abcdef', 6, 7)
+        self.router = ShardRouter(
+            HashRing(['a', 'b']),
+            IntegerAlias(alias_factory),
+            alias_factory
+        )
+
+        class TargetURL(BaseShardedTargetURL, declarative_base()):
+            __tablename__ = 'targetURL'
+            _shard_router = self.router
+            _alias = Column(
+                'alias',
+                IntegerAlias(alias_factory),
+                primary_key=True,
+                default=self.router.create_alias
+            )
+            _value = Column('value', String(2083), unique=True)
+
+        for engine in self.engines.values():
+            TargetURL.__table__.create(engine)
+        self.target_url_cls = TargetURL
+
+    def tearDown(self):
+        for engine in self.engines.values():
+            engine.dispose()
+        self.directory.cleanup()
+
+    def _shorten(self):
+        session = self.router.get_session_factory(self.engines)()
+        self.target_url_cls._session = session
+        target_urls = [
+            self.target_url_cls.get_or_create(v) for v in self.VALUES
+        ]
+        new = len(session.new)
+        session.commit()
+        aliases = [t._alias for t in target_urls]
+        session.close()
+        return aliases, new
+
+    def test_get_or_create_finds_moved_target_urls(self):
+        """Test if URLs are not stored again after rebalancing."""
+        expected, _ = self._shorten()
+        self.router.ring = HashRing(['a', 'b', 'c'])
+        rebalance_shards(
+            self.router.ring,
+            self.engines,
+            self.target_url_cls.__table__
+        )
+
+        actual, new = self._shorten()
+
+        self.assertEqual(expected, actual)
+        self.assertEqual(0, new)
+
+
 class TestGetCommitChanges(unittest.TestCase):
     """Tests for get_commit_changes function and its return value.
 
@@ -413,6 +1184,8 @@ class TestGetCommitChanges(unittest.TestCase):
     by the tested function
     :ivar logger_mock: a mock of a logger instance to be used by
     the tested function
+    :ivar caches_mock: a mock of a cache registry to be notified about
+    stored target URLs
     :ivar commit_changes: a function to be tested - a return value
     of get_commit_changes
     """
@@ -426,15 +1199,20 @@ class TestGetCommitChanges(unittest.TestCase):
     ]
 
     def setUp(self):
-        db_mock = Mock()
-        self.session_mock = db_mock.session
+        self.session_mock = Mock()
+        self.session_mock.new = [Mock()]
 
         app_mock = Mock()
         app_mock.config = {}
         app_mock.config['INTEGRITY_ERROR_LIMIT'] = self.LIMIT
         self.logger_mock = app_mock.logger.warning
+        self.caches_mock = Mock()
 
-        self.commit_changes = get_commit_changes(app_mock, db_mock)
+        self.commit_changes = get_commit_changes(
+            app_mock,
+            self.session_mock,
+            self.caches_mock
+        )
 
     def _call(self, integrity_error_count):
         """Call the tested function.
@@ -477,6 +1255,22 @@ class TestGetCommitChanges(unittest.TestCase):
             integrity_error_count
         )
 
+    @parameterized.expand(TEST_PARAMS)
+    def test_adds_pending_urls_again_for(self, _, integrity_error_count):
+        """Test if pending target URLs are added again after rollback.
+
+        :param integrity_error_count: a number of integrity errors to
+        be raised by database session commit method.
+        """
+        pending = self.session_mock.new
+
+        self._call(integrity_error_count)
+
+        self.assertEqual(
+            self.session_mock.add_all.call_args_list,
+            [call(pending)] * integrity_error_count
+        )
+
     def test_does_not_log_warning(self):
         """Test if warnings are not logged.
 
@@ -498,6 +1292,145 @@ class TestGetCommitChanges(unittest.TestCase):
 
         self.assertTrue(self.logger_mock.called)
 
+    def test_notifies_caches_about_stored_target_urls(self):
+        """Test if records of new target URLs are passed to caches."""
+        target_url = Mock(spec=BaseTargetURL)
+        self.session_mock.new = [target_url, Mock()]
+
+        self._call(1)
+
+        self.caches_mock.notify_commit.assert_called_once_with(
+            [target_url.to_record.return_value]
+        )
+
+    def test_does_not_notify_caches_without_target_urls(self):
+        """Test if caches are not notified about other changes."""
+        self._call(0)
+
+        self.assertFalse(self.caches_mock.notify_commit.called)
+
+
+class PoolWaitMonitorTest(unittest.TestCase):
+    """Tests for PoolWaitMonitor class."""
+
+    def setUp(self):
+        self.logger_mock = Mock()
+        self.tested_instance = PoolWaitMonitor(self.logger_mock, 0.5)
+
+    def test_as_dict(self):
+        """Test if recorded waits are summarized."""
+        self.tested_instance.record(0.1)
+        self.tested_instance.record(0.3)
+        self.tested_instance.record(0.2, timed_out=True)
+
+        actual = self.tested_instance.as_dict()
+
+        self.assertEqual(2, actual['checkouts'])
+        self.assertEqual(1, actual['timeouts'])
+        self.assertAlmostEqual(0.6, actual['total_wait'])
+        self.assertAlmostEqual(0.2, actual['mean_wait'])
+        self.assertAlmostEqual(0.3, actual['max_wait'])
+
+    @parameterized.expand([
+        ('short_wait', 0.4, False),
+        ('long_wait', 0.6, True)
+    ])
+    def test_record_logs_warning_for(self, _, wait, expected):
+        """Test if a warning is logged only for long waits.
+
+        :param wait: a time of waiting to be recorded
+        :param expected: True if a warning is expected to be logged
+        """
+        self.tested_instance.record(wait)
+
+        self.assertEqual(expected, self.logger_mock.warning.called)
+
+
+class MonitoredQueuePoolTest(unittest.TestCase):
+    """Tests for MonitoredQueuePool class."""
+
+    def setUp(self):
+        self.monitor_mock = Mock()
+        self.tested_instance = MonitoredQueuePool(
+            lambda: sqlite3.connect(':memory:'),
+            pool_size=1,
+            max_overflow=0,
+            timeout=0.01
+        )
+        self.tested_instance.wait_monitor = self.monitor_mock
+
+    def test_records_checkouts(self):
+        """Test if the time of waiting for a connection is recorded."""
+        self.tested_instance.connect().close()
+
+        self.assertEqual(1, self.monitor_mock.record.call_count)
+        self.assertFalse(self.monitor_mock.record.call_args[0][1])
+
+    def test_records_timeouts(self):
+        """Test if a timed out checkout is recorded."""
+        connection = self.tested_instance.connect()
+        with self.assertRaises(TimeoutError):
+            self.tested_instance.connect()
+        connection.close()
+
+        self.assertTrue(self.monitor_mock.record.call_args[0][1])
+
+    def test_recreate_keeps_monitor(self):
+        """Test if a recreated pool uses the same monitor."""
+        pool = self.tested_instance.recreate()
+
+        self.assertIs(self.monitor_mock, pool.wait_monitor)
+
+
+class ConfiguredSQLAlchemyTest(unittest.TestCase):
+    """Tests for ConfiguredSQLAlchemy class."""
+
+    def setUp(self):
+        self.app_mock = MagicMock()
+        self.app_mock.config = {
+            'SQLALCHEMY_NATIVE_UNICODE': None,
+            'SQLALCHEMY_POOL_PRE_PING': False,
+            'SQLALCHEMY_DIALECT_OPTIONS': {
+                'postgresql': {'connect_args': {'application_name': 'x'}}
+            }
+        }
+        self.tested_instance = ConfiguredSQLAlchemy()
+
+    def test_apply_driver_hacks_applies_dialect_options(self):
+        """Test if options for the dialect are applied."""
+        options = {}
+        self.tested_instance.apply_driver_hacks(
+            self.app_mock,
+            make_url('postgresql://user@host/db'),
+            options
+        )
+
+        self.assertEqual({'application_name': 'x'}, options['connect_args'])
+        self.assertEqual(MonitoredQueuePool, options['poolclass'])
+
+    def test_apply_driver_hacks_ignores_other_dialects(self):
+        """Test if options for other dialects are not applied."""
+        options = {}
+        self.tested_instance.apply_driver_hacks(
+            self.app_mock,
+            make_url('mysql://user@host/db'),
+            options
+        )
+
+        self.assertNotIn('connect_args', options)
+
+    def test_apply_driver_hacks_enables_pre_ping(self):
+        """Test if pooled connections are configured to be tested."""
+        self.app_mock.config['SQLALCHEMY_POOL_PRE_PING'] = True
+        options = {}
+        self.tested_instance.apply_driver_hacks(
+            self.app_mock,
+            make_url('mysql://user@host/db'),
+            options
+        )
+
+        self.assertTrue(options['pool_pre_ping'])
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
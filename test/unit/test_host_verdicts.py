@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Tests for caching of verdicts of host blacklists."""
+import unittest
+from unittest.mock import Mock
+
+from spam_lists.exceptions import InvalidURLError
+
+from url_shortener.caching import TTLCache
+from url_shortener.circuit_breaker import DegradedResult, reset_degraded
+from url_shortener.host_verdicts import HostVerdictTester
+
+
+class HostVerdictTesterTest(unittest.TestCase):
+    """Tests for HostVerdictTester class.
+
+    :ivar first_list_mock: a mock of the first host blacklist
+    :ivar second_list_mock: a mock of the second host blacklist
+    :ivar cache: a cache of verdicts
+    :ivar tested_instance: an instance of HostVerdictTester to be tested
+    """
+
+    def setUp(self):
+        self.first_list_mock = Mock()
+        self.first_list_mock.lookup_matching.return_value = []
+        self.second_list_mock = Mock()
+        self.item = Mock()
+        self.second_list_mock.lookup_matching.side_effect = (
+            lambda urls: [self.item] if 'spam.com' in urls[0] else []
+        )
+        self.cache = TTLCache(10, 60)
+        self.tested_instance = HostVerdictTester(
+            [self.first_list_mock, self.second_list_mock],
+            self.cache
+        )
+
+    def test_lookup_matching_returns_item_of_first_match(self):
+        """Test if an item of the first matching list is returned."""
+        actual = list(self.tested_instance.lookup_matching(
+            ['http://spam.com/a', 'http://good.com/a']
+        ))
+
+        self.assertEqual([self.item], actual)
+
+    def test_lookup_matching_caches_verdicts_per_host(self):
+        """Test if lists are queried once for URLs with the same host."""
+        for url in ('http://spam.com/a', 'http://spam.com/b'):
+            list(self.tested_instance.lookup_matching([url]))
+        for url in ('http://good.com/a', 'http://good.com/b'):
+            list(self.tested_instance.lookup_matching([url]))
+
+        self.assertEqual(2, self.second_list_mock.lookup_matching.call_count)
+        self.assertEqual(self.item, self.cache.get('spam.com'))
+        self.assertIsNone(self.cache.get('good.com', 'missing'))
+
+    def test_lookup_matching_queries_lists_again_after_expiration(self):
+        """Test if expired verdicts are computed again."""
+        list(self.tested_instance.lookup_matching(['http://spam.com/a']))
+        self.cache.clear()
+
+        list(self.tested_instance.lookup_matching(['http://spam.com/b']))
+
+        self.assertEqual(2, self.first_list_mock.lookup_matching.call_count)
+
+    def test_lookup_matching_does_not_cache_degraded_results(self):
+        """Test if fallback results of unavailable lists are not cached."""
+        self.first_list_mock.lookup_matching.return_value = DegradedResult()
+
+        reset_degraded()
+
+        list(self.tested_instance.lookup_matching(['http://good.com/a']))
+
+        self.assertEqual('missing', self.cache.get('good.com', 'missing'))
+        self.assertTrue(reset_degraded())
+
+    def test_filter_matching(self):
+        """Test if URLs with listed hosts are returned."""
+        urls = ['http://spam.com/a', 'http://good.com', 'http://spam.com/b']
+
+        actual = list(self.tested_instance.filter_matching(urls))
+
+        self.assertEqual([urls[0], urls[2]], actual)
+        self.assertTrue(self.tested_instance.any_match(urls))
+
+    def test_lookup_matching_raises_InvalidURLError(self):
+        """Test if InvalidURLError is raised for invalid URLs."""
+        with self.assertRaises(InvalidURLError):
+            list(self.tested_instance.lookup_matching(['invalid']))
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Tests for database migrations."""
+from importlib.util import module_from_spec, spec_from_file_location
+import os
+from string import ascii_lowercase, digits
+import unittest
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import create_engine, Column, Integer, MetaData, String, Table
+from sqlalchemy import sql
+
+from url_shortener.domain_and_persistence import (
+    AliasFactory, BigIntegerAlias, IntegerAlias
+)
+
+
+VERSIONS = os.path.join(
+    os.path.dirname(__file__), '..', '..', 'migrations', 'versions'
+)
+
+
+def load_revision(revision):
+    """Load a module of a migration.
+
+    :param revision: an identifier of the migration
+    :returns: the module
+    """
+    spec = spec_from_file_location(
+        'migration_' + revision,
+        os.path.join(VERSIONS, revision + '_.py')
+    )
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class BigIntegerAliasMigrationTest(unittest.TestCase):
+    """Tests for the migration storing aliases as 64 bit integers.
+
+    :ivar engine: an engine of a database with a table of target URLs
+    :ivar table: the table of target URLs, before the migration
+    :ivar migration: a module of the tested migration
+    """
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.migration = load_revision('6c0e2d41b7a3')
+        alias_type = IntegerAlias(AliasFactory(digits + ascii_lowercase, 1, 6))
+        self.table = Table(
+            'targetURL',
+            MetaData(),
+            Column('alias', Integer, primary_key=True),
+            Column('value', String(2083), nullable=False)
+        )
+        self.table.create(self.engine)
+        self.engine.execute(self.table.insert(), [
+            {
+                'alias': alias_type.process_bind_param(alias, None),
+                'value': value
+            }
+            for alias, value in [('0ab', 'http://a.com'), ('c', 'http://c')]
+        ])
+
+    def _run(self, step):
+        with self.engine.connect() as connection:
+            with Operations.context(MigrationContext.configure(connection)):
+                step()
+
+    def _get_value(self, alias):
+        alias_type = BigIntegerAlias(
+            AliasFactory(digits + ascii_lowercase, 1, 12)
+        )
+        query = sql.select([self.table.c.value]).where(
+            self.table.c.alias == alias_type.process_bind_param(alias, None)
+        )
+        return self.engine.execute(query).scalar()
+
+    def test_upgrade_keeps_aliases_with_leading_zeros(self):
+        """Test if short URLs issued before upgrading remain valid."""
+        self._run(self.migration.upgrade)
+
+        self.assertEqual('http://a.com', self._get_value('0ab'))
+        self.assertEqual('http://c', self._get_value('c'))
+
+    def test_downgrade_reverses_upgrade(self):
+        """Test if aliases remain valid after downgrading."""
+        self._run(self.migration.upgrade)
+        self._run(self.migration.downgrade)
+
+        self.assertEqual('http://a.com', self._get_value('0ab'))
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Tests for preparation of the application for preforking servers."""
+import unittest
+from unittest.mock import Mock, patch, call
+from weakref import WeakSet
+
+from url_shortener.forms import url_form_class
+from url_shortener.prefork import preload, reset_pool_after_fork
+from url_shortener.validation import BlacklistValidator
+
+
+class ResetPoolAfterForkTest(unittest.TestCase):
+    """Tests for reset_pool_after_fork function."""
+
+    def setUp(self):
+        self.patchers = [
+            patch('url_shortener.prefork.os.register_at_fork'),
+            patch('url_shortener.prefork._fork_hook_registered', False),
+            patch('url_shortener.prefork._engines_to_reset', WeakSet())
+        ]
+        self.register_at_fork_mock = self.patchers[0].start()
+        for patcher in self.patchers[1:]:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def _fork(self):
+        callback = self.register_at_fork_mock.call_args[1]['after_in_child']
+        callback()
+
+    def test_child_gets_new_pool(self):
+        """Test if a child process replaces the pool of the engine."""
+        engine = Mock()
+        original_pool = engine.pool
+
+        reset_pool_after_fork(engine)
+        self._fork()
+
+        self.assertEqual(original_pool.recreate.return_value, engine.pool)
+        self.assertFalse(original_pool.dispose.called)
+
+    def test_hook_is_registered_once(self):
+        """Test if one hook resets pools of all engines."""
+        engines = [Mock(), Mock()]
+        pools = [e.pool for e in engines]
+
+        for engine in engines + engines:
+            reset_pool_after_fork(engine)
+        self._fork()
+
+        self.assertEqual(1, self.register_at_fork_mock.call_count)
+        for engine, pool in zip(engines, pools):
+            self.assertEqual(pool.recreate.return_value, engine.pool)
+
+
+class PreloadTest(unittest.TestCase):
+    """Tests for preload function.
+
+    :ivar injector_mock: a mock of injector used by the application
+    :ivar engine_mock: a mock of a database engine
+    """
+
+    def setUp(self):
+        self.patchers = [
+            patch('url_shortener.prefork.' + name) for name in (
+                'precompile_templates', 'reset_pool_after_fork', 'gc'
+            )
+        ]
+        (
+            self.precompile_mock,
+            self.reset_pool_mock,
+            self.gc_mock
+        ) = [p.start() for p in self.patchers]
+        self.domain_patcher = patch(
+            'spam_lists.structures.registered_domain'
+        )
+        self.domain_patcher.start()
+
+        self.app_mock = Mock()
+        self.injector_mock = Mock()
+        self.engine_mock = Mock()
+
+        preload(self.app_mock, self.injector_mock, [self.engine_mock])
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        self.domain_patcher.stop()
+
+    def test_creates_lazy_dependencies(self):
+        """Test if dependencies created on first use are created."""
+        self.injector_mock.get.assert_has_calls(
+            [call(BlacklistValidator), call(url_form_class)],
+            any_order=True
+        )
+
+    def test_precompiles_templates(self):
+        """Test if templates are compiled before forking."""
+        self.precompile_mock.assert_called_once_with(self.app_mock)
+
+    def test_prepares_engines(self):
+        """Test if engines are disposed and reset after a fork."""
+        self.assertTrue(self.engine_mock.dispose.called)
+        self.reset_pool_mock.assert_called_once_with(self.engine_mock)
+
+    def test_freezes_objects(self):
+        """Test if loaded objects are moved to permanent generation."""
+        self.assertTrue(self.gc_mock.freeze.called)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Tests for Google Safe Browsing Update API client."""
+from base64 import b64encode
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+from tempfile import TemporaryDirectory
+from threading import Thread
+import unittest
+from unittest.mock import Mock
+
+from nose_parameterized import parameterized
+
+from url_shortener.safe_browsing import (
+    canonicalize, get_expressions, PrefixSet, SafeBrowsingDatabase,
+    SafeBrowsingUpdateClient, SafeBrowsingUpdateTester, ThreatList
+)
+
+
+def encode(value):
+    """Encode bytes with base64."""
+    return b64encode(value).decode('ascii')
+
+
+def digest(expression):
+    """Get a SHA256 hash of an expression."""
+    return sha256(expression.encode('utf-8')).digest()
+
+
+class FakeSafeBrowsingServer(HTTPServer):
+    """A server responding to Safe Browsing API requests.
+
+    :ivar responses: a dictionary mapping names of API methods to lists
+    of deserialized responses to be returned, in order
+    :ivar requests: a list of tuples containing a method name and
+    a deserialized request body for each received request
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        """Handles a single request."""
+
+        def do_POST(self):
+            method = self.path.split('?', 1)[0].rsplit('/', 1)[-1]
+            length = int(self.headers['Content-Length'])
+            body = json.loads(self.rfile.read(length).decode('utf-8'))
+            self.server.requests.append((method, body))
+            content = json.dumps(
+                self.server.responses[method].pop(0)
+            ).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), self.Handler)
+        self.responses = {
+            'threatListUpdates:fetch': [],
+            'fullHashes:find': []
+        }
+        self.requests = []
+        Thread(target=self.serve_forever, args=(0.01,), daemon=True).start()
+
+    @property
+    def url(self):
+        """Get a base URL of the API."""
+        return 'http://127.0.0.1:{}/v4/'.format(self.server_address[1])
+
+    def stop(self):
+        """Stop the server."""
+        self.shutdown()
+        self.server_close()
+
+
+MALWARE = ThreatList('MALWARE', 'ANY_PLATFORM', 'URL')
+
+
+def get_list_update(prefixes, state, response_type='FULL_UPDATE',
+                    removals=None, checksum=None):
+    """Get an update of the malware list to be returned by the server."""
+    by_size = {}
+    for prefix in prefixes:
+        by_size.setdefault(len(prefix), []).append(prefix)
+    update = {
+        'threatType': MALWARE.threat_type,
+        'platformType': MALWARE.platform_type,
+        'threatEntryType': MALWARE.threat_entry_type,
+        'responseType': response_type,
+        'additions': [
+            {
+                'compressionType': 'RAW',
+                'rawHashes': {
+                    'prefixSize': size,
+                    'rawHashes': encode(b''.join(values))
+                }
+            }
+            for size, values in by_size.items()
+        ],
+        'newClientState': state
+    }
+    if removals:
+        update['removals'] = [{'rawIndices': {'indices': removals}}]
+    if checksum is not None:
+        update['checksum'] = {'sha256': encode(checksum)}
+    return update
+
+
+class CanonicalizeTest(unittest.TestCase):
+    """Tests for canonicalize function."""
+
+    @parameterized.expand([
+        ('http://host/%25%32%35', 'http://host/%25'),
+        ('http://host/%25%32%35%25%32%35', 'http://host/%25%25'),
+        ('http://www.google.com/blah/..', 'http://www.google.com/'),
+        ('http://www.GOOgle.com/', 'http://www.google.com/'),
+        ('http://www.google.com.../', 'http://www.google.com/'),
+        ('http://www.google.com/foo\tbar\rbaz\n2', (
+            'http://www.google.com/foobarbaz2'
+        )),
+        ('http://www.google.com/q?', 'http://www.google.com/q?'),
+        ('http://www.google.com/q?r?', 'http://www.google.com/q?r?'),
+        ('http://evil.com/foo#bar#baz', 'http://evil.com/foo'),
+        ('http://notrailingslash.com', 'http://notrailingslash.com/'),
+        ('http://www.gotaport.com:1234/', 'http://www.gotaport.com/'),
+        ('http://host.com//twoslashes?more//slashes', (
+            'http://host.com/twoslashes?more//slashes'
+        )),
+        ('http://host.com/ab%23cd', 'http://host.com/ab%23cd'),
+        ('http://\x01\x80.com/', 'http://%01%C2%80.com/'),
+    ])
+    def test_canonicalize(self, url, expected):
+        """Test if a URL is transformed to its canonical form.
+
+        :param url: a URL to be canonicalized
+        :param expected: its expected canonical form
+        """
+        self.assertEqual(expected, canonicalize(url))
+
+
+class GetExpressionsTest(unittest.TestCase):
+    """Tests for get_expressions function."""
+
+    def test_get_expressions(self):
+        """Test if host suffixes are combined with path prefixes."""
+        actual = get_expressions('http://a.b.c/1/2.html?param=1')
+
+        self.assertCountEqual(
+            [
+                'a.b.c/1/2.html?param=1', 'a.b.c/1/2.html', 'a.b.c/',
+                'a.b.c/1/', 'b.c/1/2.html?param=1', 'b.c/1/2.html', 'b.c/',
+                'b.c/1/'
+            ],
+            actual
+        )
+
+    def test_get_expressions_for_long_host(self):
+        """Test if suffixes of the last five components are used."""
+        actual = get_expressions('http://a.b.c.d.e.f.g/')
+
+        self.assertCountEqual(
+            ['a.b.c.d.e.f.g/', 'c.d.e.f.g/', 'd.e.f.g/', 'e.f.g/', 'f.g/'],
+            actual
+        )
+
+    def test_get_expressions_for_ip_address(self):
+        """Test if suffixes of IP addresses are not used."""
+        actual = get_expressions('http://1.2.3.4/1/')
+
+        self.assertCountEqual(['1.2.3.4/1/', '1.2.3.4/'], actual)
+
+
+class PrefixSetTest(unittest.TestCase):
+    """Tests for PrefixSet class."""
+
+    def setUp(self):
+        self.prefixes = [b'bbbb', b'aaaa', b'abcdefgh', b'zzzz']
+        self.tested_instance = PrefixSet.from_prefixes(self.prefixes)
+
+    def test_iterates_in_lexicographic_order(self):
+        """Test if prefixes of all lengths are returned sorted."""
+        self.assertEqual(sorted(self.prefixes), list(self.tested_instance))
+        self.assertEqual(4, len(self.tested_instance))
+
+    def test_match(self):
+        """Test if prefixes of a full hash are returned."""
+        actual = self.tested_instance.match(b'abcdefgh' + b'\0' * 24)
+
+        self.assertEqual([b'abcdefgh'], actual)
+
+    @parameterized.expand([
+        ('lower', b'aaa\0'),
+        ('between', b'bbbc'),
+        ('higher', b'\xff' * 4)
+    ])
+    def test_match_returns_no_prefix_for(self, _, full_hash):
+        """Test if no prefixes are returned for a hash not in the set."""
+        self.assertEqual([], self.tested_instance.match(full_hash * 8))
+
+    def test_checksum(self):
+        """Test if the checksum is a hash of sorted prefixes."""
+        self.assertEqual(
+            sha256(b''.join(sorted(self.prefixes))).digest(),
+            self.tested_instance.checksum()
+        )
+
+
+class SafeBrowsingDatabaseTest(unittest.TestCase):
+    """Tests for SafeBrowsingDatabase class.
+
+    :ivar server: an instance of FakeSafeBrowsingServer
+    :ivar directory: a temporary directory for database files
+    :ivar logger_mock: a mock of a logger
+    """
+
+    def setUp(self):
+        self.server = FakeSafeBrowsingServer()
+        self.directory = TemporaryDirectory()
+        self.logger_mock = Mock()
+
+    def tearDown(self):
+        self.server.stop()
+        self.directory.cleanup()
+
+    def _create(self, path=None):
+        return SafeBrowsingDatabase(
+            SafeBrowsingUpdateClient(self.server.url, 'key', 'test', '1'),
+            [MALWARE],
+            self.logger_mock,
+            path
+        )
+
+    def _respond(self, *list_updates, wait='30.5s'):
+        self.server.responses['threatListUpdates:fetch'].append({
+            'listUpdateResponses': list(list_updates),
+            'minimumWaitDuration': wait
+        })
+
+    def test_update_applies_full_update(self):
+        """Test if prefixes and state are replaced by a full update."""
+        prefixes = [b'aaaa', b'bbbbbb']
+        self._respond(get_list_update(
+            prefixes,
+            'state1',
+            checksum=sha256(b''.join(prefixes)).digest()
+        ))
+        tested_instance = self._create()
+
+        actual = tested_instance.update()
+
+        self.assertEqual(30.5, actual)
+        self.assertEqual({MALWARE: 'state1'}, tested_instance.states)
+        self.assertEqual({b'aaaa'}, tested_instance.match(b'aaaa' * 8))
+        method, body = self.server.requests[0]
+        self.assertEqual('threatListUpdates:fetch', method)
+        self.assertEqual('', body['listUpdateRequests'][0]['state'])
+
+    def test_update_applies_partial_update(self):
+        """Test if removals and additions are applied to prefixes."""
+        self._respond(get_list_update([b'aaaa', b'bbbb', b'cccc'], 's1'))
+        self._respond(get_list_update(
+            [b'dddd'],
+            's2',
+            'PARTIAL_UPDATE',
+            removals=[0, 2],
+            checksum=sha256(b'bbbbdddd').digest()
+        ))
+        tested_instance = self._create()
+
+        tested_instance.update()
+        tested_instance.update()
+
+        self.assertEqual({MALWARE: 's2'}, tested_instance.states)
+        self.assertEqual(2, len(tested_instance))
+        self.assertEqual(set(), tested_instance.match(b'aaaa' * 8))
+        self.assertEqual('s1', self.server.requests[1][1][
+            'listUpdateRequests'
+        ][0]['state'])
+
+    def test_update_resets_list_for_invalid_checksum(self):
+        """Test if a list is emptied when its checksum doesn't match."""
+        self._respond(get_list_update(
+            [b'aaaa'],
+            'state1',
+            checksum=b'invalid'
+        ))
+        tested_instance = self._create()
+
+        tested_instance.update()
+
+        self.assertEqual({MALWARE: ''}, tested_instance.states)
+        self.assertEqual(0, len(tested_instance))
+        self.assertTrue(self.logger_mock.warning.called)
+
+    def test_database_is_saved_and_loaded(self):
+        """Test if a database is loaded from the file it was saved to."""
+        path = os.path.join(self.directory.name, 'gsb')
+        self._respond(get_list_update([b'aaaa', b'bbbbbbbb'], 'state1'))
+        self._create(path).update()
+
+        actual = self._create(path)
+
+        self.assertEqual({MALWARE: 'state1'}, actual.states)
+        self.assertEqual({b'bbbbbbbb'}, actual.match(b'bbbb' * 8))
+
+
+class SafeBrowsingUpdateTesterTest(unittest.TestCase):
+    """Tests for SafeBrowsingUpdateTester class.
+
+    :ivar server: an instance of FakeSafeBrowsingServer
+    :ivar tested_instance: an instance of SafeBrowsingUpdateTester
+    """
+
+    LISTED_URL = 'http://evil.com/malware.exe'
+
+    def setUp(self):
+        self.server = FakeSafeBrowsingServer()
+        self.full_hash = digest('evil.com/malware.exe')
+        self.server.responses['threatListUpdates:fetch'].append({
+            'listUpdateResponses': [
+                get_list_update([self.full_hash[:4]], 'state1')
+            ]
+        })
+        database = SafeBrowsingDatabase(
+            SafeBrowsingUpdateClient(self.server.url, 'key', 'test', '1'),
+            [MALWARE],
+            Mock()
+        )
+        database.update()
+        database.start = Mock()
+        self.tested_instance = SafeBrowsingUpdateTester(database)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _respond(self, full_hashes, duration='300s'):
+        self.server.responses['fullHashes:find'].append({
+            'matches': [
+                {
+                    'threatType': 'MALWARE',
+                    'platformType': 'ANY_PLATFORM',
+                    'threatEntryType': 'URL',
+                    'threat': {'hash': encode(h)},
+                    'cacheDuration': duration
+                }
+                for h in full_hashes
+            ],
+            'negativeCacheDuration': duration
+        })
+
+    def _count_full_hash_requests(self):
+        return len(
+            [r for r in self.server.requests if r[0] == 'fullHashes:find']
+        )
+
+    def test_lookup_matching_returns_listed_url(self):
+        """Test if a URL with a listed full hash is returned."""
+        self._respond([self.full_hash])
+
+        actual = list(self.tested_instance.lookup_matching(
+            [self.LISTED_URL, 'http://good.com']
+        ))
+
+        self.assertEqual([self.LISTED_URL], [i.value for i in actual])
+        self.assertEqual({'MALWARE'}, actual[0].classification)
+        _, body = self.server.requests[-1]
+        self.assertEqual(
+            [{'hash': encode(self.full_hash[:4])}],
+            body['threatInfo']['threatEntries']
+        )
+        self.assertEqual(['state1'], body['clientStates'])
+
+    def test_lookup_matching_caches_full_hashes(self):
+        """Test if full hashes are requested once while cached."""
+        self._respond([self.full_hash])
+
+        for _ in range(2):
+            self.assertTrue(self.tested_instance.any_match([self.LISTED_URL]))
+
+        self.assertEqual(1, self._count_full_hash_requests())
+
+    def test_lookup_matching_ignores_expired_full_hashes(self):
+        """Test if a full hash is not listed after its cache expires."""
+        self._respond([self.full_hash], '0s')
+        self._respond([])
+
+        self.assertTrue(self.tested_instance.any_match([self.LISTED_URL]))
+        self.assertFalse(self.tested_instance.any_match([self.LISTED_URL]))
+        self.assertEqual(2, self._count_full_hash_requests())
+
+    def test_find_full_hashes_limits_cached_results(self):
+        """Test if the number of cached results is limited."""
+        tested_instance = SafeBrowsingUpdateTester(
+            self.tested_instance.database,
+            1
+        )
+        self._respond([self.full_hash, digest('other.com/')])
+
+        tested_instance._find_full_hashes((b'aaaa', b'bbbb'))
+
+        self.assertEqual(1, len(tested_instance._full_hashes))
+        self.assertEqual(1, len(tested_instance._negative))
+
+    def test_lookup_matching_caches_negative_results(self):
+        """Test if prefixes without listed full hashes are cached."""
+        self._respond([digest('other.com/')])
+
+        for _ in range(2):
+            self.assertFalse(
+                self.tested_instance.any_match([self.LISTED_URL])
+            )
+
+        self.assertEqual(1, self._count_full_hash_requests())
+
+    def test_lookup_matching_does_not_request_unmatched_prefixes(self):
+        """Test if full hashes are not requested without a prefix match."""
+        actual = list(
+            self.tested_instance.filter_matching(['http://good.com/a'])
+        )
+
+        self.assertEqual([], actual)
+        self.assertEqual(0, self._count_full_hash_requests())
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Tests for snapshots of target URLs."""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+from nose_parameterized import parameterized
+from sqlalchemy import create_engine, BigInteger, Column, MetaData, Table
+from sqlalchemy import String
+from sqlalchemy.exc import OperationalError
+from werkzeug.exceptions import NotFound, ServiceUnavailable
+
+from url_shortener.circuit_breaker import CircuitBreaker
+from url_shortener.domain_and_persistence import (
+    AliasFactory, AliasValueError, BigIntegerAlias, TargetURLRecord
+)
+from url_shortener.snapshot import (
+    export_snapshot, write_snapshot, Snapshot, SnapshotError,
+    SnapshotFallback, SnapshotReader
+)
+
+
+class SnapshotFileTest(unittest.TestCase):
+    """Tests for writing and reading snapshots.
+
+    :ivar directory: a temporary directory containing snapshots
+    :ivar path: a path to a snapshot
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_snapshot_returns_written_values(self):
+        """Test if written target URLs are found by their integers."""
+        items = [(-5, 'http://a.com'), (3, 'http://zażółć.pl'), (7, '')]
+
+        actual = write_snapshot(self.path, items)
+        snapshot = Snapshot(self.path)
+
+        self.assertEqual(3, actual)
+        self.assertEqual(3, len(snapshot))
+        for key, value in items:
+            self.assertEqual(value, snapshot.get(key))
+
+    @parameterized.expand([
+        ('smaller', -10),
+        ('between', 5),
+        ('greater', 10)
+    ])
+    def test_snapshot_returns_none_for_missing_key(self, _, key):
+        """Test if None is returned for integers not in the snapshot.
+
+        :param key: the integer
+        """
+        write_snapshot(self.path, [(-5, 'http://a.com'), (7, 'http://b')])
+
+        self.assertIsNone(Snapshot(self.path).get(key))
+
+    def test_empty_snapshot(self):
+        """Test if an empty snapshot can be written and read."""
+        write_snapshot(self.path, [])
+
+        self.assertIsNone(Snapshot(self.path).get(1))
+
+    def test_write_snapshot_raises_value_error(self):
+        """Test if unordered items are rejected without a new file."""
+        write_snapshot(self.path, [(1, 'http://a.com')])
+
+        with self.assertRaises(ValueError):
+            write_snapshot(self.path, [(2, 'http://b'), (1, 'http://c')])
+
+        self.assertEqual('http://a.com', Snapshot(self.path).get(1))
+        self.assertEqual(['snapshot'], os.listdir(self.directory))
+
+    @parameterized.expand([
+        ('empty', b''),
+        ('other_format', b'x' * 64),
+        ('truncated', b'URLSNAP1' + b'\x00' * 8 + b'\xff' * 8)
+    ])
+    def test_snapshot_raises_snapshot_error_for(self, _, content):
+        """Test if SnapshotError is raised for invalid files.
+
+        :param content: content of the file
+        """
+        with open(self.path, 'wb') as snapshot_file:
+            snapshot_file.write(content)
+
+        self.assertRaises(SnapshotError, Snapshot, self.path)
+
+
+class ExportSnapshotTest(unittest.TestCase):
+    """Tests for export_snapshot function.
+
+    :ivar directory: a temporary directory containing the snapshot
+    :ivar path: a path to the snapshot
+    :ivar table: a table of target URLs
+    :ivar engines: engines of databases storing target URLs
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'snapshot')
+        self.table = Table(
+            'targetURL',
+            MetaData(),
+            Column('alias', BigInteger, primary_key=True),
+            Column('value', String(2083), nullable=False)
+        )
+        self.engines = [create_engine('sqlite://') for _ in range(2)]
+        for engine in self.engines:
+            self.table.create(engine)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _insert(self, engine, *aliases):
+        engine.execute(self.table.insert(), [
+            {'alias': a, 'value': 'http://{}.com'.format(a)}
+            for a in aliases
+        ])
+
+    def test_export_snapshot_writes_all_target_urls(self):
+        """Test if target URLs of all databases are exported."""
+        self._insert(self.engines[0], 1, 4, 5)
+        self._insert(self.engines[1], 2, 3)
+
+        actual = export_snapshot(self.path, self.engines, self.table, 2)
+        snapshot = Snapshot(self.path)
+
+        self.assertEqual((5, 5), actual)
+        self.assertEqual([1, 2, 3, 4, 5], list(snapshot.keys))
+        self.assertEqual('http://3.com', snapshot.get(3))
+
+    def test_export_snapshot_selects_only_new_target_urls(self):
+        """Test if existing target URLs are copied from the snapshot."""
+        write_snapshot(self.path, [(1, 'http://old.com'), (2, 'http://x')])
+        self._insert(self.engines[0], 1, 3)
+
+        actual = export_snapshot(self.path, self.engines[:1], self.table)
+        snapshot = Snapshot(self.path)
+
+        self.assertEqual((2, 1), actual)
+        self.assertEqual('http://old.com', snapshot.get(1))
+        self.assertIsNone(snapshot.get(2))
+        self.assertEqual('http://3.com', snapshot.get(3))
+
+
+class SnapshotReaderTest(unittest.TestCase):
+    """Tests for SnapshotReader class.
+
+    :ivar directory: a temporary directory containing the snapshot
+    :ivar now: a current time returned by the timer of tested instance
+    :ivar tested_instance: an instance of SnapshotReader to be tested
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.now = 100
+        self.logger_mock = Mock()
+        self.tested_instance = SnapshotReader(
+            os.path.join(self.directory, 'snapshot'),
+            10,
+            self.logger_mock,
+            lambda: self.now
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_returns_none_without_snapshot(self):
+        """Test if None is returned if the file doesn't exist."""
+        self.assertIsNone(self.tested_instance.get(1))
+
+    def test_get_uses_replaced_snapshot_after_interval(self):
+        """Test if a new version of the snapshot is used."""
+        path = self.tested_instance.path
+        write_snapshot(path, [(1, 'http://old.com')])
+        self.tested_instance.get(1)
+        write_snapshot(path, [(1, 'http://new.com')])
+
+        before = self.tested_instance.get(1)
+        self.now += 10
+        after = self.tested_instance.get(1)
+
+        self.assertEqual('http://old.com', before)
+        self.assertEqual('http://new.com', after)
+
+    def test_get_logs_invalid_snapshot(self):
+        """Test if an invalid file is logged and not used."""
+        with open(self.tested_instance.path, 'wb') as snapshot_file:
+            snapshot_file.write(b'x' * 64)
+
+        self.assertIsNone(self.tested_instance.get(1))
+        self.assertTrue(self.logger_mock.warning.called)
+
+
+class SnapshotFallbackTest(unittest.TestCase):
+    """Tests for SnapshotFallback class.
+
+    :ivar alias_type: an instance of BigIntegerAlias
+    :ivar reader_mock: a mock of SnapshotReader
+    :ivar breaker: an instance of CircuitBreaker used by tested instance
+    :ivar now: a current time returned by the timer of tested instance
+    :ivar target_url_cls_mock: a mock of a target URL class
+    :ivar tested_instance: an instance of SnapshotFallback to be tested
+    """
+
+    def setUp(self):
+        self.alias_type = BigIntegerAlias(
+            AliasFactory('0123456789acdefhijkmnopqrtuvwxy', 1, 5)
+        )
+        self.reader_mock = Mock()
+        self.reader_mock.get.return_value = 'http://snapshot.com'
+        self.now = 100
+        self.breaker = CircuitBreaker(1, 30, lambda: self.now)
+        self.target_url_cls_mock = Mock()
+        self.get_record_mock = self.target_url_cls_mock.get_record_or_404
+        self.tested_instance = SnapshotFallback(
+            self.reader_mock,
+            self.alias_type,
+            self.breaker,
+            0.5,
+            Mock(),
+            lambda: self.now
+        )
+
+    def _get_record(self, alias='acd'):
+        return self.tested_instance.get_record_or_404(
+            self.target_url_cls_mock,
+            alias
+        )
+
+    def test_get_record_returns_record_from_database(self):
+        """Test if the database is used when it works."""
+        actual = self._get_record()
+
+        self.assertEqual(self.get_record_mock.return_value, actual)
+        self.assertFalse(self.reader_mock.get.called)
+
+    @parameterized.expand([
+        ('not_found', NotFound),
+        ('invalid_alias', AliasValueError)
+    ])
+    def test_get_record_raises(self, _, exception_type):
+        """Test if errors other than database failures are raised.
+
+        :param exception_type: a type of the raised exception
+        """
+        self.get_record_mock.side_effect = exception_type
+
+        self.assertRaises(exception_type, self._get_record)
+        self.assertEqual(CircuitBreaker.CLOSED, self.breaker.state)
+
+    def test_get_record_uses_snapshot_on_database_error(self):
+        """Test if the snapshot is used when the database fails."""
+        self.get_record_mock.side_effect = OperationalError('s', {}, None)
+
+        actual = self._get_record('acrn')
+
+        self.reader_mock.get.assert_called_once_with(
+            self.alias_type.process_bind_param('acm', None)
+        )
+        self.assertEqual(TargetURLRecord('acm', 'http://snapshot.com'), actual)
+        self.assertEqual(CircuitBreaker.OPEN, self.breaker.state)
+
+    def test_get_record_skips_database_while_circuit_is_open(self):
+        """Test if the database is not queried after failures."""
+        self.get_record_mock.side_effect = OperationalError('s', {}, None)
+        self._get_record()
+        self.get_record_mock.reset_mock()
+
+        self._get_record()
+
+        self.assertFalse(self.get_record_mock.called)
+
+    def test_get_record_counts_slow_lookup_as_failure(self):
+        """Test if a lookup over the latency budget opens the circuit."""
+        def slow_lookup(_):
+            self.now += 1
+            return 'record'
+        self.get_record_mock.side_effect = slow_lookup
+
+        actual = self._get_record()
+
+        self.assertEqual('record', actual)
+        self.assertEqual(CircuitBreaker.OPEN, self.breaker.state)
+
+    def test_get_record_raises_service_unavailable(self):
+        """Test if 503 error is raised for aliases not in the snapshot."""
+        self.get_record_mock.side_effect = OperationalError('s', {}, None)
+        self.reader_mock.get.return_value = None
+
+        self.assertRaises(ServiceUnavailable, self._get_record)
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
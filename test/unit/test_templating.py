@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Tests for template compilation and caching."""
+import os
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import Mock
+
+from jinja2 import DictLoader, Environment
+
+from url_shortener.templating import (
+    SharedFileSystemBytecodeCache, set_up_bytecode_cache,
+    precompile_templates
+)
+
+
+class SharedFileSystemBytecodeCacheTest(unittest.TestCase):
+    """Tests for SharedFileSystemBytecodeCache class.
+
+    :ivar directory: a temporary directory used by tested instance
+    :ivar tested_instance: instance of SharedFileSystemBytecodeCache
+    to be used during tests
+    """
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'templates')
+        self.tested_instance = SharedFileSystemBytecodeCache(self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _get_environment(self):
+        """Get a Jinja environment using tested instance."""
+        return Environment(
+            loader=DictLoader({'page.html': 'Hello {{ name }}'}),
+            bytecode_cache=self.tested_instance
+        )
+
+    def test_init_creates_directory(self):
+        """Test if a missing cache directory is created."""
+        self.assertTrue(os.path.isdir(self.path))
+
+    def test_dump_bytecode_stores_only_complete_files(self):
+        """Test if no temporary files are left in the directory."""
+        self._get_environment().get_template('page.html')
+
+        names = os.listdir(self.path)
+        self.assertEqual(1, len(names))
+        self.assertFalse(names[0].startswith('.tmp'))
+
+    def test_dump_bytecode_removes_temporary_file_on_error(self):
+        """Test if a temporary file is removed when writing fails."""
+        bucket = Mock()
+        bucket.key = 'key'
+        bucket.write_bytecode.side_effect = OSError
+
+        with self.assertRaises(OSError):
+            self.tested_instance.dump_bytecode(bucket)
+
+        self.assertEqual([], os.listdir(self.path))
+
+    def test_stored_bytecode_is_reused(self):
+        """Test if another environment loads the stored bytecode."""
+        self._get_environment().get_template('page.html')
+        environment = self._get_environment()
+        environment.compile = Mock()
+
+        template = environment.get_template('page.html')
+
+        self.assertFalse(environment.compile.called)
+        self.assertEqual('Hello x', template.render(name='x'))
+
+
+class SetUpBytecodeCacheTest(unittest.TestCase):
+    """Tests for set_up_bytecode_cache function."""
+
+    def setUp(self):
+        self.app_mock = Mock()
+        self.app_mock.jinja_options = {'extensions': []}
+
+    def test_does_not_set_up_cache_for_none(self):
+        """Test if no cache is set up when directory is not set."""
+        self.app_mock.config = {'JINJA_BYTECODE_CACHE_DIR': None}
+
+        set_up_bytecode_cache(self.app_mock)
+
+        self.assertNotIn('bytecode_cache', self.app_mock.jinja_options)
+
+    def test_sets_up_cache(self):
+        """Test if a shared bytecode cache is set up."""
+        with TemporaryDirectory() as directory:
+            self.app_mock.config = {'JINJA_BYTECODE_CACHE_DIR': directory}
+
+            set_up_bytecode_cache(self.app_mock)
+
+        options = self.app_mock.jinja_options
+        self.assertIsInstance(
+            options['bytecode_cache'],
+            SharedFileSystemBytecodeCache
+        )
+        self.assertIn('extensions', options)
+
+
+class PrecompileTemplatesTest(unittest.TestCase):
+    """Tests for precompile_templates function."""
+
+    def test_compiles_html_templates(self):
+        """Test if all HTML templates are loaded."""
+        app_mock = Mock()
+        env = app_mock.jinja_env
+        env.list_templates.return_value = ['a.html', 'b.html']
+
+        precompile_templates(app_mock)
+
+        env.list_templates.assert_called_once_with(extensions=['html'])
+        self.assertEqual(
+            ['a.html', 'b.html'],
+            [c[0][0] for c in env.get_template.call_args_list]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,11 +2,14 @@
 # pylint: disable=C0103
 """Tests for validation-related classes and functions."""
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 from nose_parameterized import parameterized
 
-from url_shortener.validation import BlacklistValidator, ValidationError
+from url_shortener.circuit_breaker import mark_degraded
+from url_shortener.validation import (
+    BlacklistValidator, ValidationError, ValidationModule
+)
 
 
 class BlacklistValidatorTest(unittest.TestCase):
@@ -117,6 +120,25 @@ class BlacklistValidatorTest(unittest.TestCase):
         )
         self.assertIsNone(actual_message)
 
+    def test_get_verdict_returns_reliable_verdict(self):
+        """Test if a verdict of available sources is not degraded."""
+        actual = self.tested_instance.get_verdict('http://not.spam.com')
+
+        self.assertEqual((None, False), actual)
+
+    def test_get_verdict_returns_degraded_verdict(self):
+        """Test if a verdict is degraded when a source was replaced."""
+        def lookup_matching(_):
+            mark_degraded()
+            return iter(())
+        self.cb_mock.lookup_matching.side_effect = lookup_matching
+
+        first = self.tested_instance.get_verdict('http://first.com')
+        second = self.tested_instance.get_verdict('http://second.com')
+
+        self.assertEqual((None, True), first)
+        self.assertEqual((None, True), second)
+
     def _test_assert_not_blacklisted(self, url='http://example.com'):
         """Setup test environment and call the method."""
         form = Mock()
@@ -153,6 +175,90 @@ class BlacklistValidatorTest(unittest.TestCase):
             )
 
 
+class ValidationModuleTest(unittest.TestCase):
+    """Tests for ValidationModule class.
+
+    :ivar app_mock: a mock of Flask application object
+    :ivar binder_mock: a mock of injector.Binder instance
+    :ivar get_validator_mock: a mock of get_blacklist_url_validator
+    method of tested instance
+    """
+
+    def setUp(self):
+        self.app_mock = Mock()
+        self.app_mock.config = {}
+        self.binder_mock = Mock()
+        self.tested_instance = ValidationModule(self.app_mock)
+        self.get_validator_patcher = patch.object(
+            self.tested_instance,
+            'get_blacklist_url_validator'
+        )
+        self.get_validator_mock = self.get_validator_patcher.start()
+
+    def tearDown(self):
+        self.get_validator_patcher.stop()
+
+    def _get_bound_value(self):
+        """Configure dependencies and get the value bound to validator."""
+        self.tested_instance.configure(self.binder_mock)
+        args, kwargs = self.binder_mock.bind.call_args
+        self.assertEqual(BlacklistValidator, args[0])
+        return kwargs['to']
+
+    def test_configure_creates_validator_eagerly(self):
+        """Test if the validator is created during configuration."""
+        self.app_mock.config['LAZY_STARTUP'] = False
+
+        actual = self._get_bound_value()
+
+        self.assertEqual(self.get_validator_mock.return_value, actual)
+
+    def test_configure_creates_validator_lazily(self):
+        """Test if the validator creation is deferred in lazy mode."""
+        self.app_mock.config['LAZY_STARTUP'] = True
+
+        actual = self._get_bound_value()
+
+        self.assertFalse(self.get_validator_mock.called)
+        self.assertEqual(self.get_validator_mock, actual)
+
+
+class ValidationModuleBlacklistTest(unittest.TestCase):
+    """Tests for blacklists created by ValidationModule class.
+
+    :ivar tested_instance: an instance of ValidationModule configured
+    with default options
+    """
+
+    def setUp(self):
+        from url_shortener import default_config
+        app_mock = Mock()
+        app_mock.config = {
+            k: getattr(default_config, k) for k in dir(default_config)
+            if k.isupper()
+        }
+        app_mock.config['BLACKLIST_FAIL_CLOSED'] = ['hphosts']
+        app_mock.extensions = {}
+        self.tested_instance = ValidationModule(app_mock)
+
+    def test_get_blacklist_url_validator_guards_sources(self):
+        """Test if each external source is called through a guard."""
+        validator = self.tested_instance.get_blacklist_url_validator()
+
+        self.assertEqual(
+            {'dnsbl', 'hphosts', 'google_safe_browsing', 'redirect_resolver'},
+            set(validator.get_source_metrics())
+        )
+        fail_open = {
+            str(t): t.fail_open
+            for t in self.tested_instance.guarded_testers
+        }
+        self.assertEqual(
+            {'dnsbl': True, 'hphosts': False, 'google_safe_browsing': True},
+            fail_open
+        )
+
+
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
@@ -5,10 +5,11 @@
 import unittest
 from unittest.mock import Mock, patch, MagicMock
 
+from flask import Flask
 from nose_parameterized import parameterized
-from werkzeug.exceptions import HTTPException
+from werkzeug.exceptions import HTTPException, NotFound
 
-from url_shortener.views import shorten_url, ShowURL
+from url_shortener.views import shorten_url, ShowURL, ErrorPage, metrics
 
 
 class BaseViewTest(object):
@@ -39,6 +40,8 @@ class ShortenURLTest(BaseViewTest, unittest.TestCase):
         self.form_mock.errors.values = MagicMock()
 
         self.commit_changes_mock = Mock()
+        self.alias_cache_mock = Mock()
+        self.alias_cache_mock.get.return_value = None
 
         self.markup_patcher = patch('url_shortener.views.Markup')
         self.markup_mock = self.markup_patcher.start()
@@ -63,7 +66,8 @@ class ShortenURLTest(BaseViewTest, unittest.TestCase):
         return shorten_url(
             self.target_url_class_mock,
             self.form_class_mock,
-            self.commit_changes_mock
+            self.commit_changes_mock,
+            self.alias_cache_mock
         )
 
     def test_gets_or_creates_a_target_url(self):
@@ -92,9 +96,35 @@ class ShortenURLTest(BaseViewTest, unittest.TestCase):
         actual = self._call()
         self.assertEqual(expected, actual)
 
+    def test_caches_short_url(self):
+        """Test if a record of the target URL is cached."""
+        target_url = self.target_url_class_mock.get_or_create.return_value
+
+        self._call()
+
+        self.alias_cache_mock.set.assert_called_once_with(
+            self.form_mock.url.data,
+            target_url.to_record.return_value
+        )
+
+    def test_uses_cached_short_url(self):
+        """Test if a cached short URL is used without a query."""
+        record = self.alias_cache_mock.get.return_value = Mock()
+
+        self._call()
+
+        self.assertFalse(self.target_url_class_mock.get_or_create.called)
+        self.assertFalse(self.commit_changes_mock.called)
+        self.markup_mock.return_value.format.assert_any_call(
+            'Short URL',
+            record.short_url,
+            ''
+        )
+
     def test_prepares_success_message(self):
         """Test if a message with specified elements is prepared."""
-        url_mock = self.target_url_class_mock.get_or_create.return_value
+        target_url = self.target_url_class_mock.get_or_create.return_value
+        url_mock = target_url.to_record.return_value
 
         self._call()
 
@@ -142,8 +172,8 @@ class TestShowURL(BaseViewTest, unittest.TestCase):
     returning of a preview template
     :ivar validator_mock: mock for a BlacklistValidator instance to be
     used by the view instance
-    :ivar get_msg_if_blacklisted_mock: a mock for get_msg_if_blacklisted
-    method of blacklist validator.
+    :ivar get_verdict_mock: a mock for get_verdict method of blacklist
+    validator.
     """
 
     PREVIEW_NOT_PREVIEW_SETUP = [
@@ -159,12 +189,55 @@ class TestShowURL(BaseViewTest, unittest.TestCase):
     def setUp(self):
         bval = Mock()
         self.validator_mock = bval
-        self.get_msg_if_blacklisted_mock = bval.get_msg_if_blacklisted
-        self.get_msg_if_blacklisted_mock.return_value = ''
+        self.get_verdict_mock = bval.get_verdict
+        self.get_verdict_mock.return_value = ('', False)
+
+        self.page_cache_mock = Mock()
+        self.page_cache_mock.get.return_value = None
+        self.response_cache_mock = Mock()
+        self.response_cache_mock.get.return_value = None
+        self.record_cache_mock = Mock()
+        self.record_cache_mock.get.return_value = None
+        self.fallback_mock = None
+        self.click_events_mock = Mock()
+
+        self.request_patcher = patch(
+            'url_shortener.views.request',
+            MagicMock()
+        )
+        self.request_mock = self.request_patcher.start()
+        self.request_mock.if_none_match.contains.return_value = False
+
+        self.make_response_patcher = patch(
+            'url_shortener.views.make_response'
+        )
+        self.make_response_mock = self.make_response_patcher.start()
+        response_mock = self.make_response_mock.return_value
+        self.conditional_response = response_mock.make_conditional()
+
+        self.current_app_patcher = patch(
+            'url_shortener.views.current_app',
+            MagicMock()
+        )
+        self.current_app_mock = self.current_app_patcher.start()
+        self.current_app_mock.config = {
+            'PREVIEW_MAX_AGE': 0,
+            'MISSING_ALIAS_CACHE_TIMEOUT': 10
+        }
 
         super(TestShowURL, self).setUp()
 
-        self.get_or_404_mock = self.target_url_class_mock.query.get_or_404
+        self.get_record_mock = self.target_url_class_mock.get_record_or_404
+        response = self.redirect_mock.return_value
+        response.headers.to_wsgi_list.return_value = [('Location', 'x')]
+        response.get_data.return_value = b'redirect'
+
+    def tearDown(self):
+        self.request_patcher.stop()
+        self.make_response_patcher.stop()
+        self.current_app_patcher.stop()
+
+        super(TestShowURL, self).tearDown()
 
     def create_view_and_call_dispatch_request(self, preview, alias='abc'):
         """Prepare view instance and call dispatch request method.
@@ -175,7 +248,12 @@ class TestShowURL(BaseViewTest, unittest.TestCase):
         obj = ShowURL(
             preview,
             self.target_url_class_mock,
-            self.validator_mock
+            self.validator_mock,
+            self.page_cache_mock,
+            self.response_cache_mock,
+            self.record_cache_mock,
+            self.fallback_mock,
+            self.click_events_mock
             )
 
         return obj.dispatch_request(alias)
@@ -190,7 +268,7 @@ class TestShowURL(BaseViewTest, unittest.TestCase):
 
         self.create_view_and_call_dispatch_request(preview, alias)
 
-        self.get_or_404_mock.assert_called_once_with(alias)
+        self.get_record_mock.assert_called_once_with(alias)
 
     @parameterized.expand(PREVIEW_NOT_PREVIEW_SETUP)
     def test_dispatch_request_raises_http_error_for(self, _, preview):
@@ -198,7 +276,7 @@ class TestShowURL(BaseViewTest, unittest.TestCase):
 
         :param preview: a preview parameter for ShowURL constructor
         """
-        self.get_or_404_mock.side_effect = HTTPException
+        self.get_record_mock.side_effect = HTTPException
 
         with self.assertRaises(HTTPException):
             self.create_view_and_call_dispatch_request(preview)
@@ -210,9 +288,9 @@ class TestShowURL(BaseViewTest, unittest.TestCase):
         :param preview: a preview parameter for ShowURL constructor
         """
         self.create_view_and_call_dispatch_request(preview)
-        target_url = self.get_or_404_mock()
+        target_url = self.get_record_mock()
 
-        self.get_msg_if_blacklisted_mock.assert_called_once_with(
+        self.get_verdict_mock.assert_called_once_with(
             str(target_url)
         )
 
@@ -223,13 +301,13 @@ class TestShowURL(BaseViewTest, unittest.TestCase):
         :param preview: a preview parameter for ShowURL constructor
         :param spam_msg: a message to be provided by the validator
         """
-        self.get_msg_if_blacklisted_mock.return_value = spam_msg
+        self.get_verdict_mock.return_value = (spam_msg, False)
 
         self.create_view_and_call_dispatch_request(preview)
 
         self.render_template_mock.assert_called_once_with(
             'preview.html',
-            target_url=self.get_or_404_mock(),
+            target_url=self.get_record_mock(),
             warning=spam_msg
         )
 
@@ -240,22 +318,256 @@ class TestShowURL(BaseViewTest, unittest.TestCase):
         :param preview: a preview parameter for ShowURL constructor
         :param spam_msg: a message to be provided by the validator
         """
-        self.get_msg_if_blacklisted_mock.return_value = spam_msg
+        self.get_verdict_mock.return_value = (spam_msg, False)
 
-        expected = self.render_template_mock()
         actual = self.create_view_and_call_dispatch_request(preview)
 
-        self.assertEqual(expected, actual)
+        self.make_response_mock.assert_called_once_with(
+            self.render_template_mock()
+        )
+        self.assertEqual(self.conditional_response, actual)
+
+    @parameterized.expand(WHEN_PREVIEW_SETUP)
+    def test_dispatch_request_caches_preview(self, _, preview, spam_msg):
+        """Test if the method stores a rendered preview in the cache.
+
+        :param preview: a preview parameter for ShowURL constructor
+        :param spam_msg: a message to be provided by the validator
+        """
+        self.get_verdict_mock.return_value = (spam_msg, False)
+
+        self.create_view_and_call_dispatch_request(preview, 'xyz')
+
+        key, page = self.page_cache_mock.set.call_args[0]
+        self.assertEqual((self.request_mock.host, 'xyz'), key)
+        self.assertEqual(self.render_template_mock(), page.body)
+        self.assertEqual(spam_msg, page.warning)
+
+    @parameterized.expand(WHEN_PREVIEW_SETUP)
+    def test_dispatch_request_does_not_render_preview_for_matching_etag(
+            self,
+            _,
+            preview,
+            spam_msg
+    ):
+        """Test if the method skips rendering for a matching ETag.
+
+        :param preview: a preview parameter for ShowURL constructor
+        :param spam_msg: a message to be provided by the validator
+        """
+        self.get_verdict_mock.return_value = (spam_msg, False)
+        self.request_mock.if_none_match.contains.return_value = True
+
+        self.create_view_and_call_dispatch_request(preview)
+
+        self.assertFalse(self.render_template_mock.called)
+        self.assertFalse(self.page_cache_mock.set.called)
+        self.current_app_mock.response_class.assert_called_once_with(
+            status=304
+        )
+
+    def test_etag_depends_on_verdict(self):
+        """Test if ETag values differ for different verdicts."""
+        etags = set()
+        for spam_msg in None, 'This is spam.', 'This is malware.':
+            self.get_verdict_mock.return_value = (spam_msg, False)
+            self.create_view_and_call_dispatch_request(True)
+            etags.add(self.page_cache_mock.set.call_args[0][1].etag)
+
+        self.assertEqual(3, len(etags))
+
+    def test_etag_depends_on_scheme_and_host(self):
+        """Test if ETag values differ for pages with other short URLs."""
+        etags = set()
+        for scheme, host in [
+                ('http', 'a.com'), ('https', 'a.com'), ('http', 'b.com')
+        ]:
+            self.request_mock.scheme = scheme
+            self.request_mock.host = host
+            self.create_view_and_call_dispatch_request(True)
+            etags.add(self.page_cache_mock.set.call_args[0][1].etag)
+
+        self.assertEqual(3, len(etags))
+
+    @parameterized.expand(PREVIEW_NOT_PREVIEW_SETUP)
+    def test_dispatch_request_serves_cached_preview(self, _, preview):
+        """Test if a cached preview is served without a lookup.
+
+        :param preview: a preview parameter for ShowURL constructor
+        """
+        page = self.page_cache_mock.get.return_value = Mock()
+        page.warning = 'This is spam.'
+
+        actual = self.create_view_and_call_dispatch_request(preview)
+
+        self.assertFalse(self.get_record_mock.called)
+        self.assertFalse(self.get_verdict_mock.called)
+        self.assertFalse(self.render_template_mock.called)
+        self.make_response_mock.assert_called_once_with(page.body)
+        self.assertEqual(self.conditional_response, actual)
+
+    def test_dispatch_request_redirects_for_cached_preview(self):
+        """Test if a cached preview without warning leads to redirect."""
+        page = self.page_cache_mock.get.return_value = Mock()
+        page.warning = None
+
+        actual = self.create_view_and_call_dispatch_request(False)
+
+        self.assertFalse(self.get_verdict_mock.called)
+        self.redirect_mock.assert_called_once_with(page.target_url)
+        self.assertEqual(self.redirect_mock.return_value, actual)
+
+    def test_dispatch_request_caches_redirect(self):
+        """Test if a serialized redirect is offered to the cache."""
+        self.get_verdict_mock.return_value = (None, False)
+
+        self.create_view_and_call_dispatch_request(False, 'xyz')
+
+        key, serialized, size = self.response_cache_mock.set.call_args[0]
+        self.assertEqual((self.request_mock.host, 'xyz'), key)
+        self.assertEqual([('Location', 'x')], serialized.headers)
+        self.assertEqual(b'redirect', serialized.body)
+        self.assertEqual(17, size)
+
+    @parameterized.expand([
+        ('redirect', False, None),
+        ('preview', True, None),
+        ('unavailable_source', False, 'Could not be checked')
+    ])
+    def test_dispatch_request_does_not_cache_degraded(
+            self,
+            _,
+            preview,
+            spam_msg
+    ):
+        """Test if responses based on degraded verdicts aren't cached.
+
+        :param preview: a preview parameter for ShowURL constructor
+        :param spam_msg: a spam message returned by the validator
+        """
+        self.get_verdict_mock.return_value = (spam_msg, True)
+
+        self.create_view_and_call_dispatch_request(preview)
+
+        self.assertFalse(self.page_cache_mock.set.called)
+        self.assertFalse(self.response_cache_mock.set.called)
+
+    def test_dispatch_request_serves_cached_redirect(self):
+        """Test if a cached redirect is served without a lookup."""
+        serialized = self.response_cache_mock.get.return_value = Mock()
+
+        actual = self.create_view_and_call_dispatch_request(False)
+
+        self.assertFalse(self.get_record_mock.called)
+        self.assertFalse(self.redirect_mock.called)
+        self.assertTrue(self.click_events_mock.push.called)
+        self.current_app_mock.response_class.assert_called_once_with(
+            serialized.body,
+            status=serialized.status,
+            headers=serialized.headers
+        )
+        self.assertEqual(
+            self.current_app_mock.response_class.return_value,
+            actual
+        )
+
+    def test_dispatch_request_does_not_use_redirect_cache_for_preview(self):
+        """Test if the preview view ignores cached redirects."""
+        self.response_cache_mock.get.return_value = Mock()
+
+        self.create_view_and_call_dispatch_request(True)
+
+        self.assertFalse(self.response_cache_mock.get.called)
+        self.assertTrue(self.render_template_mock.called)
+
+    @parameterized.expand(PREVIEW_NOT_PREVIEW_SETUP)
+    def test_dispatch_request_records_click(self, _, preview):
+        """Test if a click event is pushed for an existing target URL.
+
+        :param preview: a preview parameter for ShowURL constructor
+        """
+        self.create_view_and_call_dispatch_request(preview, 'xyz')
+
+        event = self.click_events_mock.push.call_args[0][0]
+        self.assertEqual('xyz', event.alias)
+        self.assertEqual(self.request_mock.referrer, event.referrer)
+
+    def test_dispatch_request_records_click_for_cached_page(self):
+        """Test if a click event is pushed for a cached page."""
+        self.page_cache_mock.get.return_value = Mock()
+
+        self.create_view_and_call_dispatch_request(False, 'xyz')
+
+        self.assertTrue(self.click_events_mock.push.called)
+
+    def test_dispatch_request_does_not_record_missing_url(self):
+        """Test if no click event is pushed for a missing target URL."""
+        self.get_record_mock.side_effect = HTTPException
+
+        with self.assertRaises(HTTPException):
+            self.create_view_and_call_dispatch_request(False)
+
+        self.assertFalse(self.click_events_mock.push.called)
+
+    def test_dispatch_request_caches_record(self):
+        """Test if a record of the target URL is cached."""
+        self.create_view_and_call_dispatch_request(False, 'xyz')
+
+        self.record_cache_mock.set.assert_called_once_with(
+            'xyz',
+            self.get_record_mock.return_value
+        )
+
+    def test_dispatch_request_uses_cached_record(self):
+        """Test if a cached record is used without a query."""
+        record = self.record_cache_mock.get.return_value = Mock()
+
+        self.create_view_and_call_dispatch_request(False)
+
+        self.assertFalse(self.get_record_mock.called)
+        self.redirect_mock.assert_called_once_with(record)
+
+    def test_dispatch_request_caches_missing_alias(self):
+        """Test if an alias without a target URL is cached."""
+        self.get_record_mock.side_effect = NotFound
+
+        with self.assertRaises(NotFound):
+            self.create_view_and_call_dispatch_request(False, 'xyz')
+
+        self.record_cache_mock.set.assert_called_once_with(
+            'xyz',
+            False,
+            ttl=10
+        )
+
+    def test_dispatch_request_uses_cached_missing_alias(self):
+        """Test if a cached missing alias is not looked up again."""
+        self.record_cache_mock.get.return_value = False
+
+        with self.assertRaises(NotFound):
+            self.create_view_and_call_dispatch_request(False)
+
+        self.assertFalse(self.get_record_mock.called)
+
+    def test_dispatch_request_uses_snapshot_fallback(self):
+        """Test if the record is looked up through the fallback."""
+        self.fallback_mock = Mock()
+        get_record = self.fallback_mock.get_record_or_404
+
+        self.create_view_and_call_dispatch_request(False, 'xyz')
+
+        get_record.assert_called_once_with(self.target_url_class_mock, 'xyz')
+        self.redirect_mock.assert_called_once_with(get_record.return_value)
 
     def test_dispatch_request_redirects(self):
         """Test if redirect function is called."""
         self.create_view_and_call_dispatch_request(False)
 
-        self.redirect_mock.assert_called_once_with(self.get_or_404_mock())
+        self.redirect_mock.assert_called_once_with(self.get_record_mock())
 
     def test_dispatch_request_returns_redirect(self):
         """Test if the method returns result of redirection."""
-        self.get_msg_if_blacklisted_mock.return_value = None
+        self.get_verdict_mock.return_value = (None, False)
 
         expected = self.redirect_mock()
         actual = self.create_view_and_call_dispatch_request(False)
@@ -263,6 +575,161 @@ class TestShowURL(BaseViewTest, unittest.TestCase):
         self.assertEqual(expected, actual)
 
 
+class MetricsTest(unittest.TestCase):
+    """Tests for metrics function.
+
+    :ivar app: a Flask application in whose context the function is
+    called
+    :ivar caches_mock: a mock of a cache registry
+    :ivar validator_mock: a mock of a blacklist validator
+    :ivar db_mock: a mock of a database object with pool monitors
+    """
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['METRICS_TOKEN'] = 'token'
+        self.caches_mock = Mock()
+        self.caches_mock.as_dict.return_value = {'redirects': {'hits': 1}}
+        self.validator_mock = Mock()
+        self.validator_mock.get_source_metrics.return_value = {}
+        self.db_mock = Mock()
+        monitor = Mock()
+        monitor.as_dict.return_value = {'checkouts': 2}
+        self.db_mock.pool_monitors = {None: monitor}
+
+    def _call(self, headers):
+        """Call the function for a request with given headers.
+
+        :param headers: a dictionary of headers of the request
+        """
+        with self.app.test_request_context(headers=headers):
+            return metrics(self.caches_mock, self.validator_mock, self.db_mock)
+
+    def test_metrics_returns_statistics(self):
+        """Test if statistics are served for a valid token."""
+        actual = self._call({'Authorization': 'Bearer token'}).get_json()
+
+        self.assertEqual({'redirects': {'hits': 1}}, actual['caches'])
+        self.assertEqual(
+            {'default': {'checkouts': 2}},
+            actual['connection_pools']
+        )
+
+    def test_metrics_rejects_invalid_token(self):
+        """Test if 403 error is raised for an invalid token."""
+        with self.assertRaises(HTTPException) as context:
+            self._call({'Authorization': 'Bearer other'})
+
+        self.assertEqual(403, context.exception.code)
+
+    def test_metrics_rejects_non_ascii_token(self):
+        """Test if 403 error is raised for a non-ASCII token."""
+        with self.assertRaises(HTTPException) as context:
+            self._call({'Authorization': 'Bearer t\xf6ken'})
+
+        self.assertEqual(403, context.exception.code)
+
+    def test_metrics_are_not_served_without_token(self):
+        """Test if 404 error is raised when no token is configured."""
+        self.app.config['METRICS_TOKEN'] = None
+
+        with self.assertRaises(HTTPException) as context:
+            self._call({})
+
+        self.assertEqual(404, context.exception.code)
+
+
+class ErrorPageTest(unittest.TestCase):
+    """Tests for ErrorPage class.
+
+    :ivar cache_control_mock: a mock of a function setting cache
+    control headers, used by tested instance
+    :ivar tested_instance: instance of ErrorPage to be used
+    during tests
+    """
+
+    def setUp(self):
+        self.render_template_patcher = patch(
+            'url_shortener.views.render_template'
+        )
+        self.render_template_mock = self.render_template_patcher.start()
+        self.render_template_mock.return_value = (
+            '<p>{}</p>'.format(ErrorPage._URL_PLACEHOLDER)
+        )
+
+        self.inject_year_patcher = patch('url_shortener.views.inject_year')
+        self.inject_year_mock = self.inject_year_patcher.start()
+        self.inject_year_mock.return_value = {'year': 2016}
+
+        self.request_patcher = patch(
+            'url_shortener.views.request',
+            MagicMock()
+        )
+        self.request_mock = self.request_patcher.start()
+        self.request_mock.url = 'http://abc.com/<x>'
+
+        self.current_app_patcher = patch(
+            'url_shortener.views.current_app',
+            MagicMock()
+        )
+        self.current_app_mock = self.current_app_patcher.start()
+
+        self.cache_control_mock = Mock()
+        self.tested_instance = ErrorPage(
+            'error.html',
+            404,
+            self.cache_control_mock
+        )
+
+    def tearDown(self):
+        self.render_template_patcher.stop()
+        self.inject_year_patcher.stop()
+        self.request_patcher.stop()
+        self.current_app_patcher.stop()
+
+    def test_get_response_returns_page_with_escaped_url(self):
+        """Test if the response contains the escaped requested URL."""
+        response_class = self.current_app_mock.response_class
+
+        actual = self.tested_instance.get_response()
+
+        response_class.assert_called_once_with(
+            b'<p>http://abc.com/&lt;x&gt;</p>',
+            status=404,
+            mimetype='text/html'
+        )
+        self.assertEqual(response_class.return_value, actual)
+
+    def test_get_response_sets_cache_control(self):
+        """Test if cache control headers are set for the response."""
+        response = self.tested_instance.get_response()
+
+        self.cache_control_mock.assert_called_once_with(
+            response.cache_control
+        )
+
+    def test_get_response_renders_template_once(self):
+        """Test if the page is rendered only for the first response."""
+        self.tested_instance.get_response()
+        self.tested_instance.get_response()
+
+        self.assertEqual(1, self.render_template_mock.call_count)
+
+    def test_get_response_renders_template_for_new_year(self):
+        """Test if the page is rendered again when the year changes."""
+        self.tested_instance.get_response()
+        self.inject_year_mock.return_value = {'year': 2017}
+
+        self.tested_instance.get_response()
+
+        self.assertEqual(2, self.render_template_mock.call_count)
+        self.render_template_mock.assert_called_with(
+            'error.html',
+            url=ErrorPage._URL_PLACEHOLDER,
+            year=2017
+        )
+
+
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
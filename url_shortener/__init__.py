@@ -19,6 +19,7 @@ __email__ = "piotr.rusin88@gmail.com"
 __license__ = 'MIT'
 __copyright__ = 'Copyright 2016 Piotr Rusin'
 
+import atexit
 import logging
 from logging.handlers import TimedRotatingFileHandler
 
@@ -26,8 +27,12 @@ from flask import Flask
 from flask_injector import FlaskInjector
 
 from .views import url_shortener
+from .analytics import AnalyticsModule, click_count_flusher
+from .caching import CachingModule
 from .forms import configure as configure_form
 from .domain_and_persistence import DomainAndPersistenceModule, SQLAlchemy
+from .prefork import preload
+from .templating import set_up_bytecode_cache, precompile_templates
 from .validation import ValidationModule
 
 
@@ -57,6 +62,8 @@ def _get_injector(app):
         modules=[
             DomainAndPersistenceModule(app),
             ValidationModule(app),
+            CachingModule(app),
+            AnalyticsModule(app),
             configure_form
         ],
         use_annotations=True
@@ -85,7 +92,34 @@ def get_app_and_db(configuration, from_envvar=False):
         app.config.from_pyfile(configuration)
 
     _set_up_logging(app)
+    set_up_bytecode_cache(app)
     app.register_blueprint(url_shortener)
     injector = _get_injector(app)
-
-    return app, injector.injector.get(SQLAlchemy)
+    app.extensions['injector'] = injector.injector
+
+    if app.config['PRECOMPILE_TEMPLATES']:
+        precompile_templates(app)
+
+    if app.config['CLICK_BUFFER_SIZE'] > 0:
+        flusher = injector.injector.get(click_count_flusher)
+        app.before_first_request(flusher.start)
+        atexit.register(flusher.stop)
+
+    db = injector.injector.get(SQLAlchemy)
+    if app.config['CACHE_WARMING_LIMIT'] > 0:
+        from .cache_warming import warm_caches
+        with app.app_context():
+            warm_caches(
+                app,
+                injector.injector,
+                app.config['CACHE_WARMING_LIMIT'],
+                app.config['CACHE_WARMING_HOURS'],
+                app.config['CACHE_WARMING_ACCESS_LOG']
+            )
+
+    if app.config['PREFORK_PRELOAD']:
+        binds = [None] + list(app.config['SQLALCHEMY_BINDS'] or ())
+        engines = [db.get_engine(app, bind) for bind in binds]
+        preload(app, injector.injector, engines)
+
+    return app, db
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""Strategies of generating new aliases.
+
+The default strategy builds an alias character by character, replaces
+homoglyphs in it and repeats the generation if the result is too short.
+Other strategies choose an index in a space of aliases that don't
+contain homoglyphs, and convert it to an alias, so that each attempt
+produces a valid alias:
+
+* random_index: the index is chosen with a pseudorandom generator
+* secure_random_index: the index is chosen with a cryptographically
+  secure generator
+* scrambled_counter: the index is a value of a counter permuted with
+  a keyed bijection, so that subsequent aliases are unique and don't
+  reveal the order in which they were created
+"""
+from bisect import bisect_right
+from hashlib import blake2b
+from itertools import count
+from random import randrange
+from secrets import randbelow
+
+
+class AliasSpace(object):
+    """An indexed set of canonical aliases of a range of lengths.
+
+    An alias is canonical if it doesn't contain any homoglyph, so it
+    isn't changed by homoglyph replacement. Canonical aliases of each
+    length are counted with dynamic programming over an automaton
+    recognizing the homoglyphs, and indexed by length first, and then
+    in the order of the alphabet. Converting an index to an alias and
+    back takes time proportional to the length of the alias.
+
+    :ivar alphabet: characters used in the aliases
+    :ivar min_length: a minimum length of the aliases
+    :ivar max_length: a maximum length of the aliases
+    :ivar size: a number of the aliases
+    :ivar _transitions: a list of tuples containing, for each state of
+    the automaton, a state reached after reading each character of
+    the alphabet, or None if the character completes a homoglyph.
+    The initial state is 0.
+    :ivar _cumulative: a list containing, for each number of remaining
+    characters, a list of tuples storing, for each state, cumulative
+    numbers of canonical completions starting with subsequent
+    characters of the alphabet
+    :ivar _offsets: a dictionary mapping lengths to indexes of the first
+    aliases of the lengths
+    """
+
+    def __init__(self, alphabet, homoglyphs, min_length, max_length):
+        """Initialize a new instance.
+
+        :param alphabet: characters that can appear in aliases
+        :param homoglyphs: strings that are replaced in aliases
+        :param min_length: a minimum length of the aliases
+        :param max_length: a maximum length of the aliases
+        """
+        self.alphabet = alphabet
+        self.min_length = min_length
+        self.max_length = max_length
+        self._indexes = {c: i for i, c in enumerate(alphabet)}
+        self._transitions = self._get_transitions(
+            [h for h in homoglyphs if set(h) <= set(alphabet)]
+        )
+        self._cumulative = self._count(max_length)
+        self._offsets = {}
+        self.size = 0
+        for length in range(min_length, max_length + 1):
+            self._offsets[length] = self.size
+            self.size += self.count(length)
+
+    def _get_transitions(self, patterns):
+        """Build an automaton detecting patterns in strings.
+
+        Each state of the automaton is the longest suffix of the read
+        string that is a prefix of a pattern.
+
+        :param patterns: a list of strings to be detected
+        :returns: a list of transitions of the states
+        """
+        prefixes = sorted(
+            {''} | {p[:i] for p in patterns for i in range(len(p))}
+        )
+        state_indexes = {prefix: i for i, prefix in enumerate(prefixes)}
+        transitions = []
+        for prefix in prefixes:
+            row = []
+            for char in self.alphabet:
+                string = prefix + char
+                if any(string.endswith(p) for p in patterns):
+                    row.append(None)
+                    continue
+                longest = next(
+                    string[i:] for i in range(len(string) + 1)
+                    if string[i:] in state_indexes
+                )
+                row.append(state_indexes[longest])
+            transitions.append(tuple(row))
+        return transitions
+
+    def _count(self, max_length):
+        """Count canonical completions for each state and length.
+
+        :param max_length: a maximum number of remaining characters
+        :returns: a list of cumulative counts for lengths from zero
+        to the maximum
+        """
+        counts = [1] * len(self._transitions)
+        cumulative = [None]
+        for _ in range(max_length):
+            rows = []
+            for transitions in self._transitions:
+                row = [0]
+                for state in transitions:
+                    completions = 0 if state is None else counts[state]
+                    row.append(row[-1] + completions)
+                rows.append(tuple(row))
+            cumulative.append(rows)
+            counts = [row[-1] for row in rows]
+        return cumulative
+
+    def count(self, length):
+        """Get the number of canonical aliases of given length.
+
+        :param length: a positive length not greater than max_length
+        :returns: the number of the aliases
+        """
+        return self._cumulative[length][0][-1]
+
+    def unrank(self, index):
+        """Get an alias with given index.
+
+        :param index: an integer between zero and the size of the space
+        :returns: the alias
+        :raises IndexError: if the index is out of the range
+        """
+        if not 0 <= index < self.size:
+            raise IndexError('The index is out of range')
+        length = self.min_length
+        while index >= self._offsets[length] + self.count(length):
+            length += 1
+        index -= self._offsets[length]
+        state = 0
+        characters = []
+        for remaining in range(length, 0, -1):
+            row = self._cumulative[remaining][state]
+            position = bisect_right(row, index) - 1
+            index -= row[position]
+            characters.append(self.alphabet[position])
+            state = self._transitions[state][position]
+        return ''.join(characters)
+
+    def rank(self, alias):
+        """Get an index of given alias.
+
+        :param alias: a canonical alias of a length in the range of
+        the space
+        :returns: the index
+        :raises ValueError: if the alias is not included in the space
+        """
+        if not self.min_length <= len(alias) <= self.max_length:
+            raise ValueError('The length of the alias is out of range')
+        index = self._offsets[len(alias)]
+        state = 0
+        for remaining, char in zip(range(len(alias), 0, -1), alias):
+            position = self._indexes.get(char)
+            if position is None:
+                raise ValueError(
+                    "The alias contains unsupported character: '{}'".format(
+                        char
+                    )
+                )
+            index += self._cumulative[remaining][state][position]
+            state = self._transitions[state][position]
+            if state is None:
+                raise ValueError('The alias contains a homoglyph')
+        return index
+
+
+class FeistelPermutation(object):
+    """A keyed bijection of integers from zero to a given size.
+
+    Integers are permuted by a Feistel network operating on the smallest
+    number of bits able to represent all of them. If the number is odd,
+    the halves differ by one bit and swap their widths in each round.
+    Results exceeding the size are permuted again until they fit in
+    the range, which keeps the mapping bijective.
+
+    :cvar ROUNDS: a number of rounds of the network
+    :ivar size: a number of permuted integers
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, size, key):
+        """Initialize a new instance.
+
+        :param size: a number of permuted integers
+        :param key: a string or bytes used as a key of round functions
+        """
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        self.size = size
+        self._key = blake2b(key, digest_size=32).digest()
+        bits = max(2, (size - 1).bit_length())
+        self._widths = bits // 2, bits - bits // 2
+
+    def _round(self, number, value):
+        digest = blake2b(
+            value.to_bytes(16, 'big'),
+            digest_size=8,
+            key=self._key,
+            person=bytes([number]) * 16
+        ).digest()
+        return int.from_bytes(digest, 'big')
+
+    def _encrypt(self, value):
+        left_width, right_width = self._widths
+        left, right = value >> right_width, value & ((1 << right_width) - 1)
+        for number in range(self.ROUNDS):
+            mask = (1 << left_width) - 1
+            left, right = right, left ^ (self._round(number, right) & mask)
+            left_width, right_width = right_width, left_width
+        return (left << right_width) | right
+
+    def __call__(self, value):
+        """Get a permuted integer.
+
+        :param value: an integer between zero and the size
+        :returns: another integer from the same range
+        """
+        if not 0 <= value < self.size:
+            raise ValueError('The value is out of range')
+        value = self._encrypt(value)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+
+class RandomIndexStrategy(object):
+    """Creates aliases with pseudorandomly chosen indexes.
+
+    :ivar space: an instance of AliasSpace
+    """
+
+    def __init__(self, space):
+        """Initialize a new instance.
+
+        :param space: an instance of AliasSpace
+        """
+        self.space = space
+
+    def __call__(self):
+        """Create a new alias."""
+        return self.space.unrank(randrange(self.space.size))
+
+
+class SecureRandomIndexStrategy(RandomIndexStrategy):
+    """Creates aliases with indexes chosen by a secure generator."""
+
+    def __call__(self):
+        """Create a new alias."""
+        return self.space.unrank(randbelow(self.space.size))
+
+
+class ScrambledCounterStrategy(object):
+    """Creates aliases with permuted values of a counter.
+
+    Aliases created by one instance are unique until all aliases of
+    the space are used. Each process starts counting at a random
+    value, so aliases created by different processes rarely collide.
+
+    :ivar space: an instance of AliasSpace
+    :ivar permutation: an instance of FeistelPermutation
+    """
+
+    def __init__(self, space, key, start=None):
+        """Initialize a new instance.
+
+        :param space: an instance of AliasSpace
+        :param key: a secret key of the permutation
+        :param start: an initial value of the counter. By default, it
+        is chosen randomly.
+        """
+        self.space = space
+        self.permutation = FeistelPermutation(space.size, key)
+        if start is None:
+            start = randbelow(space.size)
+        self._counter = count(start)
+
+    def __call__(self):
+        """Create a new alias."""
+        index = next(self._counter) % self.space.size
+        return self.space.unrank(self.permutation(index))
+
+
+STRATEGY_NAMES = (
+    'random_characters', 'random_index', 'secure_random_index',
+    'scrambled_counter'
+)
+
+
+def get_alias_strategy(name, alias_factory, key):
+    """Get a strategy of creating aliases.
+
+    :param name: one of STRATEGY_NAMES
+    :param alias_factory: an instance of AliasFactory providing
+    the alphabet and lengths of aliases
+    :param key: a secret key used by scrambled_counter strategy
+    :returns: a function returning new aliases
+    :raises ValueError: if the name is not a name of a strategy
+    """
+    if name == 'random_characters':
+        return alias_factory.create_from_characters
+    space = AliasSpace(
+        alias_factory.alphabet,
+        alias_factory.homoglyphs,
+        alias_factory.min_new_alias_length,
+        alias_factory.max_new_alias_length
+    )
+    if name == 'random_index':
+        return RandomIndexStrategy(space)
+    if name == 'secure_random_index':
+        return SecureRandomIndexStrategy(space)
+    if name == 'scrambled_counter':
+        return ScrambledCounterStrategy(space, key)
+    raise ValueError(
+        'Unknown alias strategy: {}. Available strategies: {}'.format(
+            name,
+            ', '.join(STRATEGY_NAMES)
+        )
+    )
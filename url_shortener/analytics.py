@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""Collection of click statistics for short URLs.
+
+Clicks are recorded without accessing the database while handling
+requests: each click is pushed into an in-memory buffer, and a background
+thread periodically aggregates buffered clicks into per-alias,
+per-minute counts and adds them to the counts stored in the database.
+"""
+from collections import Counter, deque, namedtuple
+import datetime
+import os
+from threading import Event, Lock, Thread
+
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from injector import Module, Key, inject, singleton
+from sqlalchemy import and_, bindparam, select
+from sqlalchemy.exc import IntegrityError
+
+from .domain_and_persistence import click_count_table, target_url_class
+
+
+ClickEvent = namedtuple(
+    'ClickEvent',
+    ['alias', 'timestamp', 'referrer', 'user_agent']
+)
+
+
+class ClickEventBuffer(object):
+    """A bounded buffer of click events that doesn't use locks.
+
+    Events are pushed by threads handling requests and drained by
+    a single consumer. Both operations rely on appending to and
+    popping from a deque being atomic, so pushing an event never
+    blocks. When the buffer is full, new events are dropped and
+    counted instead.
+
+    The capacity and the number of dropped events are approximate
+    when many threads push events at the same time.
+
+    :ivar capacity: a maximum number of stored events. If it is not
+    greater than zero, the buffer doesn't store any events.
+    :ivar dropped: a number of events dropped because the buffer
+    was full
+    """
+
+    def __init__(self, capacity):
+        """Initialize a new instance.
+
+        :param capacity: a maximum number of stored events
+        """
+        self.capacity = capacity
+        self.dropped = 0
+        self._events = deque()
+
+    def __len__(self):
+        """Get the number of events currently stored in the buffer."""
+        return len(self._events)
+
+    def push(self, event):
+        """Store an event, unless the buffer is full.
+
+        :param event: an instance of ClickEvent
+        :returns: True if the event was stored, False if it was dropped
+        """
+        if self.capacity <= 0:
+            return False
+        if len(self._events) >= self.capacity:
+            self.dropped += 1
+            return False
+        self._events.append(event)
+        return True
+
+    def drain(self):
+        """Remove and return all events stored in the buffer.
+
+        :returns: a list of events, from the oldest to the newest
+        """
+        return [self._events.popleft() for _ in range(len(self._events))]
+
+
+def aggregate(events):
+    """Count click events per alias and minute.
+
+    :param events: instances of ClickEvent
+    :returns: an instance of collections.Counter mapping tuples
+    containing an alias and a datetime of the start of a minute (in UTC)
+    to numbers of clicks
+    """
+    counts = Counter()
+    for event in events:
+        timestamp = int(event.timestamp)
+        minute = datetime.datetime.utcfromtimestamp(timestamp - timestamp % 60)
+        counts[event.alias, minute] += 1
+    return counts
+
+
+class ClickCountStore(object):
+    """Adds click counts to a database table.
+
+    The table must have "alias", "minute" and "count" columns, with
+    the first two forming its primary key. Aliases are stored as
+    integers.
+    """
+
+    def __init__(self, engine, table, alias_type):
+        """Initialize a new instance.
+
+        :param engine: an engine connected to the database containing
+        the table
+        :param table: an instance of sqlalchemy.Table
+        :param alias_type: a column type of aliases of target URLs,
+        used for converting aliases to integers
+        """
+        self._engine = engine
+        self._table = table
+        self._alias_type = alias_type
+
+    def add(self, counts):
+        """Add click counts to the stored ones.
+
+        All counts are added in a single transaction, with an upsert
+        statement on PostgreSQL. Other databases receive separate bulk
+        updates and inserts, retried once if another process inserts
+        a count for the same alias and minute at the same time.
+
+        :param counts: a mapping of tuples containing an alias and
+        a minute to numbers of clicks
+        """
+        rows = Counter()
+        for (alias, minute), number in counts.items():
+            integer = self._alias_type.process_bind_param(alias, None)
+            rows[integer, minute] += number
+        if not rows:
+            return
+
+        rows = [
+            {'alias': alias, 'minute': minute, 'count': number}
+            for (alias, minute), number in rows.items()
+        ]
+        if self._engine.dialect.name == 'postgresql':
+            self._upsert(rows)
+            return
+
+        try:
+            self._update_or_insert(rows)
+        except IntegrityError:
+            self._update_or_insert(rows)
+
+    def _upsert(self, rows):
+        from sqlalchemy.dialects.postgresql import insert
+        statement = insert(self._table)
+        statement = statement.on_conflict_do_update(
+            index_elements=['alias', 'minute'],
+            set_={'count': self._table.c.count + statement.excluded.count}
+        )
+        with self._engine.begin() as connection:
+            connection.execute(statement, rows)
+
+    def _update_or_insert(self, rows):
+        columns = self._table.c
+        with self._engine.begin() as connection:
+            existing = set(
+                tuple(row) for row in connection.execute(
+                    select([columns.alias, columns.minute]).where(
+                        and_(
+                            columns.alias.in_({r['alias'] for r in rows}),
+                            columns.minute.in_({r['minute'] for r in rows})
+                        )
+                    )
+                )
+            )
+            updated = [
+                {'key_alias': r['alias'], 'key_minute': r['minute'],
+                 'added': r['count']}
+                for r in rows if (r['alias'], r['minute']) in existing
+            ]
+            inserted = [
+                r for r in rows if (r['alias'], r['minute']) not in existing
+            ]
+            if updated:
+                connection.execute(
+                    self._table.update().where(
+                        and_(
+                            columns.alias == bindparam('key_alias'),
+                            columns.minute == bindparam('key_minute')
+                        )
+                    ).values(count=columns.count + bindparam('added')),
+                    updated
+                )
+            if inserted:
+                connection.execute(self._table.insert(), inserted)
+
+
+class ClickCountFlusher(object):
+    """Periodically moves click events from a buffer to a store.
+
+    The flushing thread is started separately in each process, so that
+    workers of a preforking server flush their own buffers. Counts that
+    the store fails to add are kept and added with the next batch.
+    """
+
+    def __init__(self, events, store, interval, logger):
+        """Initialize a new instance.
+
+        :param events: an instance of ClickEventBuffer to be drained
+        :param store: an instance of ClickCountStore receiving
+        aggregated counts
+        :param interval: a number of seconds between flushes
+        :param logger: a logger used for reporting errors and dropped
+        events
+        """
+        self._events = events
+        self._store = store
+        self._interval = interval
+        self._logger = logger
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._pending = Counter()
+        self._pid = None
+        self._stopped = Event()
+        self._reported_dropped = 0
+
+    def flush(self):
+        """Aggregate buffered events and add their counts to the store.
+
+        :raises Exception: an error raised by the store. The counts
+        are kept, to be added by the next call.
+        """
+        with self._flush_lock:
+            dropped = self._events.dropped
+            if dropped > self._reported_dropped:
+                self._logger.warning(
+                    '{} click events dropped because the buffer was full.'
+                    ''.format(dropped - self._reported_dropped)
+                )
+                self._reported_dropped = dropped
+
+            counts = self._pending + aggregate(self._events.drain())
+            if counts:
+                try:
+                    self._store.add(counts)
+                except Exception:
+                    self._pending = counts
+                    raise
+            self._pending = Counter()
+
+    def start(self):
+        """Start flushing in a background thread of the current process.
+
+        The method does nothing if the thread has already been started
+        in the process.
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopped = Event()
+            Thread(
+                target=self._run,
+                args=(self._stopped,),
+                name='click-count-flusher',
+                daemon=True
+            ).start()
+
+    def stop(self):
+        """Stop the background thread and flush remaining events."""
+        self._stopped.set()
+        self.flush()
+
+    def _run(self, stopped):
+        while not stopped.wait(self._interval):
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-except
+                self._logger.exception('Click counts could not be stored.')
+
+
+click_event_buffer = Key('click_event_buffer')
+click_count_flusher = Key('click_count_flusher')
+
+
+class AnalyticsModule(Module):
+    """Configures injection of click analytics services.
+
+    The event buffer is created eagerly, and the flusher when it is
+    needed for the first time.
+    """
+
+    def __init__(self, app):
+        """Initialize a new instance.
+
+        :param app: an instance of Flask application for which
+        the services are being configured
+        """
+        self.app = app
+
+    def configure(self, binder):
+        """Configure dependencies.
+
+        :param binder: an instance of injector.Binder used for binding
+        interfaces to implementations
+        """
+        binder.bind(
+            click_event_buffer,
+            to=ClickEventBuffer(self.app.config['CLICK_BUFFER_SIZE']),
+            scope=singleton
+        )
+        binder.bind(
+            click_count_flusher,
+            to=self.get_click_count_flusher,
+            scope=singleton
+        )
+
+    @inject
+    def get_click_count_flusher(
+            self,
+            app: Flask,
+            db: SQLAlchemy,
+            events: click_event_buffer,
+            table: click_count_table,
+            target_url_cls: target_url_class
+    ):
+        """Get a ClickCountFlusher object to be provided."""
+        store = ClickCountStore(
+            db.get_engine(app),
+            table,
+            target_url_cls.__table__.c.alias.type
+        )
+        return ClickCountFlusher(
+            events,
+            store,
+            app.config['CLICK_FLUSH_INTERVAL'],
+            app.logger
+        )
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""An ASGI entry point of the application.
+
+Redirects are served by an asyncio-based application. Operations that
+block - database lookups and blacklist queries - are performed by
+a pool of threads, so that the event loop keeps accepting requests
+while they are in progress, and redirects for aliases whose redirect
+responses or pages are cached don't leave the event loop at all.
+Redirects are stored in the same redirect cache as the one used by
+the WSGI application, unless their verdicts are degraded.
+
+All other requests, including those for previews, the URL form,
+missing aliases and redirects to URLs recognized as spam, are passed to
+the WSGI application, which is also called in the pool of threads.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+import sys
+from time import time
+
+from sqlalchemy.exc import StatementError
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+from werkzeug.utils import redirect
+
+from .analytics import ClickEvent, click_event_buffer, click_count_flusher
+from .caching import preview_cache, redirect_cache, target_url_cache
+from .coalescing import AsyncSingleFlight
+from .domain_and_persistence import (
+    AliasValueError, snapshot_fallback, target_url_class
+)
+from .validation import BlacklistValidator
+from .views import cache_redirect, get_cached_record
+
+
+def get_environ(scope, body):
+    """Get a WSGI environment for an HTTP request received through ASGI.
+
+    :param scope: a connection scope of the request
+    :param body: the body of the request, as bytes
+    :returns: a dictionary
+    """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope['http_version']),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'CONTENT_LENGTH': str(len(body))
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ[name] = value
+            continue
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = 'HTTP_' + name
+        environ[key] = (
+            environ[key] + ',' + value if key in environ else value
+        )
+    return environ
+
+
+class ASGIApplication(object):
+    """An ASGI application serving the URL shortener.
+
+    :ivar app: a Flask application created with get_app_and_db
+    :ivar executor: an instance of concurrent.futures.Executor
+    performing blocking operations
+    :ivar _resolutions: an instance of AsyncSingleFlight coalescing
+    concurrent resolutions of the same alias, so that waiting for
+    them doesn't occupy threads of the executor
+    """
+
+    def __init__(self, app, executor=None):
+        """Initialize a new instance.
+
+        :param app: a Flask application created with get_app_and_db
+        :param executor: an executor to be used for blocking
+        operations. If it is None, a pool of ASGI_THREADS threads is
+        created.
+        """
+        self.app = app
+        self.executor = executor or ThreadPoolExecutor(
+            app.config['ASGI_THREADS'],
+            thread_name_prefix='asgi'
+        )
+        self._injector = app.extensions['injector']
+        self._resolutions = AsyncSingleFlight()
+
+    async def __call__(self, scope, receive, send):
+        """Handle an ASGI connection.
+
+        :param scope: a connection scope
+        :param receive: a coroutine function receiving events
+        :param send: a coroutine function sending events
+        """
+        if scope['type'] == 'lifespan':
+            await self._handle_lifespan(receive, send)
+        elif scope['type'] == 'http':
+            alias = self._match_redirect(scope)
+            if alias is None or not await self._redirect(scope, send, alias):
+                await self._call_wsgi_app(scope, receive, send)
+
+    async def _handle_lifespan(self, receive, send):
+        """Handle startup and shutdown of the server.
+
+        Click events are flushed by a thread started on startup, because
+        redirects served by this application don't trigger hooks of
+        the WSGI application that would start it.
+
+        :param receive: a coroutine function receiving events
+        :param send: a coroutine function sending events
+        """
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if self.app.config['CLICK_BUFFER_SIZE'] > 0:
+                    self._injector.get(click_count_flusher).start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    def _get_header(scope, name, default=None):
+        for key, value in scope['headers']:
+            if key == name:
+                return value.decode('latin-1')
+        return default
+
+    def _match_redirect(self, scope):
+        """Get an alias of a redirect requested with given scope.
+
+        :param scope: a connection scope of an HTTP request
+        :returns: the alias, or None if the request is not a GET or
+        HEAD request for a redirect
+        """
+        if scope['method'] not in ('GET', 'HEAD'):
+            return None
+        adapter = self.app.url_map.bind(
+            self._get_header(scope, b'host', 'localhost'),
+            script_name=scope.get('root_path') or None,
+            url_scheme=scope.get('scheme', 'http')
+        )
+        try:
+            endpoint, arguments = adapter.match(scope['path'], 'GET')
+        except (HTTPException, RequestRedirect):
+            return None
+        if endpoint != 'url_shortener.redirect_for':
+            return None
+        return arguments['alias']
+
+    def _resolve(self, alias):
+        """Get a target URL for an alias and its blacklist verdict.
+
+        This method blocks, so it is called in the executor. Target
+        URLs, and aliases without them, are looked up in the same cache
+        of records as the one used by the WSGI application.
+
+        :param alias: the alias
+        :returns: a tuple containing the target URL, a message of
+        the spam verdict for it and a boolean value signifying if
+        the verdict is degraded, or None if there is no target URL
+        for the alias
+        """
+        target_url_cls = self._injector.get(target_url_class)
+        fallback = self._injector.get(snapshot_fallback)
+        lookup = target_url_cls.get_record_or_404
+        if fallback is not None:
+            lookup = partial(fallback.get_record_or_404, target_url_cls)
+        with self.app.app_context():
+            try:
+                target_url = get_cached_record(
+                    self._injector.get(target_url_cache),
+                    alias,
+                    lookup
+                )
+            except (HTTPException, AliasValueError):
+                return None
+            except StatementError as error:
+                if isinstance(error.orig, AliasValueError):
+                    return None
+                raise
+            validator = self._injector.get(BlacklistValidator)
+            target = str(target_url)
+            return (target,) + validator.get_verdict(target)
+
+    async def _redirect(self, scope, send, alias):
+        """Send a redirect for an alias, if possible.
+
+        :param scope: a connection scope of the request
+        :param send: a coroutine function sending events
+        :param alias: the alias of a target URL
+        :returns: True if the redirect was sent, False if the request
+        must be handled by the WSGI application
+        """
+        key = self._get_header(scope, b'host'), alias
+        response_cache = self._injector.get(redirect_cache)
+        serialized = response_cache.get(key)
+        if serialized is not None:
+            self._record_click(scope, alias)
+            await self._send(scope, send, *serialized)
+            return True
+
+        page = self._injector.get(preview_cache).get(key)
+        if page is not None:
+            if page.warning:
+                return False
+            response = redirect(page.target_url)
+        else:
+            loop = asyncio.get_event_loop()
+            result = await self._resolutions.do(
+                key,
+                loop.run_in_executor,
+                self.executor,
+                self._resolve,
+                alias
+            )
+            if result is None or result[1]:
+                return False
+            response = redirect(result[0])
+            if not result[2]:
+                cache_redirect(response_cache, key, response)
+
+        self._record_click(scope, alias)
+        await self._send(
+            scope,
+            send,
+            response.status_code,
+            response.headers.to_wsgi_list(),
+            response.get_data()
+        )
+        return True
+
+    def _record_click(self, scope, alias):
+        """Record a click on a short URL.
+
+        :param scope: a connection scope of the request
+        :param alias: the alias of a target URL
+        """
+        self._injector.get(click_event_buffer).push(
+            ClickEvent(
+                alias,
+                time(),
+                self._get_header(scope, b'referer'),
+                self._get_header(scope, b'user-agent', '')
+            )
+        )
+
+    @staticmethod
+    async def _send(scope, send, status, headers, body):
+        """Send a response.
+
+        :param scope: a connection scope of the request
+        :param send: a coroutine function sending events
+        :param status: a status code of the response
+        :param headers: a list of tuples containing names and values
+        of headers, as strings
+        :param body: the body of the response, as bytes. It is not sent
+        in responses to HEAD requests.
+        """
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (k.encode('latin-1'), v.encode('latin-1'))
+                for k, v in headers
+            ]
+        })
+        if scope['method'] == 'HEAD':
+            body = b''
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _call_wsgi_app(self, scope, receive, send):
+        """Pass a request to the WSGI application.
+
+        :param scope: a connection scope of the request
+        :param receive: a coroutine function receiving events
+        :param send: a coroutine function sending events
+        """
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        environ = get_environ(scope, b''.join(chunks))
+
+        loop = asyncio.get_event_loop()
+        status, headers, body = await loop.run_in_executor(
+            self.executor,
+            self._run_wsgi_app,
+            environ
+        )
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': headers
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    def _run_wsgi_app(self, environ):
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            response[:] = [
+                int(status.split(' ', 1)[0]),
+                [
+                    (k.encode('latin-1'), v.encode('latin-1'))
+                    for k, v in headers
+                ]
+            ]
+
+        result = self.app(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response[0], response[1], body
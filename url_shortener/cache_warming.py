@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""Warming of the cache of target URLs.
+
+After a deploy, caches of new worker processes are empty, so requests
+for popular aliases all query the database at once. Warming loads target
+URLs of the most requested aliases in bulk and stores them in the cache
+before workers start handling requests.
+
+The most requested aliases are read from recent click counts recorded
+by the application, or from an access log of the HTTP server.
+"""
+from collections import Counter
+import datetime
+import re
+
+from sqlalchemy import func, select, desc
+from sqlalchemy.exc import SQLAlchemyError
+
+from .caching import get_cache_registry
+from .domain_and_persistence import (
+    click_count_table, target_url_class, SQLAlchemy
+)
+
+ACCESS_LOG_PATTERN = re.compile(
+    r'"(?:GET|HEAD) /(?:preview/)?([^/?#\s"]+)(?:\?[^\s"]*)? HTTP/[^"]*"'
+    r' [23]\d\d '
+)
+
+
+def get_logged_clicks(lines):
+    """Count requests for aliases in lines of an access log.
+
+    The log must use Common or Combined Log Format. Only successful
+    and redirected requests for short and preview URLs are counted.
+
+    :param lines: an iterable of lines of the log
+    :returns: an instance of collections.Counter mapping requested
+    aliases to numbers of requests
+    """
+    counts = Counter()
+    for line in lines:
+        match = ACCESS_LOG_PATTERN.search(line)
+        if match is not None:
+            counts[match.group(1)] += 1
+    return counts
+
+
+def get_recorded_clicks(engine, table, alias_type, since, limit):
+    """Get the most clicked aliases from recorded click counts.
+
+    :param engine: an engine connected to a database storing the counts
+    :param table: a table of per-minute click counts
+    :param alias_type: a column type of aliases of target URLs, used
+    for converting stored integers to aliases
+    :param since: a datetime (in UTC) of the first minute whose clicks
+    are counted
+    :param limit: a maximum number of aliases to be returned
+    :returns: an instance of collections.Counter mapping the aliases to
+    numbers of their clicks
+    """
+    clicks = func.sum(table.c.count).label('clicks')
+    statement = select([table.c.alias, clicks]).where(
+        table.c.minute >= since
+    ).group_by(table.c.alias).order_by(desc(clicks)).limit(limit)
+    with engine.connect() as connection:
+        return Counter({
+            alias_type.process_result_value(integer, None): number
+            for integer, number in connection.execute(statement)
+        })
+
+
+def normalize_aliases(counts, alias_type):
+    """Convert requested aliases to the form in which they are stored.
+
+    Homoglyphs in the aliases are replaced, and counts of aliases
+    referring to the same target URL are merged. Strings that are not
+    valid aliases, for example: names of static files, are skipped.
+
+    :param counts: a mapping of aliases to numbers of requests
+    :param alias_type: a column type of aliases of target URLs
+    :returns: an instance of collections.Counter
+    """
+    normalized = Counter()
+    for alias, number in counts.items():
+        try:
+            integer = alias_type.process_bind_param(alias, None)
+        except ValueError:
+            continue
+        normalized[alias_type.process_result_value(integer, None)] += number
+    return normalized
+
+
+def warm_target_url_cache(target_url_cls, cache, aliases, batch_size=500):
+    """Store target URLs with given aliases in a cache.
+
+    The target URLs are selected in batches, with one query for each of
+    them. They are stored starting with the least requested one, so
+    that the most requested ones remain in a cache that is too small
+    for all of them.
+
+    :param target_url_cls: a subclass of BaseTargetURL
+    :param cache: a cache of target URLs stored by their aliases
+    :param aliases: a list of aliases, ordered from the most requested
+    :param batch_size: a maximum number of aliases selected at once
+    :returns: a number of stored target URLs
+    """
+    records = {}
+    for start in range(0, len(aliases), batch_size):
+        batch = aliases[start:start + batch_size]
+        records.update(
+            (r.alias, r) for r in target_url_cls.get_records(batch)
+        )
+    for alias in reversed(aliases):
+        record = records.get(alias)
+        if record is not None:
+            cache.set(alias, record)
+    return len(records)
+
+
+def warm_caches(app, injector, limit, hours, access_log=None):
+    """Warm caches of an application with popular target URLs.
+
+    Errors of the database and of reading the log are logged instead of
+    being raised, so that warming can't prevent the application from
+    starting.
+
+    :param app: an instance of Flask application
+    :param injector: an instance of injector.Injector used by
+    the application
+    :param limit: a maximum number of target URLs to be loaded
+    :param hours: a number of recent hours whose recorded clicks are
+    counted
+    :param access_log: a path to an access log from which requests
+    are counted instead of recorded clicks, or None
+    :returns: a number of stored target URLs
+    """
+    target_url_cls = injector.get(target_url_class)
+    alias_type = target_url_cls.__table__.c.alias.type
+    cache = get_cache_registry(app).get('target_urls')
+    try:
+        if access_log is None:
+            since = datetime.datetime.utcnow() - datetime.timedelta(
+                hours=hours
+            )
+            counts = get_recorded_clicks(
+                injector.get(SQLAlchemy).get_engine(app),
+                injector.get(click_count_table),
+                alias_type,
+                since,
+                limit
+            )
+        else:
+            with open(access_log) as lines:
+                counts = get_logged_clicks(lines)
+        aliases = [
+            a for a, _ in
+            normalize_aliases(counts, alias_type).most_common(limit)
+        ]
+        stored = warm_target_url_cache(target_url_cls, cache, aliases)
+    except (SQLAlchemyError, OSError) as error:
+        app.logger.warning('Warming caches failed: {!r}'.format(error))
+        return 0
+    app.logger.info(
+        'Caches warmed with {} of {} most requested target URLs.'.format(
+            stored,
+            len(aliases)
+        )
+    )
+    return stored
@@ -0,0 +1,790 @@
+# -*- coding: utf-8 -*-
+"""Caches used by the application.
+
+Each kind of cached data is stored in a separate namespace, with its own
+size limit and expiration time. A namespace consists of a cache local to
+a process and, optionally, a store shared by all processes running
+the application, queried when the local cache misses.
+"""
+from collections import OrderedDict
+import pickle
+from sys import getsizeof
+from threading import Lock
+from time import monotonic
+
+from injector import Module, Key, singleton
+
+from . import __title__
+
+
+def estimate_size(value):
+    """Estimate a number of bytes of memory used by a value.
+
+    Items of tuples, lists and dictionaries are included in the size of
+    their container. Other objects are measured without objects they
+    refer to.
+
+    :param value: the value
+    :returns: the estimated number of bytes
+    """
+    size = getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        size += sum(estimate_size(v) for v in value)
+    elif isinstance(value, dict):
+        size += sum(
+            estimate_size(k) + estimate_size(v) for k, v in value.items()
+        )
+    return size
+
+
+class TTLCache(object):
+    """A thread-safe, size-bounded cache of expiring items.
+
+    When the number of stored items reaches the size limit, the least
+    recently used item is evicted to make room for a new one.
+
+    :ivar maxsize: a maximum number of items stored in the cache. If
+    it is not greater than zero, the cache doesn't store anything
+    :ivar ttl: a number of seconds after which a stored item expires
+    """
+
+    def __init__(self, maxsize, ttl, timer=monotonic):
+        """Initialize a new instance.
+
+        :param maxsize: a maximum number of items to be stored
+        :param ttl: a number of seconds after which an item expires
+        :param timer: a function returning current time in seconds,
+        used for calculating expiration time of items
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0,
+                       'expirations': 0}
+
+    def __len__(self):
+        """Get the number of items currently stored in the cache."""
+        return len(self._items)
+
+    def _remove(self, key):
+        _, _, size = self._items.pop(key)
+        self._bytes -= size
+
+    def get(self, key, default=None):
+        """Get a value stored for given key.
+
+        :param key: a key of the value
+        :param default: a value to be returned if there is no value
+        stored for the key, or if the value has expired
+        :returns: the stored value or the default
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] <= self._timer():
+                if item is not None:
+                    self._remove(key)
+                    self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return default
+            self._items.move_to_end(key)
+            self._stats['hits'] += 1
+            return item[1]
+
+    def set(self, key, value, size=None, ttl=None):
+        """Store a value for given key.
+
+        :param key: a key of the value
+        :param value: a value to be stored
+        :param size: a size of the value in bytes, used only for
+        reporting memory used by the cache. By default, it is
+        estimated.
+        :param ttl: a number of seconds after which the value expires.
+        By default, the ttl of the cache is used.
+        :returns: True if the value has been stored
+        """
+        if self.maxsize <= 0:
+            return False
+        if size is None:
+            size = estimate_size(value)
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            while len(self._items) >= self.maxsize:
+                self._remove(next(iter(self._items)))
+                self._stats['evictions'] += 1
+            self._items[key] = self._timer() + ttl, value, size
+            self._bytes += size
+            return True
+
+    def delete(self, key):
+        """Remove a value stored for given key, if there is any.
+
+        :param key: a key of the value to be removed
+        """
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+
+    def clear(self):
+        """Remove all stored values."""
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def as_dict(self):
+        """Get statistics of the cache."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(items=len(self._items), bytes=self._bytes)
+        return stats
+
+
+class FrequencySketch(object):
+    """An approximate counter of accesses to keys.
+
+    The counter is a count-min sketch: each key is counted in one cell
+    of each of several rows, and its estimated frequency is the lowest
+    of its counts. Cells of a key are chosen by multiplying its hash by
+    a different odd constant for each row. All counts are halved after
+    a number of accesses, so that keys that were popular only in
+    the past can be replaced by currently popular ones.
+
+    :cvar MAX_COUNT: a maximum value of a single count
+    :cvar _MULTIPLIERS: odd 64-bit constants used for choosing cells of
+    keys in subsequent rows
+    :cvar _MASK: a mask limiting products of hashes to 64 bits
+    :ivar width: a number of cells in a row, rounded up to a power of
+    two
+    :ivar sample_size: a number of accesses after which the counts are
+    halved
+    """
+
+    MAX_COUNT = 15
+    _MULTIPLIERS = (
+        0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F,
+        0x165667B19E3779F9, 0xD6E8FEB86659FD93
+    )
+    _MASK = (1 << 64) - 1
+
+    def __init__(self, width, sample_size=None):
+        """Initialize a new instance.
+
+        :param width: a minimum number of cells in each row
+        :param sample_size: a number of accesses after which the counts
+        are halved. By default, it is ten times the width.
+        """
+        bits = max(4, (width - 1).bit_length())
+        self.width = 1 << bits
+        self.sample_size = sample_size or 10 * self.width
+        self._shift = 64 - bits
+        self._rows = [bytearray(self.width) for _ in self._MULTIPLIERS]
+        self._accesses = 0
+
+    def _get_indexes(self, key):
+        hashed = hash(key) & self._MASK
+        return [
+            ((hashed * m) & self._MASK) >> self._shift
+            for m in self._MULTIPLIERS
+        ]
+
+    def increment(self, key):
+        """Record an access to a key.
+
+        :param key: the key
+        """
+        for row, index in zip(self._rows, self._get_indexes(key)):
+            if row[index] < self.MAX_COUNT:
+                row[index] += 1
+        self._accesses += 1
+        if self._accesses >= self.sample_size:
+            self._accesses //= 2
+            for row in self._rows:
+                row[:] = bytes(c >> 1 for c in row)
+
+    def estimate(self, key):
+        """Get an estimated number of recent accesses to a key.
+
+        :param key: the key
+        :returns: the number
+        """
+        return min(
+            row[index]
+            for row, index in zip(self._rows, self._get_indexes(key))
+        )
+
+
+class AdmissionCache(object):
+    """A thread-safe cache of expiring items bounded by their size.
+
+    Each access to a key, including a miss, is recorded by a frequency
+    sketch. When a new item doesn't fit in the cache, it is stored
+    only if its key has been requested more often than the keys of
+    the least recently used items that would have to be evicted to make
+    room for it. This keeps the most popular items in the cache even
+    when many rarely requested items are being stored.
+
+    :ivar maxsize: a maximum number of items stored in the cache. If
+    it is not greater than zero, the cache doesn't store anything
+    :ivar maxbytes: a maximum total size of stored items, in bytes
+    :ivar ttl: a number of seconds after which a stored item expires
+    :ivar sketch: an instance of FrequencySketch
+    """
+
+    def __init__(self, maxsize, maxbytes, ttl, timer=monotonic):
+        """Initialize a new instance.
+
+        :param maxsize: a maximum number of items to be stored
+        :param maxbytes: a maximum total size of stored items
+        :param ttl: a number of seconds after which an item expires
+        :param timer: a function returning current time in seconds,
+        used for calculating expiration time of items
+        """
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.sketch = FrequencySketch(4 * maxsize)
+        self._timer = timer
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'admissions': 0,
+                       'rejections': 0, 'evictions': 0, 'expirations': 0}
+
+    def __len__(self):
+        """Get the number of items currently stored in the cache."""
+        return len(self._items)
+
+    def _remove(self, key):
+        _, _, size = self._items.pop(key)
+        self._bytes -= size
+
+    def get(self, key, default=None):
+        """Get a value stored for given key.
+
+        :param key: a key of the value
+        :param default: a value to be returned if there is no value
+        stored for the key, or if the value has expired
+        :returns: the stored value or the default
+        """
+        if self.maxsize <= 0:
+            return default
+        with self._lock:
+            self.sketch.increment(key)
+            item = self._items.get(key)
+            if item is None or item[0] <= self._timer():
+                if item is not None:
+                    self._remove(key)
+                    self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return default
+            self._items.move_to_end(key)
+            self._stats['hits'] += 1
+            return item[1]
+
+    def _get_victims(self, size):
+        """Get keys of items to be evicted to make room for a new one.
+
+        :param size: a size of the new item
+        :returns: a list of keys of the least recently used items
+        """
+        victims = []
+        count = len(self._items)
+        free = self.maxbytes - self._bytes
+        for key, (_, _, item_size) in self._items.items():
+            if count < self.maxsize and free >= size:
+                break
+            victims.append(key)
+            count -= 1
+            free += item_size
+        return victims
+
+    def set(self, key, value, size, ttl=None):
+        """Store a value for given key, if it is admitted.
+
+        :param key: a key of the value
+        :param value: a value to be stored
+        :param size: a size of the value, in bytes
+        :param ttl: a number of seconds after which the value expires.
+        By default, the ttl of the cache is used.
+        :returns: True if the value has been stored
+        """
+        if self.maxsize <= 0 or size > self.maxbytes:
+            return False
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            now = self._timer()
+            victims = self._get_victims(size)
+            frequency = self.sketch.estimate(key)
+            if any(
+                    self._items[v][0] > now and
+                    self.sketch.estimate(v) >= frequency
+                    for v in victims
+            ):
+                self._stats['rejections'] += 1
+                return False
+            for victim in victims:
+                self._remove(victim)
+            self._stats['evictions'] += len(victims)
+            self._stats['admissions'] += 1
+            self._items[key] = now + ttl, value, size
+            self._bytes += size
+            return True
+
+    def delete(self, key):
+        """Remove a value stored for given key, if there is any.
+
+        :param key: a key of the value to be removed
+        """
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+
+    def clear(self):
+        """Remove all stored values."""
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def as_dict(self):
+        """Get statistics of the cache."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(items=len(self._items), bytes=self._bytes)
+        return stats
+
+
+class SharedStore(object):
+    """A tier of a cache shared by processes, stored in Redis.
+
+    Values are pickled together with their sizes, so the store must be
+    accessible only to the application. Errors of the store are logged
+    and treated as misses, so its unavailability only makes the cache
+    less effective.
+
+    :ivar client: a Redis client
+    :ivar prefix: a prefix of keys of stored values
+    :ivar ttl: a number of seconds after which a stored value expires
+    :ivar logger: a logger used for reporting errors
+    :ivar errors: a tuple of types of errors raised by the client
+    """
+
+    def __init__(self, client, prefix, ttl, logger, errors=(Exception,)):
+        """Initialize a new instance.
+
+        :param client: a Redis client
+        :param prefix: a prefix of keys of stored values
+        :param ttl: a number of seconds after which a value expires
+        :param logger: a logger used for reporting errors
+        :param errors: a tuple of types of errors raised by the client
+        """
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.logger = logger
+        self.errors = errors
+        self._lock = Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'errors': 0}
+
+    def _key(self, key):
+        return '{}:{!r}'.format(self.prefix, key)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _log_error(self, error):
+        self._count('errors')
+        self.logger.warning(
+            'The shared cache {} is unavailable: {!r}'.format(
+                self.prefix,
+                error
+            )
+        )
+
+    def get(self, key):
+        """Get a value stored for given key.
+
+        :param key: a key of the value
+        :returns: a tuple containing the value and its size, or None
+        if there is no such value or the store is unavailable
+        """
+        try:
+            data = self.client.get(self._key(key))
+        except self.errors as error:
+            self._log_error(error)
+            return None
+        if data is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return pickle.loads(data)
+
+    def set(self, key, value, size, ttl=None):
+        """Store a value for given key.
+
+        :param key: a key of the value
+        :param value: a value to be stored
+        :param size: a size of the value, in bytes
+        :param ttl: a number of seconds after which the value expires.
+        By default, the ttl of the store is used.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        try:
+            self.client.set(
+                self._key(key),
+                pickle.dumps((value, size), pickle.HIGHEST_PROTOCOL),
+                px=int(ttl * 1000)
+            )
+        except self.errors as error:
+            self._log_error(error)
+
+    def delete(self, key):
+        """Remove a value stored for given key, if there is any.
+
+        :param key: a key of the value to be removed
+        """
+        try:
+            self.client.delete(self._key(key))
+        except self.errors as error:
+            self._log_error(error)
+
+    def clear(self):
+        """Remove all values stored with the prefix."""
+        try:
+            keys = list(self.client.scan_iter(match=self.prefix + ':*'))
+            if keys:
+                self.client.delete(*keys)
+        except self.errors as error:
+            self._log_error(error)
+
+    def as_dict(self):
+        """Get statistics of the store."""
+        with self._lock:
+            return dict(self._stats)
+
+
+class TieredCache(object):
+    """A namespace of cached values stored in one or two tiers.
+
+    Values are looked up in a cache local to the process, and then in
+    a shared store. Values found in the shared store are offered to
+    the local cache. New values are stored in both tiers.
+
+    :ivar name: a name of the namespace
+    :ivar local: an instance of TTLCache or AdmissionCache
+    :ivar shared: an instance of SharedStore, or None
+    """
+
+    def __init__(self, name, local, shared=None):
+        """Initialize a new instance.
+
+        :param name: a name of the namespace
+        :param local: an instance of TTLCache or AdmissionCache
+        :param shared: an instance of SharedStore, or None if values
+        are stored only by the process
+        """
+        self.name = name
+        self.local = local
+        self.shared = shared
+
+    def __len__(self):
+        """Get the number of values stored by the local cache."""
+        return len(self.local)
+
+    def get(self, key, default=None):
+        """Get a value stored for given key.
+
+        :param key: a key of the value
+        :param default: a value to be returned if neither of the tiers
+        stores a value for the key
+        :returns: the stored value or the default
+        """
+        value = self.local.get(key, self)
+        if value is not self:
+            return value
+        if self.shared is None:
+            return default
+        item = self.shared.get(key)
+        if item is None:
+            return default
+        value, size = item
+        self.local.set(key, value, size)
+        return value
+
+    def set(self, key, value, size=None, ttl=None):
+        """Store a value for given key.
+
+        :param key: a key of the value
+        :param value: a value to be stored
+        :param size: a size of the value in bytes. By default, it is
+        estimated.
+        :param ttl: a number of seconds after which the value expires
+        in both tiers. By default, the ttl of each tier is used.
+        :returns: True if the value has been stored by the local cache
+        """
+        if size is None:
+            size = estimate_size(value)
+        if self.shared is not None:
+            self.shared.set(key, value, size, ttl)
+        return self.local.set(key, value, size, ttl)
+
+    def delete(self, key):
+        """Remove values stored for given key from both tiers.
+
+        :param key: a key of the values to be removed
+        """
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def clear(self):
+        """Remove all values stored in both tiers."""
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def as_dict(self):
+        """Get statistics of the namespace.
+
+        :returns: a dictionary containing statistics of the local
+        cache, a hit ratio of the namespace and statistics of the shared
+        store, or None if the namespace doesn't use one
+        """
+        stats = self.local.as_dict()
+        requests = stats['hits'] + stats['misses']
+        hits = stats['hits']
+        stats['shared'] = None
+        if self.shared is not None:
+            stats['shared'] = self.shared.as_dict()
+            hits += stats['shared']['hits']
+        stats['hit_ratio'] = hits / requests if requests else 0.0
+        return stats
+
+
+class CacheRegistry(object):
+    """Namespaces of cached values used by the application.
+
+    Functions registered as commit hooks are called after target URLs
+    are stored in the database, so that caches can add or invalidate
+    values depending on them.
+    """
+
+    def __init__(self):
+        """Initialize a new instance."""
+        self._namespaces = OrderedDict()
+        self._commit_hooks = []
+
+    def add(self, cache):
+        """Register a namespace.
+
+        :param cache: an instance of TieredCache
+        :returns: the cache
+        """
+        self._namespaces[cache.name] = cache
+        return cache
+
+    def get(self, name):
+        """Get a namespace with given name.
+
+        :param name: the name
+        :returns: an instance of TieredCache
+        :raises KeyError: if there is no such namespace
+        """
+        return self._namespaces[name]
+
+    def add_commit_hook(self, hook):
+        """Register a function to be called after a commit.
+
+        :param hook: a function receiving a list of instances of
+        domain_and_persistence.TargetURLRecord representing target
+        URLs stored by the commit
+        """
+        self._commit_hooks.append(hook)
+
+    def notify_commit(self, records):
+        """Call commit hooks for target URLs stored by a commit.
+
+        :param records: a list of instances of TargetURLRecord
+        """
+        for hook in self._commit_hooks:
+            hook(records)
+
+    def as_dict(self):
+        """Get statistics of all namespaces."""
+        return {n: c.as_dict() for n, c in self._namespaces.items()}
+
+
+SHAREABLE_NAMESPACES = (
+    'target_urls', 'aliases', 'preview_pages', 'redirects',
+    'recent_aliases'
+)
+
+
+def get_shared_client(url):
+    """Get a client of a Redis server used as a shared store.
+
+    :param url: a URL of the server
+    :returns: a tuple containing the client and a tuple of types of
+    errors raised by it
+    """
+    import redis
+    return redis.StrictRedis.from_url(url), (redis.RedisError,)
+
+
+def _cache_target_urls(cache, records):
+    """Store records of new target URLs in a cache.
+
+    :param cache: a namespace of target URLs stored by their aliases
+    :param records: a list of instances of TargetURLRecord
+    """
+    for record in records:
+        cache.set(record.alias, record)
+
+
+def _mark_recent_aliases(cache, records):
+    """Remember aliases of new target URLs until replicas get them.
+
+    :param cache: a namespace of aliases created within replication lag
+    :param records: a list of instances of TargetURLRecord
+    """
+    for record in records:
+        cache.set(record.alias, True)
+
+
+def _create_cache_registry(app):
+    """Create caches configured for an application.
+
+    :param app: an instance of Flask application
+    :returns: an instance of CacheRegistry
+    :raises ValueError: if SHARED_CACHE_NAMESPACES option contains
+    a name of a namespace that can't be shared
+    """
+    config = app.config
+    shared_names = config['SHARED_CACHE_NAMESPACES']
+    unsupported = set(shared_names) - set(SHAREABLE_NAMESPACES)
+    if unsupported:
+        raise ValueError(
+            'These cache namespaces can not be shared: {}'.format(
+                ', '.join(sorted(unsupported))
+            )
+        )
+    client, errors = None, ()
+    if shared_names and config['SHARED_CACHE_URL'] is not None:
+        client, errors = get_shared_client(config['SHARED_CACHE_URL'])
+
+    registry = CacheRegistry()
+
+    def add(name, local):
+        shared = None
+        if client is not None and name in shared_names:
+            shared = SharedStore(
+                client,
+                '{}:{}'.format(__title__, name),
+                local.ttl,
+                app.logger,
+                errors
+            )
+        registry.add(TieredCache(name, local, shared))
+
+    add('target_urls', TTLCache(
+        config['TARGET_URL_CACHE_SIZE'],
+        config['TARGET_URL_CACHE_TIMEOUT']
+    ))
+    add('aliases', TTLCache(
+        config['ALIAS_CACHE_SIZE'],
+        config['ALIAS_CACHE_TIMEOUT']
+    ))
+    add('host_verdicts', TTLCache(
+        config['HOST_VERDICT_CACHE_SIZE'],
+        config['HOST_VERDICT_CACHE_TIMEOUT']
+    ))
+    add('preview_pages', TTLCache(
+        config['PREVIEW_CACHE_SIZE'],
+        config['PREVIEW_CACHE_TIMEOUT']
+    ))
+    add('redirects', AdmissionCache(
+        config['REDIRECT_CACHE_SIZE'],
+        config['REDIRECT_CACHE_MEMORY'],
+        config['REDIRECT_CACHE_TIMEOUT']
+    ))
+    add('recent_aliases', TTLCache(
+        config['RECENT_ALIAS_CACHE_SIZE'],
+        config['REPLICA_LAG']
+    ))
+    registry.add_commit_hook(
+        lambda records: _cache_target_urls(
+            registry.get('target_urls'),
+            records
+        )
+    )
+    registry.add_commit_hook(
+        lambda records: _mark_recent_aliases(
+            registry.get('recent_aliases'),
+            records
+        )
+    )
+    return registry
+
+
+def get_cache_registry(app):
+    """Get caches of an application, creating them if necessary.
+
+    The caches are stored in extensions of the application, so that
+    all injector modules configuring it use the same instances.
+
+    :param app: an instance of Flask application
+    :returns: an instance of CacheRegistry
+    """
+    registry = app.extensions.get('caches')
+    if registry is None:
+        registry = app.extensions['caches'] = _create_cache_registry(app)
+    return registry
+
+
+cache_registry = Key('cache_registry')
+target_url_cache = Key('target_url_cache')
+alias_cache = Key('alias_cache')
+preview_cache = Key('preview_cache')
+redirect_cache = Key('redirect_cache')
+
+
+class CachingModule(Module):
+    """Configures injection of caches used by the application.
+
+    All caches are created eagerly, but a cache configured with
+    a size limit of zero doesn't store any values in the memory of
+    a process.
+    """
+
+    def __init__(self, app):
+        """Initialize a new instance.
+
+        :param app: an instance of Flask application for which
+        the caches are being configured
+        """
+        self.app = app
+
+    def configure(self, binder):
+        """Configure dependencies.
+
+        :param binder: an instance of injector.Binder used for binding
+        interfaces to implementations
+        """
+        registry = get_cache_registry(self.app)
+        binder.bind(cache_registry, to=registry, scope=singleton)
+        for key, name in (
+                (target_url_cache, 'target_urls'),
+                (alias_cache, 'aliases'),
+                (preview_cache, 'preview_pages'),
+                (redirect_cache, 'redirects')
+        ):
+            binder.bind(key, to=registry.get(name), scope=singleton)
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+"""Protection against slow or unavailable blacklist sources.
+
+Each external source used for testing URLs is called through a guard
+limiting the time spent waiting for it and a circuit breaker that stops
+calling it after a number of consecutive failures. While the circuit is
+open, the source is called again only once in a while, to check if it
+has recovered.
+
+When a source can't be used, its wrapper returns a fallback result
+depending on its policy: a fail-open source is treated as if it didn't
+list any URL, and a fail-closed one as if it listed all of them.
+Fallback results are marked as degraded, so that they are not cached.
+Sources can also return degraded results themselves, for example when
+only some of their queries succeeded. Returning a degraded result also
+marks the current thread as degraded, so that callers of composite
+blacklists, which don't pass the results through, can find out if
+their verdict was complete.
+"""
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import Lock, local
+from time import monotonic
+
+
+class SourceUnavailableError(Exception):
+    """An error raised when a source fails, times out or is disabled."""
+
+
+class CircuitBreaker(object):
+    """A circuit breaker for calls to an unreliable source.
+
+    :cvar CLOSED: a state in which all calls are allowed
+    :cvar OPEN: a state in which calls are rejected
+    :cvar HALF_OPEN: a state in which a single probing call is allowed
+    :ivar failure_threshold: a number of consecutive failures after
+    which the circuit is opened
+    :ivar reset_timeout: a number of seconds after which an open circuit
+    allows a probing call
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold, reset_timeout, timer=monotonic):
+        """Initialize a new instance.
+
+        :param failure_threshold: a number of consecutive failures
+        after which the circuit is opened
+        :param reset_timeout: a number of seconds after which an open
+        circuit allows a probing call
+        :param timer: a function returning current time in seconds
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._timer = timer
+        self._lock = Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        """Get the current state of the circuit."""
+        with self._lock:
+            if self._state == self.OPEN and self._can_probe():
+                return self.HALF_OPEN
+            return self._state
+
+    def _can_probe(self):
+        return self._timer() >= self._opened_at + self.reset_timeout
+
+    def allow(self):
+        """Check if a call is allowed, and register it if it is.
+
+        :returns: True if the call can be performed
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and self._can_probe():
+                self._state = self.HALF_OPEN
+                self._probing = False
+            if self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        """Record a successful call, closing the circuit."""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        """Record a failed call, opening the circuit if necessary."""
+        with self._lock:
+            self._failures += 1
+            if (
+                    self._state == self.HALF_OPEN or
+                    self._failures >= self.failure_threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = self._timer()
+                self._probing = False
+
+
+class SourceGuard(object):
+    """Calls a source with a latency budget and a circuit breaker.
+
+    Calls are performed by an executor, so that the caller stops waiting
+    when the budget is exceeded. Threads of the executor that are still
+    waiting for the source remain busy, but the number of such threads
+    is bounded by the executor, and the circuit opens when timeouts
+    repeat.
+
+    :ivar name: a name of the source, used in logs and metrics
+    :ivar breaker: an instance of CircuitBreaker
+    :ivar budget: a maximum number of seconds to wait for a call
+    :ivar executor: an instance of concurrent.futures.Executor
+    :ivar logger: a logger used for reporting failures
+    :ivar passthrough: a tuple of exception types that are not
+    failures of the source and are raised to the caller
+    """
+
+    def __init__(
+            self,
+            name,
+            breaker,
+            budget,
+            executor,
+            logger,
+            passthrough=()
+    ):
+        """Initialize a new instance.
+
+        :param name: a name of the source
+        :param breaker: an instance of CircuitBreaker
+        :param budget: a maximum number of seconds to wait for a call
+        :param executor: an executor performing the calls
+        :param logger: a logger used for reporting failures
+        :param passthrough: a tuple of exception types raised to
+        the caller without being treated as failures of the source
+        """
+        self.name = name
+        self.breaker = breaker
+        self.budget = budget
+        self.executor = executor
+        self.logger = logger
+        self.passthrough = passthrough
+        self._lock = Lock()
+        self._latencies = deque(maxlen=1000)
+        self._counts = {'calls': 0, 'failures': 0, 'timeouts': 0,
+                        'rejected': 0}
+
+    def _record(self, start, outcome=None):
+        with self._lock:
+            self._counts['calls'] += 1
+            if outcome is not None:
+                self._counts[outcome] += 1
+            if start is not None:
+                self._latencies.append(monotonic() - start)
+
+    def call(self, function, *args):
+        """Call a function accessing the source.
+
+        :param function: the function
+        :param args: arguments of the function
+        :returns: a value returned by the function
+        :raises SourceUnavailableError: if the circuit is open, or if
+        the function failed or didn't finish within the budget
+        """
+        if not self.breaker.allow():
+            self._record(None, 'rejected')
+            raise SourceUnavailableError(
+                'The circuit of {} is open.'.format(self.name)
+            )
+
+        start = monotonic()
+        future = self.executor.submit(function, *args)
+        try:
+            result = future.result(self.budget)
+        except FutureTimeoutError as error:
+            future.cancel()
+            self.breaker.record_failure()
+            self._record(start, 'timeouts')
+            self.logger.warning(
+                '{} did not respond within {} seconds.'.format(
+                    self.name,
+                    self.budget
+                )
+            )
+            raise SourceUnavailableError(str(error)) from error
+        except self.passthrough:
+            self.breaker.record_success()
+            self._record(start)
+            raise
+        except Exception as error:
+            self.breaker.record_failure()
+            self._record(start, 'failures')
+            self.logger.warning(
+                '{} failed: {!r}'.format(self.name, error)
+            )
+            raise SourceUnavailableError(str(error)) from error
+        self.breaker.record_success()
+        self._record(start)
+        return result
+
+    def as_dict(self):
+        """Get the state and latency statistics of the source."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            metrics = dict(self._counts)
+
+        def percentile(fraction):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1,
+                                 int(len(latencies) * fraction))]
+
+        metrics.update({
+            'state': self.breaker.state,
+            'mean_latency': (
+                sum(latencies) / len(latencies) if latencies else 0.0
+            ),
+            'p50_latency': percentile(0.5),
+            'p99_latency': percentile(0.99),
+            'max_latency': latencies[-1] if latencies else 0.0
+        })
+        return metrics
+
+
+_degradation = local()
+
+
+def mark_degraded():
+    """Record that a degraded result was used in the current thread."""
+    _degradation.degraded = True
+
+
+def reset_degraded():
+    """Clear the record of degraded results in the current thread.
+
+    :returns: True if a degraded result was used since the previous
+    call, False otherwise
+    """
+    degraded = getattr(_degradation, 'degraded', False)
+    _degradation.degraded = False
+    return degraded
+
+
+class DegradedResult(list):
+    """A list of items returned instead of a result of a source.
+
+    :ivar degraded: always True, to distinguish the list from results
+    that can be cached
+    """
+
+    degraded = True
+
+
+def _collect(items):
+    """Get a list of items, keeping it degraded if it is.
+
+    :param items: an iterable of items returned by a source
+    :returns: a list or an instance of DegradedResult
+    """
+    if getattr(items, 'degraded', False):
+        return DegradedResult(items)
+    return list(items)
+
+
+class GuardedTester(object):
+    """A URL tester calling another one through a SourceGuard.
+
+    :ivar tester: a URL tester having lookup_matching(urls) and
+    filter_matching(urls) methods
+    :ivar guard: an instance of SourceGuard
+    :ivar fail_open: if True, URLs are treated as not listed when
+    the tester can't be used. Otherwise, they are treated as listed.
+    """
+
+    def __init__(self, tester, guard, fail_open=True):
+        """Initialize a new instance.
+
+        :param tester: a URL tester to be called
+        :param guard: an instance of SourceGuard
+        :param fail_open: True if URLs are to be treated as not listed
+        when the tester can't be used, False if they are to be treated
+        as listed
+        """
+        self.tester = tester
+        self.guard = guard
+        self.fail_open = fail_open
+
+    def __str__(self):
+        return self.guard.name
+
+    def _call(self, method, urls):
+        """Call a method of the tester through the guard.
+
+        :param method: the method
+        :param urls: a list of URLs passed to the method
+        :returns: a list of values returned by the method, or
+        an instance of DegradedResult if the tester returned one
+        :raises SourceUnavailableError: if the tester can't be used
+        """
+        result = self.guard.call(lambda: _collect(method(urls)))
+        if getattr(result, 'degraded', False):
+            mark_degraded()
+        return result
+
+    def lookup_matching(self, urls):
+        """Get items for listed URLs.
+
+        :param urls: a sequence of URLs
+        :returns: a list of items returned by the tester, or
+        an instance of DegradedResult
+        :raises InvalidURLError: if there are any invalid URLs
+        """
+        from spam_lists.structures import AddressListItem
+        urls = list(urls)
+        try:
+            return self._call(self.tester.lookup_matching, urls)
+        except SourceUnavailableError:
+            mark_degraded()
+            if self.fail_open:
+                return DegradedResult()
+            return DegradedResult(
+                AddressListItem(u, self, {'unavailable'}) for u in urls
+            )
+
+    def any_match(self, urls):
+        """Check if any of URLs is listed.
+
+        :param urls: a sequence of URLs
+        :returns: True if any of them is listed
+        :raises InvalidURLError: if there are any invalid URLs
+        """
+        return bool(self.lookup_matching(urls))
+
+    def filter_matching(self, urls):
+        """Get listed URLs.
+
+        :param urls: a sequence of URLs
+        :returns: a list of the listed URLs, or an instance of
+        DegradedResult
+        :raises InvalidURLError: if there are any invalid URLs
+        """
+        urls = list(urls)
+        try:
+            return self._call(self.tester.filter_matching, urls)
+        except SourceUnavailableError:
+            mark_degraded()
+            return DegradedResult([] if self.fail_open else urls)
+
+
+class GuardedRedirectResolver(object):
+    """A redirect resolver calling another one through a SourceGuard.
+
+    When the resolver can't be used, only the original URLs are tested.
+
+    :ivar resolver: an object having get_urls_and_locations(urls)
+    method, like spam_lists.composites.RedirectURLResolver
+    :ivar guard: an instance of SourceGuard
+    """
+
+    def __init__(self, resolver, guard):
+        """Initialize a new instance.
+
+        :param resolver: a redirect resolver to be called
+        :param guard: an instance of SourceGuard
+        """
+        self.resolver = resolver
+        self.guard = guard
+
+    def get_urls_and_locations(self, urls):
+        """Get URLs and addresses they redirect to.
+
+        :param urls: a sequence of URLs
+        :returns: a list of the URLs and their redirect addresses
+        :raises InvalidURLError: if there are any invalid URLs
+        """
+        urls = list(urls)
+        try:
+            return self.guard.call(
+                lambda: list(self.resolver.get_urls_and_locations(urls))
+            )
+        except SourceUnavailableError:
+            mark_degraded()
+            return DegradedResult(set(urls))
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""Compact storage of daily click counts.
+
+Click counts are stored in compressed NumPy files, one for each month.
+Each file contains three columns: integers of aliases, days (counted
+from 1970-01-01) and numbers of clicks, sorted by alias and day.
+Reports are computed with vectorized operations on these columns.
+
+This module requires NumPy.
+"""
+import datetime
+import os
+from tempfile import NamedTemporaryFile
+
+import numpy
+from sqlalchemy import and_, bindparam, select
+
+
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def to_day(date):
+    """Get a number of days between the epoch and a date.
+
+    :param date: an instance of datetime.date
+    :returns: an integer
+    """
+    return (date - EPOCH).days
+
+
+def _columns(aliases=(), days=(), counts=()):
+    return (
+        numpy.asarray(aliases, dtype=numpy.int64),
+        numpy.asarray(days, dtype=numpy.int32),
+        numpy.asarray(counts, dtype=numpy.int64)
+    )
+
+
+def sum_by_alias_and_day(aliases, days, counts):
+    """Sum counts with the same alias and day.
+
+    :param aliases: an array of integers of aliases
+    :param days: an array of days
+    :param counts: an array of numbers of clicks
+    :returns: a tuple of the three arrays, with unique pairs of aliases
+    and days, sorted by alias and day
+    """
+    aliases, days, counts = _columns(aliases, days, counts)
+    if not len(aliases):
+        return aliases, days, counts
+
+    order = numpy.lexsort((days, aliases))
+    aliases, days, counts = aliases[order], days[order], counts[order]
+    changed = (aliases[1:] != aliases[:-1]) | (days[1:] != days[:-1])
+    starts = numpy.flatnonzero(numpy.concatenate(([True], changed)))
+    return aliases[starts], days[starts], numpy.add.reduceat(counts, starts)
+
+
+class ClickArchive(object):
+    """A directory of files containing daily click counts.
+
+    :ivar directory: a path to the directory
+    """
+
+    _UNTIL_FILE = 'archived_until'
+
+    def __init__(self, directory):
+        """Initialize a new instance.
+
+        :param directory: a path to a directory in which the files are
+        to be stored. It is created if it doesn't exist.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def _path(self, month):
+        return os.path.join(self.directory, '{}.npz'.format(month))
+
+    def _load_month(self, month):
+        try:
+            with numpy.load(self._path(month)) as data:
+                return data['alias'], data['day'], data['count']
+        except FileNotFoundError:
+            return _columns()
+
+    def _replace(self, name, write):
+        with NamedTemporaryFile(
+            dir=self.directory,
+            prefix='.tmp',
+            delete=False
+        ) as temporary:
+            write(temporary)
+        os.replace(temporary.name, os.path.join(self.directory, name))
+
+    @property
+    def archived_until(self):
+        """Get the day up to which clicks have been archived.
+
+        :returns: a number of the first day whose clicks have not been
+        archived yet, or None if no clicks have been archived
+        """
+        try:
+            with open(os.path.join(self.directory, self._UNTIL_FILE)) as f:
+                return int(f.read())
+        except FileNotFoundError:
+            return None
+
+    def add(self, aliases, days, counts, until=None):
+        """Add click counts to the archive.
+
+        Files of affected months are replaced atomically.
+
+        :param aliases: integers of aliases
+        :param days: days of the clicks
+        :param counts: numbers of clicks
+        :param until: a number of the first day whose clicks are not
+        included in the counts, to be recorded as the value of
+        archived_until, or None if the value is not to be changed
+        """
+        aliases, days, counts = _columns(aliases, days, counts)
+        months = days.astype('datetime64[D]').astype('datetime64[M]')
+        for month in numpy.unique(months):
+            selected = months == month
+            existing = self._load_month(month)
+            merged = sum_by_alias_and_day(
+                numpy.concatenate((existing[0], aliases[selected])),
+                numpy.concatenate((existing[1], days[selected])),
+                numpy.concatenate((existing[2], counts[selected]))
+            )
+            self._replace(
+                '{}.npz'.format(month),
+                lambda f, m=merged: numpy.savez_compressed(
+                    f, alias=m[0], day=m[1], count=m[2]
+                )
+            )
+
+        if until is not None:
+            self._replace(
+                self._UNTIL_FILE,
+                lambda f: f.write(str(until).encode('ascii'))
+            )
+
+    def load(self, first_day, last_day):
+        """Load click counts for a range of days.
+
+        :param first_day: a number of the first day of the range
+        :param last_day: a number of the last day of the range
+        :returns: a tuple of arrays of aliases, days and counts
+        """
+        first_month, last_month = (
+            numpy.datetime64(day, 'D').astype('datetime64[M]')
+            for day in (first_day, last_day)
+        )
+        columns = [
+            self._load_month(month)
+            for month in numpy.arange(first_month, last_month + 1)
+        ]
+        aliases, days, counts = (
+            numpy.concatenate([c[i] for c in columns]) for i in range(3)
+        )
+        selected = (days >= first_day) & (days <= last_day)
+        return aliases[selected], days[selected], counts[selected]
+
+    def top(self, number, first_day, last_day):
+        """Get aliases with the most clicks in a range of days.
+
+        :param number: a maximum number of aliases to be returned
+        :param first_day: a number of the first day of the range
+        :param last_day: a number of the last day of the range
+        :returns: a list of tuples containing an integer of an alias
+        and its number of clicks, starting with the most clicked one
+        """
+        aliases, _, counts = self.load(first_day, last_day)
+        unique, inverse = numpy.unique(aliases, return_inverse=True)
+        totals = numpy.zeros(len(unique), dtype=numpy.int64)
+        numpy.add.at(totals, inverse, counts)
+        order = numpy.argsort(-totals, kind='stable')[:number]
+        return [(int(unique[i]), int(totals[i])) for i in order]
+
+    def time_series(self, alias, first_day, last_day):
+        """Get daily click counts of an alias.
+
+        :param alias: an integer of the alias
+        :param first_day: a number of the first day of the range
+        :param last_day: a number of the last day of the range
+        :returns: an array of numbers of clicks, one for each day of
+        the range
+        """
+        aliases, days, counts = self.load(first_day, last_day)
+        selected = aliases == alias
+        series = numpy.zeros(last_day - first_day + 1, dtype=numpy.int64)
+        numpy.add.at(series, days[selected] - first_day, counts[selected])
+        return series
+
+
+def archive_click_counts(
+        engine,
+        table,
+        archive,
+        until,
+        batch_size=10000,
+        prune=False
+):
+    """Copy per-minute click counts from a database to an archive.
+
+    Counts are read starting with the day recorded as archived_until
+    in the archive. If they are to be pruned, the rows that have been
+    read are deleted in the same transaction, matched by their alias,
+    minute and count, so that counts added after reading them are
+    never deleted without being archived.
+
+    :param engine: an engine connected to the database
+    :param table: a table of per-minute click counts
+    :param archive: an instance of ClickArchive
+    :param until: a number of the first day whose clicks are not to be
+    archived
+    :param batch_size: a maximum number of rows read or deleted at once
+    :param prune: if True, archived counts are deleted from
+    the database
+    :returns: a number of archived rows
+    """
+    columns = table.c
+    query = select([columns.alias, columns.minute, columns.count]).where(
+        columns.minute < EPOCH + datetime.timedelta(days=until)
+    )
+    if archive.archived_until is not None:
+        query = query.where(
+            columns.minute >= (
+                EPOCH + datetime.timedelta(days=archive.archived_until)
+            )
+        )
+    if prune:
+        query = query.with_for_update()
+
+    summed = _columns()
+    archived = []
+    row_count = 0
+    with engine.begin() as connection:
+        result = connection.execute(query)
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            row_count += len(rows)
+            aliases, minutes, counts = zip(*rows)
+            if prune:
+                archived.extend(zip(aliases, minutes, counts))
+            days = numpy.array(minutes, dtype='datetime64[m]').astype(
+                'datetime64[D]'
+            ).astype(numpy.int32)
+            summed = sum_by_alias_and_day(
+                numpy.concatenate((summed[0], aliases)),
+                numpy.concatenate((summed[1], days)),
+                numpy.concatenate((summed[2], counts))
+            )
+
+        archive.add(*summed, until=until)
+        for start in range(0, len(archived), batch_size):
+            _delete_rows(
+                connection,
+                table,
+                archived[start:start + batch_size]
+            )
+    return row_count
+
+
+def _delete_rows(connection, table, rows):
+    """Delete rows of per-minute click counts with unchanged counts.
+
+    :param connection: a connection used for deleting the rows
+    :param table: a table of per-minute click counts
+    :param rows: tuples containing an alias, a minute and a count
+    """
+    columns = table.c
+    connection.execute(
+        table.delete().where(
+            and_(
+                columns.alias == bindparam('key_alias'),
+                columns.minute == bindparam('key_minute'),
+                columns.count == bindparam('key_count')
+            )
+        ),
+        [
+            {'key_alias': a, 'key_minute': m, 'key_count': c}
+            for a, m, c in rows
+        ]
+    )
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Coalescing of concurrent identical computations.
+
+When many requests need the same value at the same time - for example
+a target URL of a popular alias that is not cached yet - only the first
+of them computes it. The others wait for that computation and receive
+its result or its exception.
+"""
+import asyncio
+from threading import Event, Lock
+
+
+class _Call(object):
+    """A computation performed by one thread for a number of callers.
+
+    :ivar done: an event set when the computation is finished
+    :ivar result: a value returned by the computation
+    :ivar error: an exception raised by the computation, or None
+    """
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesces identical computations performed by threads."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+
+    def do(self, key, function, *args, **kwargs):
+        """Call a function, unless a call for the same key is in progress.
+
+        :param key: a hashable value identifying the computation
+        :param function: a function performing the computation
+        :param args: positional arguments of the function
+        :param kwargs: keyword arguments of the function
+        :returns: a value returned by the function, either called by
+        this thread or by another one, for the same key
+        :raises Exception: any exception raised by the function
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight(object):
+    """Coalesces identical computations performed by coroutines.
+
+    An instance can be used by one event loop at a time.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def __len__(self):
+        """Get the number of computations in progress."""
+        return len(self._calls)
+
+    async def do(self, key, function, *args):
+        """Await a coroutine function, unless it is already awaited.
+
+        The computation is not cancelled when a caller waiting for it
+        is cancelled.
+
+        :param key: a hashable value identifying the computation
+        :param function: a function returning an awaitable object
+        performing the computation
+        :param args: positional arguments of the function
+        :returns: a value of the computation started by this or another
+        caller for the same key
+        :raises Exception: any exception raised by the computation
+        """
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(function(*args))
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._discard(key, f))
+        return await asyncio.shield(future)
+
+    def _discard(self, key, future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        # The exception is raised to callers that are still waiting.
+        # Retrieving it here prevents the event loop from logging it
+        # when all callers have been cancelled.
+        if not future.cancelled():
+            future.exception()
@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+"""Concurrent DNSBL queries.
+
+Clients of DNSBL services provided by spam-lists send blocking queries,
+one per host and service. Here, all queries necessary to test URLs
+against a number of DNSBL services are sent at once over UDP by
+a resolver running an asyncio event loop. The resolver caches answers
+for as long as their TTL allows and sends only one query for identical
+names requested at the same time.
+
+Testing URLs is limited by a time budget. If some queries fail or are
+not answered in time, hosts confirmed as listed by other queries are
+still returned, as a degraded result that is not cached. If no host is
+confirmed as listed, the test raises an error instead of treating
+the hosts as not listed, so that a guard protecting the tester counts
+the failure and applies its fail-open or fail-closed policy.
+"""
+import asyncio
+from collections import namedtuple
+import os
+from random import randrange
+from threading import Lock, Thread
+from time import monotonic
+from urllib.parse import urlparse
+
+import dns.exception
+import dns.message
+import dns.rcode
+import dns.rdatatype
+from spam_lists.exceptions import InvalidHostError
+from spam_lists.structures import AddressListItem
+from spam_lists.validation import accepts_valid_urls
+
+from .circuit_breaker import DegradedResult
+from .coalescing import AsyncSingleFlight
+
+
+class ResolverError(Exception):
+    """An error raised when a name can't be resolved."""
+
+
+class ResolverTimeout(ResolverError):
+    """An error raised when no nameserver answers a query in time."""
+
+
+class IncompleteLookupError(Exception):
+    """An error raised when some DNSBL queries can't be completed."""
+
+
+def _as_result(matches, values):
+    """Get a list of values, degraded if the matches are incomplete.
+
+    :param matches: a list of matches, or an instance of DegradedResult
+    :param values: an iterable of values derived from the matches
+    :returns: a list or an instance of DegradedResult
+    """
+    if getattr(matches, 'degraded', False):
+        return DegradedResult(values)
+    return list(values)
+
+
+_CacheEntry = namedtuple('_CacheEntry', ['expires', 'addresses'])
+
+
+class _DNSProtocol(asyncio.DatagramProtocol):
+    """A protocol passing DNS responses to futures waiting for them.
+
+    :ivar pending: a dictionary mapping ids of sent queries to futures
+    of their responses
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 2:
+            return
+        future = self.pending.get(int.from_bytes(data[:2], 'big'))
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+
+class AsyncResolver(object):
+    """A caching resolver of IPv4 addresses, using asyncio.
+
+    An instance can be used by one event loop at a time.
+
+    :ivar nameservers: a sequence of IP addresses of nameservers,
+    queried in turn when a query is not answered
+    :ivar port: a port of the nameservers
+    :ivar retry_interval: a number of seconds after which an unanswered
+    query is sent to the next nameserver
+    :ivar attempts: a maximum number of queries sent for a name
+    :ivar cache_size: a maximum number of cached answers
+    :ivar negative_ttl: a number of seconds for which non-existence
+    of a name is cached when a nameserver doesn't specify it
+    """
+
+    def __init__(
+            self,
+            nameservers,
+            port=53,
+            retry_interval=0.5,
+            attempts=3,
+            cache_size=10000,
+            negative_ttl=60
+    ):
+        """Initialize a new instance.
+
+        :param nameservers: a sequence of IP addresses of nameservers
+        :param port: a port of the nameservers
+        :param retry_interval: a number of seconds after which
+        an unanswered query is sent to the next nameserver
+        :param attempts: a maximum number of queries sent for a name
+        :param cache_size: a maximum number of cached answers
+        :param negative_ttl: a number of seconds for which non-existence
+        of a name is cached when a nameserver doesn't specify it
+        """
+        self.nameservers = list(nameservers)
+        self.port = port
+        self.retry_interval = retry_interval
+        self.attempts = attempts
+        self.cache_size = cache_size
+        self.negative_ttl = negative_ttl
+        self._cache = {}
+        self._in_flight = AsyncSingleFlight()
+        self._protocols = {}
+        self._loop = None
+
+    def _set_loop(self, loop):
+        if loop is not self._loop:
+            for endpoint in self._protocols.values():
+                if endpoint.done() and not endpoint.exception():
+                    endpoint.result().transport.close()
+            self._protocols = {}
+            self._in_flight = AsyncSingleFlight()
+            self._loop = loop
+
+    async def _create_protocol(self, nameserver):
+        _, protocol = await self._loop.create_datagram_endpoint(
+            _DNSProtocol,
+            remote_addr=(nameserver, self.port)
+        )
+        return protocol
+
+    async def _get_protocol(self, nameserver):
+        endpoint = self._protocols.get(nameserver)
+        if endpoint is None or endpoint.done() and endpoint.exception():
+            endpoint = self._loop.create_task(
+                self._create_protocol(nameserver)
+            )
+            self._protocols[nameserver] = endpoint
+        return await endpoint
+
+    def _get_cached(self, name):
+        entry = self._cache.get(name)
+        if entry is None:
+            return None
+        if entry.expires <= monotonic():
+            del self._cache[name]
+            return None
+        return entry.addresses
+
+    def _store(self, name, addresses, ttl):
+        if ttl <= 0 or self.cache_size <= 0:
+            return
+        if len(self._cache) >= self.cache_size:
+            now = monotonic()
+            for key in [k for k, v in self._cache.items() if v.expires <= now]:
+                del self._cache[key]
+            if len(self._cache) >= self.cache_size:
+                del self._cache[next(iter(self._cache))]
+        self._cache[name] = _CacheEntry(monotonic() + ttl, addresses)
+
+    async def resolve(self, name):
+        """Get IPv4 addresses of a name.
+
+        :param name: a fully qualified domain name, as a string
+        :returns: a tuple of strings representing the addresses. It is
+        empty if the name doesn't exist or has no addresses.
+        :raises ResolverTimeout: if none of the nameservers answered
+        :raises ResolverError: if a nameserver reported an error
+        """
+        name = name.lower().rstrip('.') + '.'
+        addresses = self._get_cached(name)
+        if addresses is not None:
+            return addresses
+
+        self._set_loop(asyncio.get_event_loop())
+        return await self._in_flight.do(name, self._query, name)
+
+    async def _query(self, name):
+        query = dns.message.make_query(name, dns.rdatatype.A)
+        wire = query.to_wire()
+        for attempt in range(self.attempts):
+            nameserver = self.nameservers[attempt % len(self.nameservers)]
+            protocol = await self._get_protocol(nameserver)
+            while query.id in protocol.pending:
+                query.id = randrange(0x10000)
+                wire = query.to_wire()
+            future = self._loop.create_future()
+            protocol.pending[query.id] = future
+            try:
+                protocol.transport.sendto(wire)
+                data = await asyncio.wait_for(future, self.retry_interval)
+            except (asyncio.TimeoutError, OSError):
+                continue
+            finally:
+                protocol.pending.pop(query.id, None)
+            try:
+                response = dns.message.from_wire(data)
+            except dns.exception.DNSException:
+                continue
+            if query.is_response(response):
+                return self._handle(name, response)
+        raise ResolverTimeout('No answer for {}'.format(name))
+
+    def _handle(self, name, response):
+        rcode = response.rcode()
+        if rcode not in (dns.rcode.NOERROR, dns.rcode.NXDOMAIN):
+            raise ResolverError(
+                '{} returned for {}'.format(dns.rcode.to_text(rcode), name)
+            )
+        addresses = tuple(
+            item.address
+            for rrset in response.answer
+            if rrset.rdtype == dns.rdatatype.A
+            for item in rrset
+        )
+        if addresses:
+            ttl = min(r.ttl for r in response.answer)
+        else:
+            ttl = min(
+                (
+                    min(r.ttl, r[0].minimum) for r in response.authority
+                    if r.rdtype == dns.rdatatype.SOA
+                ),
+                default=self.negative_ttl
+            )
+        self._store(name, addresses, ttl)
+        return addresses
+
+
+class EventLoopThread(object):
+    """An event loop running in a background thread.
+
+    The thread is started in each process when the loop is used for
+    the first time there, so that an instance can be created before
+    forking worker processes.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._pid = None
+        self._loop = None
+
+    def _get_loop(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                Thread(
+                    target=self._loop.run_forever,
+                    name='event-loop',
+                    daemon=True
+                ).start()
+                self._pid = os.getpid()
+            return self._loop
+
+    def run(self, coroutine):
+        """Run a coroutine in the loop and wait for its result.
+
+        :param coroutine: a coroutine to be run
+        :returns: the value returned by the coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(
+            coroutine,
+            self._get_loop()
+        ).result()
+
+
+class DNSBLTester(object):
+    """A URL tester querying a number of DNSBL services concurrently.
+
+    An instance replaces the DNSBL clients passed to it in a chain of
+    URL testers. Items returned by it have the clients as their sources.
+
+    :ivar dnsbls: a sequence of spam_lists.clients.DNSBL instances
+    providing names of the services and classifications of their
+    return codes
+    :ivar resolver: an instance of AsyncResolver
+    :ivar budget: a maximum number of seconds spent on testing URLs
+    """
+
+    def __init__(self, dnsbls, resolver, budget, loop_thread=None):
+        """Initialize a new instance.
+
+        :param dnsbls: a sequence of spam_lists.clients.DNSBL instances
+        :param resolver: an instance of AsyncResolver
+        :param budget: a maximum number of seconds spent on testing URLs
+        :param loop_thread: an instance of EventLoopThread running
+        the resolver when the tester is used by synchronous code. If
+        it is None, a new one is created.
+        """
+        self.dnsbls = list(dnsbls)
+        self.resolver = resolver
+        self.budget = budget
+        self._loop_thread = loop_thread or EventLoopThread()
+
+    def _get_queries(self, urls):
+        """Get names to be queried for hosts of URLs.
+
+        :param urls: a sequence of URLs
+        :returns: a list of tuples containing a DNSBL client, an object
+        representing a host, a name to be resolved and a list of URLs
+        with the host
+        """
+        # pylint: disable=protected-access
+        queries = []
+        for dnsbl in self.dnsbls:
+            by_name = {}
+            for url in urls:
+                try:
+                    host = dnsbl._host_factory(urlparse(url).hostname)
+                except InvalidHostError:
+                    continue
+                name = host.relative_domain.derelativize(
+                    dnsbl._query_suffix
+                ).to_text()
+                if name not in by_name:
+                    by_name[name] = (dnsbl, host, name, [])
+                    queries.append(by_name[name])
+                by_name[name][3].append(url)
+        return queries
+
+    async def _match(self, urls):
+        """Get items for listed hosts of URLs and the matching URLs.
+
+        :param urls: a sequence of valid URLs
+        :returns: a list of tuples containing an instance of
+        spam_lists.structures.AddressListItem and a list of URLs
+        with the listed host. If any query failed or exceeded
+        the budget, it is an instance of DegradedResult.
+        :raises IncompleteLookupError: if any query failed or exceeded
+        the budget, and no host is listed
+        """
+        queries = self._get_queries(urls)
+        if not queries:
+            return []
+        tasks = [
+            asyncio.ensure_future(self.resolver.resolve(name))
+            for _, _, name, _ in queries
+        ]
+        _, pending = await asyncio.wait(tasks, timeout=self.budget)
+        for task in pending:
+            task.cancel()
+
+        matches = []
+        failed = []
+        for (dnsbl, host, name, matching), task in zip(queries, tasks):
+            if task in pending or task.exception() is not None:
+                failed.append(name)
+                continue
+            addresses = task.result()
+            if addresses:
+                item = self._get_item(dnsbl, host, addresses)
+                matches.append((item, matching))
+        if failed and not matches:
+            raise IncompleteLookupError(
+                'DNSBL queries failed or exceeded the time budget of {} '
+                'seconds: {}'.format(self.budget, ', '.join(failed))
+            )
+        if failed:
+            return DegradedResult(matches)
+        return matches
+
+    async def lookup(self, urls):
+        """Get items for listed hosts of URLs.
+
+        This coroutine can be used by code running in an event loop
+        instead of lookup_matching.
+
+        :param urls: a sequence of valid URLs
+        :returns: a list of spam_lists.structures.AddressListItem
+        instances, ordered by DNSBL clients and URLs. If any query
+        failed or exceeded the budget, it is an instance of
+        DegradedResult.
+        :raises IncompleteLookupError: if any query failed or exceeded
+        the budget, and no host is listed
+        """
+        matches = await self._match(urls)
+        return _as_result(matches, (item for item, _ in matches))
+
+    @staticmethod
+    def _get_item(dnsbl, host, addresses):
+        # pylint: disable=protected-access
+        classification = set()
+        for address in addresses:
+            code = int(address.split('.')[-1])
+            classification.update(dnsbl._get_entry_classification(code))
+        return AddressListItem(host.to_unicode(), dnsbl, classification)
+
+    @accepts_valid_urls
+    def lookup_matching(self, urls):
+        """Get items for listed hosts of URLs.
+
+        :param urls: a sequence of URLs
+        :returns: a list of spam_lists.structures.AddressListItem
+        instances, or an instance of DegradedResult
+        :raises InvalidURLError: if there are any invalid URLs
+        :raises IncompleteLookupError: if any query failed or exceeded
+        the budget, and no host is listed
+        """
+        return self._loop_thread.run(self.lookup(list(urls)))
+
+    def any_match(self, urls):
+        """Check if any of URLs has a listed host.
+
+        :param urls: a sequence of URLs
+        :returns: True if any host is listed
+        :raises InvalidURLError: if there are any invalid URLs
+        :raises IncompleteLookupError: if any query failed or exceeded
+        the budget, and no host is listed
+        """
+        return bool(self.lookup_matching(urls))
+
+    @accepts_valid_urls
+    def filter_matching(self, urls):
+        """Get URLs with listed hosts.
+
+        :param urls: a sequence of URLs
+        :returns: a list of the URLs, or an instance of DegradedResult
+        :raises InvalidURLError: if there are any invalid URLs
+        :raises IncompleteLookupError: if any query failed or exceeded
+        the budget, and no host is listed
+        """
+        urls = list(urls)
+        matches = self._loop_thread.run(self._match(urls))
+        matching = {u for _, m in matches for u in m}
+        return _as_result(matches, (u for u in urls if u in matching))
@@ -1,21 +1,36 @@
 # -*- coding: utf-8 -*-
 """Elements of domain and persistence layers."""
 from bisect import bisect_left
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict, namedtuple
+from functools import partial
+from hashlib import md5
+from itertools import count
 from math import log, floor
 from random import randint, choice
 import re
 from string import ascii_lowercase, digits
+from threading import Lock
+from timeit import default_timer
+from weakref import WeakSet
 
 from cached_property import cached_property
 
-from flask import url_for, Flask
+from flask import (
+    url_for, abort, Flask, _app_ctx_stack, current_app, has_request_context,
+    request
+)
 from flask_sqlalchemy import SQLAlchemy
 from injector import (
     inject, singleton, Module, Key, InstanceProvider
 )
-from sqlalchemy import types
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import event, types, sql
+from sqlalchemy.exc import IntegrityError, TimeoutError
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from .alias_strategies import AliasSpace, get_alias_strategy
+from .caching import TTLCache, cache_registry, get_cache_registry
 
 
 class AlphabetValueError(ValueError):
@@ -83,6 +98,9 @@ class AliasFactory(object):
     alias string
     :param max_length: a maximum length of a newly generated
     alias string
+    :ivar strategy: a function creating new aliases, called by
+    create_random. By default, it is create_from_characters method
+    of the instance - see alias_strategies module for other strategies.
     """
 
     def __init__(self, characters, min_length, max_length):
@@ -105,6 +123,15 @@ class AliasFactory(object):
             )
         self._min_length = min_length
         self._max_length = max_length
+        self.strategy = self.create_from_characters
+
+    @property
+    def min_new_alias_length(self):
+        """Get the minimum length of newly generated alias strings.
+
+        :returns: the value of the setting for this factory
+        """
+        return self._min_length
 
     @property
     def max_new_alias_length(self):
@@ -124,6 +151,14 @@ class AliasFactory(object):
         """
         return self._alphabet
 
+    @property
+    def homoglyphs(self):
+        """Get strings that are replaced in aliases.
+
+        :returns: a tuple of the strings, ordered by length
+        """
+        return tuple(self._homoglyph_replacement)
+
     @alphabet.setter
     def alphabet(self, value):
         """Set characters that can appear in an alias.
@@ -177,6 +212,13 @@ class AliasFactory(object):
     def create_random(self):
         """Create a random alias for a preconfigured length range.
 
+        :return: an alias string created by the strategy of the factory
+        """
+        return self.strategy()
+
+    def create_from_characters(self):
+        """Create a random alias character by character.
+
         The alias is generated as a string of a random length between
         self._min_length and self._max_length, consisting of randomly
         chosen characters included in self.alphabet value.
@@ -222,7 +264,7 @@ class IntegerAlias(types.TypeDecorator):
     """A custom database column type representing alias value.
 
     :cvar impl: implementation type of the class
-    :cvar _max_int_32: a maximum value of a 32 bit signed integer
+    :cvar _max_int: a maximum value of a 32 bit signed integer
 
     This value is treated as a maximum allowed one for the integers
     used in generation because we assume the implementation type will
@@ -231,7 +273,7 @@ class IntegerAlias(types.TypeDecorator):
     """
 
     impl = types.Integer
-    _max_int_32 = 2**31 - 1
+    _max_int = 2**31 - 1
 
     @inject
     def __init__(self, alias_factory):
@@ -241,24 +283,54 @@ class IntegerAlias(types.TypeDecorator):
         by the object
         """
         self._alphabet = alias_factory.alphabet
-        base = len(self._alphabet)
-        max_safe_length = int(floor(log(self._max_int_32, base)))
+        self._base = len(self._alphabet)
+        max_safe_length = self._get_max_safe_length()
         max_length = alias_factory.max_new_alias_length
 
         if max_length > max_safe_length:
             raise AlphabetValueError(
                 'The alias factory can be used to generate strings of'
                 ' a length up to {} characters, but such aliases can not be'
-                ' converted to an integer smaller than max int32'.format(
-                    max_length
+                ' converted to an integer smaller than {}'.format(
+                    max_length,
+                    self._max_int
                 )
             )
 
-        self._base = base
         self._alias_factory = alias_factory
 
         super(IntegerAlias, self).__init__()
 
+    def _get_max_safe_length(self):
+        """Get a maximum length of aliases that can be always stored.
+
+        :returns: a number of characters
+        """
+        return int(floor(log(self._max_int, self._base)))
+
+    def _to_integer(self, alias):
+        integer = 0
+        for exponent, char in enumerate(reversed(alias)):
+            digit_value = self._alphabet.index(char)
+            integer += digit_value * self._base**exponent
+        return integer
+
+    def _to_string(self, integer, length=1):
+        string = ''
+        while True:
+            integer, remainder = divmod(integer, self._base)
+            string = self._alphabet[remainder] + string
+            if integer == 0 and len(string) >= length:
+                break
+        return string
+
+    def _check_range(self, integer, alias):
+        if integer > self._max_int:
+            raise AliasValueError(
+                "The alias '{}' is too long to be stored".format(alias)
+            )
+        return integer
+
     def process_bind_param(self, value, dialect):
         """Get an integer representation of given alias string.
 
@@ -269,16 +341,10 @@ class IntegerAlias(types.TypeDecorator):
         :returns: an integer corresponding to the alias string
         :raises AliasValueError: if value is not a valid alias string,
         for example: if it contains characters that are not part
-        of the alphabet
+        of the alphabet, or if it is too long to be stored
         """
-        integer = 0
         valid_alias = self._alias_factory.from_string(value)
-
-        for exponent, char in enumerate(reversed(valid_alias)):
-            digit_value = self._alphabet.index(char)
-            integer += digit_value * self._base**exponent
-
-        return integer
+        return self._check_range(self._to_integer(valid_alias), value)
 
     process_literal_param = process_bind_param
 
@@ -291,25 +357,251 @@ class IntegerAlias(types.TypeDecorator):
         used by the database
         :returns: a string converted from the integer
         """
-        string = ''
-        while True:
-            value, remainder = divmod(value, self._base)
-            string = self._alphabet[remainder] + string
-            if value == 0:
-                break
+        return self._to_string(value)
 
-        return string
+
+class BigIntegerAlias(IntegerAlias):
+    """A column type representing alias value as a 64 bit integer.
+
+    Aliases are encoded in the same way as by IntegerAlias, so integers
+    stored in a column of that type remain valid after the column is
+    widened. Aliases that differ only in leading characters
+    representing zero (for example: "0ab" and "ab") are represented by
+    the same integer.
+
+    :cvar _max_int: a maximum value of a 64 bit signed integer
+    """
+
+    impl = types.BigInteger
+    _max_int = 2**63 - 1
+
+
+class LengthAwareAlias(BigIntegerAlias):
+    """A column type representing alias value as a 64 bit integer.
+
+    The integer representing an alias of a given length is its
+    positional value increased by the number of all shorter aliases,
+    so aliases that differ only in leading characters representing zero
+    (for example: "0" and "00") are represented by different integers.
+
+    Integers stored by other alias types represent other aliases with
+    this type, so it can be used only for databases that don't contain
+    target URLs stored with them.
+    """
+
+    def _get_max_safe_length(self):
+        length = 0
+        while self._offset(length + 2) - 1 <= self._max_int:
+            length += 1
+        return length
+
+    def _offset(self, length):
+        """Get a number of non-empty aliases shorter than given length.
+
+        :param length: a positive number of characters
+        :returns: the integer representing the first alias of
+        the length
+        """
+        return (self._base**length - self._base) // (self._base - 1)
+
+    def process_bind_param(self, value, dialect):
+        """Get an integer representation of given alias string.
+
+        :param value: an alias string
+        :param dialect: a dialect used by the database
+        :returns: an integer corresponding to the alias string
+        :raises AliasValueError: if value is not a valid alias string
+        """
+        valid_alias = self._alias_factory.from_string(value)
+        if not valid_alias:
+            raise AliasValueError('An alias can not be empty')
+        integer = self._offset(len(valid_alias))
+        integer += self._to_integer(valid_alias)
+        return self._check_range(integer, value)
+
+    process_literal_param = process_bind_param
+
+    def process_result_value(self, value, dialect):
+        """Get an alias string for given integer.
+
+        :param value: an integer representing alias string
+        :param dialect: a dialect used by the database
+        :returns: a string converted from the integer
+        """
+        length = 1
+        while self._offset(length + 1) <= value:
+            length += 1
+        return self._to_string(value - self._offset(length), length)
+
+
+ALIAS_TYPES = OrderedDict([
+    ('positional', BigIntegerAlias),
+    ('length_aware', LengthAwareAlias)
+])
+
+
+def get_alias_type(encoding, alias_factory):
+    """Get a column type of aliases using given encoding.
+
+    :param encoding: one of keys of ALIAS_TYPES
+    :param alias_factory: an instance of AliasFactory used by the type
+    :returns: an instance of a subclass of IntegerAlias
+    :raises ValueError: if the encoding is not a name of an encoding
+    """
+    try:
+        alias_type_cls = ALIAS_TYPES[encoding]
+    except KeyError:
+        raise ValueError(
+            'Unknown alias encoding: {}. Available encodings: {}'.format(
+                encoding,
+                ', '.join(ALIAS_TYPES)
+            )
+        )
+    return alias_type_cls(alias_factory)
+
+
+class URLTemplate(object):
+    """A precompiled template of external URLs of an endpoint.
+
+    A template is a pair of strings surrounding an alias in URLs of
+    an endpoint whose only argument is the alias. Building a URL with
+    it requires only concatenating the strings with the alias, instead
+    of building the URL with the URL map of the application. Aliases
+    are not quoted, because all aliases created by AliasFactory consist
+    of characters that don't require quoting.
+
+    :cvar _PLACEHOLDER: an alias passed to url_for to find the position
+    of aliases in URLs
+    :cvar _SAMPLE: an alias used for verifying a new template
+    :ivar prefix: a part of the URLs preceding the alias
+    :ivar suffix: a part of the URLs following the alias
+    """
+
+    __slots__ = ('prefix', 'suffix')
+
+    _PLACEHOLDER = 'alias'
+    _SAMPLE = 'x0y1'
+
+    def __init__(self, prefix, suffix=''):
+        """Initialize a new instance.
+
+        :param prefix: a part of the URLs preceding the alias
+        :param suffix: a part of the URLs following the alias
+        """
+        self.prefix = prefix
+        self.suffix = suffix
+
+    @classmethod
+    def compile(cls, endpoint):
+        """Create a template of URLs of an endpoint with url_for.
+
+        The template is verified by comparing a URL built with it to
+        a URL built by url_for for the same alias.
+
+        :param endpoint: a name of the endpoint
+        :returns: a new instance of the class
+        :raises ValueError: if the URLs can't be built with a template
+        """
+        url = url_for(endpoint, _external=True, alias=cls._PLACEHOLDER)
+        prefix, placeholder, suffix = url.rpartition(cls._PLACEHOLDER)
+        template = cls(prefix, suffix)
+        expected = url_for(endpoint, _external=True, alias=cls._SAMPLE)
+        if not placeholder or template.build(cls._SAMPLE) != expected:
+            raise ValueError(
+                'URLs of {} cannot be built with a template'.format(endpoint)
+            )
+        return template
+
+    def build(self, alias):
+        """Build a URL for an alias.
+
+        :param alias: the alias
+        :returns: the URL
+        """
+        return self.prefix + alias + self.suffix
+
+    def build_all(self, aliases):
+        """Build URLs for multiple aliases.
+
+        :param aliases: an iterable of aliases
+        :returns: a list of the URLs, in the order of the aliases
+        """
+        prefix, suffix = self.prefix, self.suffix
+        return [prefix + alias + suffix for alias in aliases]
+
+
+_url_templates = TTLCache(100, 3600)
+
+
+def get_url_template(endpoint):
+    """Get a template of external URLs of an endpoint.
+
+    A template is compiled only once for each application, endpoint
+    and root URL or server name for which URLs are built.
+
+    :param endpoint: a name of an endpoint whose only argument is
+    an alias
+    :returns: an instance of URLTemplate
+    """
+    app = current_app._get_current_object()
+    if has_request_context():
+        root = request.url_root
+    else:
+        root = app.config['SERVER_NAME']
+    key = app, endpoint, root
+    template = _url_templates.get(key)
+    if template is None:
+        template = URLTemplate.compile(endpoint)
+        _url_templates.set(key, template)
+    return template
+
+
+class TargetURLRecord(namedtuple('TargetURLRecord', ['alias', 'value'])):
+    """An immutable representation of a stored target URL.
+
+    Records are loaded with Core select statements for requests that
+    only read target URLs, without the overhead of mapped instances
+    tracked by the identity map of a session.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        """Get this target URL as a string."""
+        return self.value
+
+    @property
+    def short_url(self):
+        """Get a short URL associated with this target URL."""
+        return get_url_template('url_shortener.redirect_for').build(
+            self.alias
+        )
+
+    @property
+    def preview_url(self):
+        """Get a preview URL associated with this target URL."""
+        return get_url_template('url_shortener.preview').build(self.alias)
 
 
 class BaseTargetURL(object):
     """A base for classes representing target URLs.
 
     :cvar _session: a database session to be used by the class
+    :cvar _replica_sessions: a sequence of read-only database sessions
+    connected to replicas of the database. Each lookup is performed on
+    the next replica. Aliases missing on the replica are looked up on
+    the primary database only if they were created recently.
+    :cvar _recent_aliases: a cache in which aliases of target URLs
+    created within replication lag are stored, or None if there are
+    no such aliases
     :ivar _alias: a value representing a registered URL in short URLs
     and in database
     """
 
     _session = None
+    _replica_sessions = ()
+    _replica_counter = count()
+    _recent_aliases = None
     _alias = None
 
     def __init__(self, target):
@@ -324,7 +616,7 @@ class BaseTargetURL(object):
         return self._value
 
     def _alternative_url(self, endpoint):
-        return url_for(endpoint, _external=True, alias=self._alias)
+        return get_url_template(endpoint).build(self._alias)
 
     @cached_property
     def short_url(self):
@@ -336,6 +628,193 @@ class BaseTargetURL(object):
         """Get a preview URL associated with this target URL."""
         return self._alternative_url('url_shortener.preview')
 
+    def to_record(self):
+        """Get an immutable record of this target URL.
+
+        :returns: an instance of TargetURLRecord
+        """
+        return TargetURLRecord(self._alias, self._value)
+
+    @staticmethod
+    def short_urls_for(aliases):
+        """Get short URLs for multiple aliases.
+
+        :param aliases: an iterable of aliases
+        :returns: a list of the short URLs, in the order of the aliases
+        """
+        return get_url_template('url_shortener.redirect_for').build_all(
+            aliases
+        )
+
+    @staticmethod
+    def preview_urls_for(aliases):
+        """Get preview URLs for multiple aliases.
+
+        :param aliases: an iterable of aliases
+        :returns: a list of the preview URLs, in the order of
+        the aliases
+        """
+        return get_url_template('url_shortener.preview').build_all(aliases)
+
+    @classmethod
+    def _is_recent(cls, alias):
+        """Check if a target URL may not have reached replicas yet.
+
+        :param alias: an alias of the target URL
+        :returns: True if the target URL was created within
+        replication lag
+        """
+        recent = cls._recent_aliases
+        return recent is not None and recent.get(alias, False)
+
+    @classmethod
+    def _find(cls, get, fall_back=True):
+        """Find a target URL on a replica or on the primary database.
+
+        :param get: a function receiving a query for the class and
+        returning a target URL or None
+        :param fall_back: if True, the primary database is queried
+        when the replica doesn't return a target URL
+        :returns: the target URL found by the function, or None
+        """
+        if cls._replica_sessions:
+            index = next(cls._replica_counter) % len(cls._replica_sessions)
+            target_url = get(cls._replica_sessions[index].query(cls))
+            if target_url is not None or not fall_back:
+                return target_url
+
+        with cls._session.no_autoflush:
+            return get(cls._session.query(cls))
+
+    @classmethod
+    def _find_by_value(cls, value):
+        """Find a target URL with given value.
+
+        The primary database is always queried after a replica miss,
+        because a target URL missing on the replica would be stored
+        again.
+
+        :param value: the value of target URL
+        :returns: an existing instance of the class, or None
+        """
+        return cls._find(
+            lambda query: query.filter_by(_value=value).one_or_none()
+        )
+
+    @classmethod
+    def get_or_404(cls, alias):
+        """Get a target URL registered with given alias.
+
+        :param alias: an alias of the target URL
+        :returns: an existing instance of the class
+        :raises werkzeug.exceptions.NotFound: if there is no target URL
+        with the alias
+        """
+        target_url = cls._find(
+            lambda query: query.get(alias),
+            cls._is_recent(alias)
+        )
+        if target_url is None:
+            abort(404)
+        return target_url
+
+    @classmethod
+    def _get_record_statement(cls):
+        """Get a statement selecting a row of a target URL by alias.
+
+        The statement is created once for each mapped class.
+        """
+        statement = cls.__dict__.get('_record_statement')
+        if statement is None:
+            table = cls.__table__
+            statement = sql.select([table.c.alias, table.c.value]).where(
+                table.c.alias == sql.bindparam('alias')
+            )
+            cls._record_statement = statement
+        return statement
+
+    @classmethod
+    def _select_record(cls, alias):
+        """Select a row of a target URL on a replica or the primary.
+
+        :param alias: an alias of the target URL
+        :returns: a row containing the alias and the value, or None
+        """
+        statement = cls._get_record_statement()
+        params = {'alias': alias}
+        if cls._replica_sessions:
+            index = next(cls._replica_counter) % len(cls._replica_sessions)
+            session = cls._replica_sessions[index]
+            row = session.execute(statement, params).first()
+            if row is not None or not cls._is_recent(alias):
+                return row
+        return cls._session.execute(statement, params).first()
+
+    @classmethod
+    def get_record_or_404(cls, alias):
+        """Get a read-only record of a target URL with given alias.
+
+        :param alias: an alias of the target URL
+        :returns: an instance of TargetURLRecord
+        :raises werkzeug.exceptions.NotFound: if there is no target URL
+        with the alias
+        """
+        row = cls._select_record(alias)
+        if row is None:
+            abort(404)
+        return TargetURLRecord(*row)
+
+    @classmethod
+    def _get_records_statement(cls):
+        """Get a statement selecting rows of target URLs by aliases.
+
+        The statement is created once for each mapped class. Its
+        "aliases" parameter is expanded to a list of values when it is
+        executed.
+        """
+        statement = cls.__dict__.get('_records_statement')
+        if statement is None:
+            table = cls.__table__
+            statement = sql.select([table.c.alias, table.c.value]).where(
+                table.c.alias.in_(sql.bindparam('aliases', expanding=True))
+            )
+            cls._records_statement = statement
+        return statement
+
+    @classmethod
+    def get_records(cls, aliases):
+        """Get read-only records of target URLs with given aliases.
+
+        The records are selected with a single query, on the next read
+        replica if there are any. Recently created target URLs that
+        the replica doesn't return are then selected on the primary
+        database.
+
+        :param aliases: a list of valid aliases
+        :returns: a list of instances of TargetURLRecord for aliases of
+        existing target URLs, in no particular order
+        """
+        if not aliases:
+            return []
+        statement = cls._get_records_statement()
+        records = []
+        if cls._replica_sessions:
+            index = next(cls._replica_counter) % len(cls._replica_sessions)
+            session = cls._replica_sessions[index]
+            records = [
+                TargetURLRecord(*r)
+                for r in session.execute(statement, {'aliases': aliases})
+            ]
+            found = {r.alias for r in records}
+            aliases = [
+                a for a in aliases
+                if a not in found and cls._is_recent(a)
+            ]
+            if not aliases:
+                return records
+        rows = cls._session.execute(statement, {'aliases': aliases})
+        return records + [TargetURLRecord(*r) for r in rows]
+
     @classmethod
     def get_or_create(cls, value):
         """Find an existing target URL or create a new one.
@@ -355,26 +834,515 @@ class BaseTargetURL(object):
             return cache[value]
 
         else:
-            with cls._session.no_autoflush:
-                query = cls._session.query(cls)
-                target_url = query.filter_by(_value=value).one_or_none()
-                if not target_url:
-                    target_url = cls(value)
-                    cls._session.add(target_url)
+            target_url = cls._find_by_value(value)
+            if not target_url:
+                target_url = cls(value)
+                cls._session.add(target_url)
             cache[value] = target_url
             return target_url
 
 
+def _stable_hash(key):
+    """Get a hash of a string that doesn't change between processes.
+
+    :param key: a string to be hashed
+    :returns: a 64 bit unsigned integer
+    """
+    return int.from_bytes(md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing(object):
+    """A consistent hash ring assigning keys to nodes.
+
+    Each node is represented by a number of points on the ring, and
+    a key is assigned to the node owning the first point following
+    the hash of the key. When a node is added or removed, only keys
+    assigned to its points change their nodes.
+
+    :ivar nodes: a tuple of names of the nodes
+    """
+
+    def __init__(self, nodes, points_per_node=128):
+        """Initialize a new instance.
+
+        :param nodes: names of nodes to be placed on the ring
+        :param points_per_node: a number of points representing each
+        node. More points result in a more even distribution of keys.
+        :raises ValueError: if there are no nodes
+        """
+        self.nodes = tuple(nodes)
+        if not self.nodes:
+            raise ValueError('A hash ring requires at least one node')
+
+        points = sorted(
+            (_stable_hash('{}-{}'.format(node, i)), node)
+            for node in self.nodes
+            for i in range(points_per_node)
+        )
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def get_node(self, key):
+        """Get a node to which given key is assigned.
+
+        :param key: a string
+        :returns: a name of the node
+        """
+        index = bisect_left(self._hashes, _stable_hash(key))
+        return self._owners[index % len(self._owners)]
+
+
+class ShardRouter(object):
+    """Assigns target URLs to database shards.
+
+    A target URL is stored on a shard assigned to the integer value
+    of its alias, so that it can be found by its alias with a query
+    sent to a single shard. New target URLs receive aliases assigned to
+    the same shard as their values, so that they are usually found by
+    their values with a single query, too.
+
+    Adding or removing a shard changes assignment of some aliases,
+    which requires moving their target URLs with rebalance_shards.
+    Until then, target URLs that are not stored on shards assigned to
+    their aliases can't be found by their aliases. The shards of moved
+    target URLs no longer have to be assigned to their values, so
+    a target URL not found on the shard of its value is looked up on
+    the other shards.
+
+    :ivar ring: an instance of HashRing whose nodes are names of
+    the shards
+    """
+
+    def __init__(self, ring, alias_type, alias_factory):
+        """Initialize a new instance.
+
+        :param ring: an instance of HashRing
+        :param alias_type: an instance of IntegerAlias or its subclass,
+        used for converting aliases to integers
+        :param alias_factory: an instance of AliasFactory used for
+        generating new aliases
+        """
+        self.ring = ring
+        self._alias_type = alias_type
+        self._alias_factory = alias_factory
+
+    def get_shard_for_alias(self, alias):
+        """Get a shard on which a target URL with given alias is stored.
+
+        :param alias: an alias string
+        :returns: a name of the shard
+        :raises AliasValueError: if the alias is not a valid one
+        """
+        integer = self._alias_type.process_bind_param(alias, None)
+        return self.ring.get_node(str(integer))
+
+    def get_shard_for_value(self, value):
+        """Get a shard on which a new target URL is to be stored.
+
+        :param value: the value of target URL
+        :returns: a name of the shard
+        """
+        return self.ring.get_node(value)
+
+    def create_alias(self, context):
+        """Create a random alias for a new target URL.
+
+        This method is used as a default of the alias column.
+
+        :param context: an execution context of the insert statement,
+        providing the value of target URL being inserted
+        :returns: an alias assigned to the same shard as the value
+        """
+        shard = self.get_shard_for_value(context.current_parameters['value'])
+        while True:
+            alias = self._alias_factory.create_random()
+            if self.get_shard_for_alias(alias) == shard:
+                return alias
+
+    def get_session_factory(self, engines):
+        """Get a factory of sessions distributing queries to shards.
+
+        :param engines: a dictionary mapping names of the shards to
+        their engines
+        :returns: a session factory for
+        sqlalchemy.ext.horizontal_shard.ShardedSession
+        """
+        return sessionmaker(
+            class_=ShardedSession,
+            shards=engines,
+            shard_chooser=lambda mapper, instance, clause=None: (
+                self.get_shard_for_value(instance._value)
+            ),
+            id_chooser=lambda query, ident: [
+                self.get_shard_for_alias(ident[0])
+            ],
+            query_chooser=lambda query: list(engines)
+        )
+
+
+class BaseShardedTargetURL(BaseTargetURL):
+    """A base for classes representing target URLs stored on shards.
+
+    The database session of the class must be an instance of
+    sqlalchemy.ext.horizontal_shard.ShardedSession, routing lookups
+    by alias with its id chooser. Read replicas are not used.
+
+    :cvar _shard_router: an instance of ShardRouter used by the class
+    """
+
+    _shard_router = None
+
+    @classmethod
+    def _select_record(cls, alias):
+        shard = cls._shard_router.get_shard_for_alias(alias)
+        return cls._session.execute(
+            cls._get_record_statement(),
+            {'alias': alias},
+            shard_id=shard
+        ).first()
+
+    @classmethod
+    def get_records(cls, aliases):
+        """Get read-only records of target URLs with given aliases.
+
+        The aliases are grouped by their shards, and each shard is
+        queried once.
+
+        :param aliases: a list of valid aliases
+        :returns: a list of instances of TargetURLRecord, in no
+        particular order
+        """
+        by_shard = defaultdict(list)
+        for alias in aliases:
+            shard = cls._shard_router.get_shard_for_alias(alias)
+            by_shard[shard].append(alias)
+        statement = cls._get_records_statement()
+        records = []
+        for shard, shard_aliases in by_shard.items():
+            rows = cls._session.execute(
+                statement,
+                {'aliases': shard_aliases},
+                shard_id=shard
+            )
+            records.extend(TargetURLRecord(*r) for r in rows)
+        return records
+
+    @classmethod
+    def _find_by_value(cls, value):
+        """Find a target URL with given value.
+
+        The shard assigned to the value is queried first, and then
+        the other shards, because target URLs moved by rebalance_shards
+        may be stored on shards not assigned to their values.
+
+        :param value: the value of target URL
+        :returns: an existing instance of the class, or None
+        """
+        router = cls._shard_router
+        shard = router.get_shard_for_value(value)
+        with cls._session.no_autoflush:
+            target_url = cls._find_by_value_on(shard, value)
+            if target_url is not None:
+                return target_url
+            for other in router.ring.nodes:
+                if other != shard:
+                    target_url = cls._find_by_value_on(other, value)
+                    if target_url is not None:
+                        return target_url
+        return None
+
+    @classmethod
+    def _find_by_value_on(cls, shard, value):
+        query = cls._session.query(cls).set_shard(shard)
+        return query.filter_by(_value=value).one_or_none()
+
+
+def rebalance_shards(ring, engines, table, batch_size=1000):
+    """Move target URLs to shards assigned to their aliases.
+
+    Rows are read from each shard in batches, in order of their
+    aliases, and the rows assigned to other shards are inserted into
+    them before being deleted from the source shard, so that they
+    remain available during rebalancing. Shortening new URLs should be
+    paused until rebalancing is finished, because a target URL moved
+    between lookups of its value on two shards is not found, and its
+    URL can be stored twice.
+
+    :param ring: an instance of HashRing assigning aliases to shards
+    :param engines: a dictionary mapping names of shards to their
+    engines. It must contain all nodes of the ring, and it may contain
+    shards being removed from the ring, to move all rows out of them.
+    :param table: a table in which target URLs are stored
+    :param batch_size: a maximum number of rows read at once
+    :returns: a number of moved rows
+    """
+    raw_table = sql.table(table.name, sql.column('alias'), sql.column('value'))
+    alias = raw_table.c.alias
+    moved = 0
+    for source, source_engine in engines.items():
+        last_alias = None
+        while True:
+            query = sql.select([alias, raw_table.c.value])
+            if last_alias is not None:
+                query = query.where(alias > last_alias)
+            rows = source_engine.execute(
+                query.order_by(alias).limit(batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            last_alias = rows[-1][0]
+
+            batches = defaultdict(list)
+            for row_alias, value in rows:
+                target = ring.get_node(str(row_alias))
+                if target != source:
+                    batches[target].append(
+                        {'alias': row_alias, 'value': value}
+                    )
+
+            for target, batch in batches.items():
+                with engines[target].begin() as connection:
+                    connection.execute(raw_table.insert(), batch)
+                with source_engine.begin() as connection:
+                    connection.execute(
+                        raw_table.delete().where(
+                            alias.in_([r['alias'] for r in batch])
+                        )
+                    )
+                moved += len(batch)
+    return moved
+
+
+class PoolWaitMonitor(object):
+    """Statistics of time spent waiting for pooled connections.
+
+    :ivar checkouts: a number of connections checked out of the pool
+    :ivar timeouts: a number of checkouts that failed because no
+    connection became available in time
+    :ivar total_wait: a total number of seconds spent waiting for
+    connections
+    :ivar max_wait: the longest time spent waiting for a connection
+    """
+
+    def __init__(self, logger, warning_threshold):
+        """Initialize a new instance.
+
+        :param logger: a logger used for reporting long waits
+        :param warning_threshold: a number of seconds of waiting
+        for a connection after which a warning is logged, or None if
+        no warnings are to be logged
+        """
+        self.logger = logger
+        self.warning_threshold = warning_threshold
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._lock = Lock()
+
+    def record(self, wait, timed_out=False):
+        """Record time spent waiting for a connection.
+
+        :param wait: a number of seconds spent waiting
+        :param timed_out: True if no connection was checked out
+        because the pool timeout was exceeded
+        """
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+        threshold = self.warning_threshold
+        if threshold is not None and wait > threshold:
+            self.logger.warning(
+                'Waited {:.3f} s for a database connection{}.'.format(
+                    wait,
+                    ' and timed out' if timed_out else ''
+                )
+            )
+
+    def as_dict(self):
+        """Get the statistics as a dictionary."""
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'total_wait': self.total_wait,
+                'mean_wait': self.total_wait / attempts if attempts else 0.0,
+                'max_wait': self.max_wait
+            }
+
+
+class MonitoredQueuePool(QueuePool):
+    """A queue pool measuring time spent waiting for connections.
+
+    The time of each checkout is measured around the public connect
+    method, so it also includes opening new connections and testing
+    pooled ones, if pre-ping is enabled.
+
+    :ivar wait_monitor: an instance of PoolWaitMonitor recording
+    the time, or None
+    """
+
+    wait_monitor = None
+
+    def connect(self):
+        """Check out a connection, recording the time it took.
+
+        :returns: a proxy of a DBAPI connection
+        :raises sqlalchemy.exc.TimeoutError: if no connection became
+        available within the timeout of the pool
+        """
+        start = default_timer()
+        try:
+            connection = super(MonitoredQueuePool, self).connect()
+        except TimeoutError:
+            self._record(start, True)
+            raise
+        self._record(start)
+        return connection
+
+    def _record(self, start, timed_out=False):
+        if self.wait_monitor is not None:
+            self.wait_monitor.record(default_timer() - start, timed_out)
+
+    def recreate(self):
+        pool = super(MonitoredQueuePool, self).recreate()
+        pool.wait_monitor = self.wait_monitor
+        return pool
+
+
+def execute_on_connect(statement, dbapi_connection, connection_record):
+    """Execute a statement on a newly created connection.
+
+    This function is used as a listener of the pool "connect" event,
+    after partially applying the statement.
+
+    :param statement: an SQL statement to be executed
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute(statement)
+    cursor.close()
+
+
+class ConfiguredSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy extension applying engine options from config.
+
+    In addition to options supported by Flask-SQLAlchemy, the engines
+    are configured with options specific to their dialects, statement
+    timeouts and pessimistic testing of pooled connections. Queue pools
+    used by the engines record time spent waiting for connections.
+
+    :cvar STATEMENT_TIMEOUT_SQL: templates of statements setting
+    statement timeouts (in milliseconds) for supported dialects
+    :ivar pool_monitors: a dictionary mapping bind keys (None for
+    the default bind) to instances of PoolWaitMonitor used by pools
+    of their engines
+    """
+
+    STATEMENT_TIMEOUT_SQL = {
+        'postgresql': 'SET statement_timeout = {}',
+        'mysql': 'SET SESSION max_execution_time = {}'
+    }
+
+    def __init__(self, *args, **kwargs):
+        """Initialize a new instance.
+
+        :param args: positional arguments for SQLAlchemy constructor
+        :param kwargs: keyword arguments for SQLAlchemy constructor
+        """
+        self.pool_monitors = {}
+        self._configured_engines = WeakSet()
+        self._configuration_lock = Lock()
+        super(ConfiguredSQLAlchemy, self).__init__(*args, **kwargs)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        """Apply options specific to the dialect of an engine.
+
+        :param app: an application for which the engine is created
+        :param sa_url: an instance of sqlalchemy.engine.url.URL for
+        the engine
+        :param options: a dictionary of options for creating the engine
+        """
+        result = super(ConfiguredSQLAlchemy, self).apply_driver_hacks(
+            app,
+            sa_url,
+            options
+        )
+        backend = sa_url.get_backend_name()
+        dialect_options = app.config['SQLALCHEMY_DIALECT_OPTIONS']
+        options.update(dialect_options.get(backend, {}))
+        if app.config['SQLALCHEMY_POOL_PRE_PING']:
+            options.setdefault('pool_pre_ping', True)
+        if backend != 'sqlite':
+            options.setdefault('poolclass', MonitoredQueuePool)
+        return result
+
+    def get_engine(self, app=None, bind=None):
+        """Get an engine, configuring it first if it is a new one.
+
+        :param app: an application for which the engine is created
+        :param bind: a bind key of the engine
+        :returns: an instance of sqlalchemy.engine.Engine
+        """
+        engine = super(ConfiguredSQLAlchemy, self).get_engine(app, bind)
+        if engine not in self._configured_engines:
+            with self._configuration_lock:
+                if engine not in self._configured_engines:
+                    self._configure(self.get_app(app), engine, bind)
+                    self._configured_engines.add(engine)
+        return engine
+
+    def _configure(self, app, engine, bind):
+        config = app.config
+        timeout = config['SQLALCHEMY_STATEMENT_TIMEOUT']
+        if timeout is not None:
+            template = self.STATEMENT_TIMEOUT_SQL.get(engine.dialect.name)
+            if template is None:
+                app.logger.warning(
+                    'Statement timeout is not supported for {} '
+                    'databases.'.format(engine.dialect.name)
+                )
+            else:
+                statement = template.format(int(timeout * 1000))
+                event.listen(
+                    engine,
+                    'connect',
+                    partial(execute_on_connect, statement)
+                )
+
+        if isinstance(engine.pool, MonitoredQueuePool):
+            monitor = PoolWaitMonitor(
+                app.logger,
+                config['SQLALCHEMY_POOL_WAIT_WARNING']
+            )
+            engine.pool.wait_monitor = self.pool_monitors[bind] = monitor
+
+
 commit_changes = Key('commit_changes')
 
 
+target_url_session = Key('target_url_session')
+
+
 @inject
-def get_commit_changes(app: Flask, db: SQLAlchemy):
+def get_commit_changes(
+        app: Flask,
+        session: target_url_session,
+        caches: cache_registry
+):
     """Get a function to be called to commit changes.
 
     :param app: an instance of Flask representing the current
     application
-    :param db: an instance of SQLAlchemy for the database being used
+    :param session: a database session in which target URLs are
+    stored
+    :param caches: an instance of caching.CacheRegistry whose commit
+    hooks are notified about stored target URLs
     :returns: a function to be used for commiting changes
     """
     def commit():
@@ -409,15 +1377,30 @@ def get_commit_changes(app: Flask, db: SQLAlchemy):
         and more frequent, administrators can realise when it is
         necessary to increase the range of available aliases by
         increasing their maximum or decreasing their minimum length.
+
+        Rolling back the session removes pending target URLs from it,
+        so they are added again before the next attempt, to receive
+        new aliases.
+
+        Records of stored target URLs are taken after flushing
+        the session, when their aliases are already assigned, and
+        passed to commit hooks of caches after the commit.
         """
         integrity_error_count = 0
         while True:
+            pending = list(session.new)
             try:
-                db.session.commit()
+                session.flush()
+                records = [
+                    p.to_record() for p in pending
+                    if isinstance(p, BaseTargetURL)
+                ]
+                session.commit()
                 break
             except IntegrityError:
                 integrity_error_count += 1
-                db.session.rollback()
+                session.rollback()
+                session.add_all(pending)
 
         limit = app.config['INTEGRITY_ERROR_LIMIT']
         if integrity_error_count > limit:
@@ -425,19 +1408,37 @@ def get_commit_changes(app: Flask, db: SQLAlchemy):
                 'Number of integrity errors exceeds the limit: {} > {}'
                 ''.format(integrity_error_count, limit)
             )
+        if records:
+            caches.notify_commit(records)
     return commit
 
 
 target_url_class = Key('target_url_class')
+click_count_table = Key('click_count_table')
+snapshot_fallback = Key('snapshot_fallback')
 
 
 class DomainAndPersistenceModule(Module):
     """Configures injection of domain and persistence services.
 
     This class represents an injector module that creates and binds
-    an instance of SQLAlchemy, a mapped target URL class and a function
-    responsible for commiting changes. Both SQLAlchemy instance and
-    target URL class are created eagerly.
+    an instance of SQLAlchemy, a mapped target URL class, a table of
+    click counts and a function responsible for commiting changes.
+    Both SQLAlchemy instance and target URL class are created eagerly,
+    but the database is not accessed until it is needed for the first
+    time. Tables are not created automatically - see "create_db"
+    command of manage.py.
+
+    Sessions connected to binds listed in READ_REPLICA_BINDS option are
+    used by the target URL class for lookups. If SHARD_BINDS option is
+    set, target URLs are stored on the listed binds instead of
+    the primary database, using a session that distributes queries
+    between them. All these sessions are removed at the end of each
+    application context, like the primary session.
+
+    If SNAPSHOT_FILE option is set, an instance of
+    snapshot.SnapshotFallback is bound for looking up target URLs when
+    the database fails. Otherwise, None is bound instead.
     """
 
     def __init__(self, app):
@@ -449,8 +1450,31 @@ class DomainAndPersistenceModule(Module):
         self.app = app
         # See http://flask-sqlalchemy.pocoo.org/2.1/config/
         app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-        self.db = SQLAlchemy(app)
-        self.db.create_all()
+        self.db = ConfiguredSQLAlchemy(app)
+        self.replica_sessions = tuple(
+            self.db.create_scoped_session({
+                'bind': self.db.get_engine(app, bind),
+                'binds': {}
+            })
+            for bind in app.config['READ_REPLICA_BINDS']
+        )
+        self.scoped_sessions = list(self.replica_sessions)
+        app.teardown_appcontext(self.remove_sessions)
+        self.click_count_table = self.db.Table(
+            'clickCount',
+            self.db.Column('alias', self.db.BigInteger, primary_key=True),
+            self.db.Column('minute', self.db.DateTime, primary_key=True),
+            self.db.Column('count', self.db.Integer, nullable=False)
+        )
+
+    def remove_sessions(self, _):
+        """Remove sessions connected to read replicas and shards.
+
+        :param _: an exception that ended the application context,
+        or None
+        """
+        for session in self.scoped_sessions:
+            session.remove()
 
     def configure(self, binder):
         """Configure dependencies.
@@ -458,15 +1482,57 @@ class DomainAndPersistenceModule(Module):
         :param binder: an instance of injector.Binder used for binding
         interfaces to implementations
         """
+        target_url_cls = self.get_target_url_class()
         binder.bind(SQLAlchemy, to=self.db, scope=singleton)
         binder.bind(
             target_url_class,
-            to=InstanceProvider(
-                self.get_target_url_class()
-            ),
+            to=InstanceProvider(target_url_cls),
+            scope=singleton
+        )
+        binder.bind(
+            target_url_session,
+            to=InstanceProvider(target_url_cls._session),
+            scope=singleton
+        )
+        binder.bind(
+            click_count_table,
+            to=InstanceProvider(self.click_count_table),
             scope=singleton
         )
         binder.bind(commit_changes, to=get_commit_changes, scope=singleton)
+        binder.bind(
+            snapshot_fallback,
+            to=InstanceProvider(self.get_snapshot_fallback(target_url_cls)),
+            scope=singleton
+        )
+
+    def get_snapshot_fallback(self, target_url_cls):
+        """Get an object looking up target URLs in a snapshot.
+
+        :param target_url_cls: a class of target URLs whose lookups
+        are protected by the fallback
+        :returns: an instance of snapshot.SnapshotFallback, or None if
+        no snapshot is configured
+        """
+        config = self.app.config
+        if config['SNAPSHOT_FILE'] is None:
+            return None
+        from .circuit_breaker import CircuitBreaker
+        from .snapshot import SnapshotFallback, SnapshotReader
+        return SnapshotFallback(
+            SnapshotReader(
+                config['SNAPSHOT_FILE'],
+                config['SNAPSHOT_CHECK_INTERVAL'],
+                self.app.logger
+            ),
+            target_url_cls.__table__.c.alias.type,
+            CircuitBreaker(
+                config['DATABASE_FAILURE_THRESHOLD'],
+                config['DATABASE_RESET_TIMEOUT']
+            ),
+            config['DATABASE_LATENCY_BUDGET'],
+            self.app.logger
+        )
 
     def get_target_url_class(self):
         """Get a configured subclass of BaseTargetURL and db.Model.
@@ -475,20 +1541,59 @@ class DomainAndPersistenceModule(Module):
         by the application.
         """
         alias_factory = self.get_alias_factory()
+        alias_type = get_alias_type(
+            self.app.config['ALIAS_ENCODING'],
+            alias_factory
+        )
+        shard_binds = self.app.config['SHARD_BINDS']
+
+        if shard_binds:
+            base = BaseShardedTargetURL
+            router = ShardRouter(
+                HashRing(shard_binds),
+                alias_type,
+                alias_factory
+            )
+            engines = {
+                bind: self.db.get_engine(self.app, bind)
+                for bind in shard_binds
+            }
+            session = scoped_session(
+                router.get_session_factory(engines),
+                scopefunc=_app_ctx_stack.__ident_func__
+            )
+            self.scoped_sessions.append(session)
+            replica_sessions = ()
+            recent_aliases = None
+            create_alias = router.create_alias
+        else:
+            base = BaseTargetURL
+            router = None
+            session = self.db.session
+            replica_sessions = self.replica_sessions
+            recent_aliases = None
+            if replica_sessions:
+                recent_aliases = get_cache_registry(self.app).get(
+                    'recent_aliases'
+                )
+            create_alias = alias_factory.create_random
 
-        class TargetURL(BaseTargetURL, self.db.Model):
+        class TargetURL(base, self.db.Model):
             """Represents a target URL expected to be shortened.
 
             :ivar _value: a value of a target URL
             """
 
-            _session = self.db.session
+            _session = session
+            _replica_sessions = replica_sessions
+            _recent_aliases = recent_aliases
+            _shard_router = router
 
             _alias = self.db.Column(
                 'alias',
-                IntegerAlias(alias_factory),
+                alias_type,
                 primary_key=True,
-                default=alias_factory.create_random
+                default=create_alias
             )
 
             _value = self.db.Column(
@@ -507,7 +1612,8 @@ class DomainAndPersistenceModule(Module):
         alias values. It uses a combination of digits and ASCII
         lowercase characters to create its own character set,
         and uses values of minimum and maximum new alias length options
-        provided in config file.
+        and the strategy selected with ALIAS_STRATEGY option provided in
+        config file.
         """
         min_new_alias_length = self.app.config['MIN_NEW_ALIAS_LENGTH']
         max_new_alias_length = self.app.config['MAX_NEW_ALIAS_LENGTH']
@@ -517,14 +1623,25 @@ class DomainAndPersistenceModule(Module):
             min_new_alias_length,
             max_new_alias_length
         )
+        alias_factory.strategy = get_alias_strategy(
+            self.app.config['ALIAS_STRATEGY'],
+            alias_factory,
+            self.app.config['SECRET_KEY']
+        )
 
         self.app.logger.info(
             "The application will generate aliases from {} to {} characters "
             "long.\n\nThe following characters will be used in aliases: {}"
-            "".format(
+            "\n\nThe number of aliases that can be generated: {}".format(
                 min_new_alias_length,
                 max_new_alias_length,
-                alias_factory.alphabet
+                alias_factory.alphabet,
+                AliasSpace(
+                    alias_factory.alphabet,
+                    alias_factory.homoglyphs,
+                    min_new_alias_length,
+                    max_new_alias_length
+                ).size
             )
         )
 
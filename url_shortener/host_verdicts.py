@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Caching of verdicts of host blacklists.
+
+Most blacklists used by the application judge URLs only by their
+hosts, so their verdict for one URL applies to all other URLs with
+the same host. Their results are cached per host, separately from
+verdicts of blacklists testing whole URLs.
+"""
+from urllib.parse import urlparse
+
+from spam_lists.validation import accepts_valid_urls
+
+from .circuit_breaker import mark_degraded
+from .coalescing import SingleFlight
+
+
+_MISSING = object()
+
+
+class HostVerdictTester(object):
+    """A URL tester caching verdicts of host blacklists per host.
+
+    :ivar host_lists: a sequence of URL testers judging URLs only by
+    their hosts, in the order in which they are queried
+    :ivar cache: a cache mapping hosts to items returned by the first
+    matching tester, or to None for hosts that are not listed
+    :ivar _lookups: an instance of SingleFlight coalescing concurrent
+    lookups of the same host
+    """
+
+    def __init__(self, host_lists, cache):
+        """Initialize a new instance.
+
+        :param host_lists: a sequence of objects having
+        lookup_matching(urls) method and judging URLs by their hosts
+        :param cache: an instance of caching.TTLCache or
+        caching.TieredCache
+        """
+        self.host_lists = list(host_lists)
+        self.cache = cache
+        self._lookups = SingleFlight()
+
+    def _lookup(self, url):
+        """Get an item matching the host of a URL.
+
+        Results of lists that returned a degraded result instead of
+        a real verdict, for example because they were unavailable,
+        must not be cached.
+
+        :param url: a valid URL
+        :returns: a tuple containing an item returned by the first
+        matching host list or None, and a boolean value signifying if
+        the verdict can be cached
+        """
+        cacheable = True
+        for host_list in self.host_lists:
+            items = host_list.lookup_matching([url])
+            degraded = getattr(items, 'degraded', False)
+            for item in items:
+                return item, not degraded
+            cacheable = cacheable and not degraded
+        return None, cacheable
+
+    def _get_verdict(self, url):
+        """Get a cached or computed item matching the host of a URL.
+
+        A verdict that can't be cached also marks the current thread
+        as degraded, including threads whose lookups were coalesced
+        with a lookup in another thread.
+
+        :param url: a valid URL
+        :returns: an item representing a listed host, or None
+        """
+        host = urlparse(url).hostname
+        verdict = self.cache.get(host, _MISSING)
+        if verdict is _MISSING:
+            verdict, cacheable = self._lookups.do(host, self._lookup, url)
+            if cacheable:
+                self.cache.set(host, verdict)
+            else:
+                mark_degraded()
+        return verdict
+
+    @accepts_valid_urls
+    def lookup_matching(self, urls):
+        """Get items for listed hosts of URLs.
+
+        :param urls: a sequence of URLs
+        :returns: items representing the listed hosts, one for each
+        host
+        :raises InvalidURLError: if there are any invalid URLs
+        """
+        seen = set()
+        for url in urls:
+            host = urlparse(url).hostname
+            if host in seen:
+                continue
+            seen.add(host)
+            verdict = self._get_verdict(url)
+            if verdict is not None:
+                yield verdict
+
+    def any_match(self, urls):
+        """Check if any of URLs has a listed host.
+
+        :param urls: a sequence of URLs
+        :returns: True if any host is listed
+        :raises InvalidURLError: if there are any invalid URLs
+        """
+        return any(self.lookup_matching(urls))
+
+    @accepts_valid_urls
+    def filter_matching(self, urls):
+        """Get URLs with listed hosts.
+
+        :param urls: a sequence of URLs
+        :returns: the URLs
+        :raises InvalidURLError: if there are any invalid URLs
+        """
+        for url in urls:
+            if self._get_verdict(url) is not None:
+                yield url
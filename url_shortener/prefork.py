@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Preparation of the application for preforking servers.
+
+A preforking server can create the application in its master process
+and then fork worker processes. Objects created before the fork are
+shared by workers as long as their memory pages are not written to,
+so loading large, immutable state in the master process lowers memory
+usage of each worker and the time it needs to start handling requests.
+"""
+import gc
+import os
+from weakref import WeakSet
+
+from .forms import url_form_class
+from .templating import precompile_templates
+from .validation import BlacklistValidator
+
+
+_engines_to_reset = WeakSet()
+_fork_hook_registered = False
+
+
+def _recreate_pools():
+    """Replace pools of engines registered by reset_pool_after_fork."""
+    for engine in list(_engines_to_reset):
+        engine.pool = engine.pool.recreate()
+
+
+def reset_pool_after_fork(engine):
+    """Make child processes replace the connection pool of an engine.
+
+    Connections inherited from the parent process must never be used by
+    a child, nor closed by it, because that would affect the same
+    connections in the parent. The child gets a new, empty pool
+    instead, and the inherited one is simply dropped.
+
+    A single fork hook is registered for all engines, the first time
+    the function is called, and it resets engines that still exist
+    when a child process is created.
+
+    :param engine: an instance of sqlalchemy.engine.Engine
+    """
+    global _fork_hook_registered
+    _engines_to_reset.add(engine)
+    if not _fork_hook_registered:
+        os.register_at_fork(after_in_child=_recreate_pools)
+        _fork_hook_registered = True
+
+
+def preload(app, injector, engines):
+    """Load state shared by workers of a preforking server.
+
+    The function creates blacklists, including custom host lists,
+    the URL form class, compiled templates and the public suffix list
+    used by spam-lists to recognize registered domains, even if
+    the application is configured for lazy startup. Aliasing and
+    the mapped target URL class are already created with the injector.
+
+    After loading, all objects tracked by the garbage collector are
+    moved to its permanent generation, so that collections performed
+    by workers don't write to memory pages shared with the master
+    process. Database engines are disposed of, so that no connections
+    are inherited by workers, and their pools are reset in each child
+    process after a fork.
+
+    :param app: an application to be prepared
+    :param injector: an instance of injector.Injector used by
+    the application
+    :param engines: database engines used by the application
+    """
+    injector.get(BlacklistValidator)
+    injector.get(url_form_class)
+    precompile_templates(app)
+
+    from spam_lists.structures import registered_domain
+    registered_domain('example.com')
+
+    for engine in engines:
+        engine.dispose()
+        reset_pool_after_fork(engine)
+
+    gc.collect()
+    gc.freeze()
+
+    app.logger.info(
+        'Shared state loaded. {} objects frozen.'.format(
+            gc.get_freeze_count()
+        )
+    )
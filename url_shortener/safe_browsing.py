@@ -0,0 +1,676 @@
+# -*- coding: utf-8 -*-
+"""A client of Google Safe Browsing Update API (v4).
+
+Instead of sending each tested URL to Google, the client keeps a local
+database of SHA256 hash prefixes of listed URL expressions, refreshed in
+a background thread. Full hashes are requested only for prefixes of
+tested URLs that are found in the database, and their results are
+cached for as long as the API allows.
+
+Prefixes of each threat list are stored in sorted, fixed-width byte
+strings, one for each prefix length. The database can be saved to
+a file, which is then memory-mapped, so that it doesn't have to be
+downloaded again when the application is restarted.
+"""
+from base64 import b64decode, b64encode
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+from hashlib import sha256
+import json
+import mmap
+import os
+import posixpath
+import re
+from tempfile import NamedTemporaryFile
+from threading import Event, Lock, Thread
+from urllib.parse import quote_from_bytes, unquote_to_bytes, urlsplit
+
+import requests
+from spam_lists.structures import AddressListItem
+from spam_lists.validation import accepts_valid_urls
+
+from .caching import TTLCache
+from .coalescing import SingleFlight
+
+
+_IP_ADDRESS = re.compile(r'^\d+\.\d+\.\d+\.\d+$')
+
+
+def _unescape(value):
+    """Percent-unescape a string until it doesn't change.
+
+    :param value: a string
+    :returns: unescaped bytes
+    """
+    value = value.encode('utf-8')
+    while True:
+        unescaped = unquote_to_bytes(value)
+        if unescaped == value:
+            return value
+        value = unescaped
+
+
+def _escape(value):
+    return quote_from_bytes(
+        value,
+        safe=bytes(c for c in range(0x21, 0x7f) if c not in b'#%')
+    )
+
+
+def canonicalize(url):
+    """Get a canonical form of a URL, as defined by Safe Browsing API.
+
+    :param url: a valid URL
+    :returns: the canonical URL
+    """
+    url = re.sub('[\t\r\n]', '', url.strip()).split('#', 1)[0]
+    parts = urlsplit(url)
+
+    host = _unescape(parts.hostname or '').decode('utf-8', 'replace')
+    host = re.sub(r'\.+', '.', host.strip('.')).lower()
+
+    path = _unescape(parts.path or '/').decode('latin-1')
+    normalized = posixpath.normpath(path)
+    if normalized.startswith('//'):
+        normalized = normalized[1:]
+    if path.endswith('/') and normalized != '/':
+        normalized += '/'
+
+    canonical = '{}://{}{}'.format(
+        parts.scheme.lower(),
+        _escape(host.encode('utf-8')),
+        _escape(normalized.encode('latin-1'))
+    )
+    if '?' in url:
+        canonical += '?' + _escape(_unescape(parts.query))
+    return canonical
+
+
+def get_expressions(url):
+    """Get host suffix and path prefix expressions for a URL.
+
+    :param url: a valid URL
+    :returns: a list of expressions, without duplicates, to be hashed
+    and looked up in threat lists
+    """
+    parts = urlsplit(canonicalize(url))
+    host = parts.hostname
+    hosts = [host]
+    if not _IP_ADDRESS.match(host):
+        components = host.split('.')
+        hosts.extend(
+            '.'.join(components[i:])
+            for i in range(max(len(components) - 5, 1), len(components) - 1)
+        )
+
+    path = parts.path
+    paths = [path + '?' + parts.query] if parts.query else []
+    paths.append(path)
+    components = path.split('/')[1:-1]
+    paths.extend(
+        '/' + ''.join(c + '/' for c in components[:i])
+        for i in range(min(len(components), 3) + 1)
+    )
+
+    expressions = []
+    for host_value in hosts:
+        for path_value in paths[:6]:
+            expression = host_value + path_value
+            if expression not in expressions:
+                expressions.append(expression)
+    return expressions
+
+
+def get_hashes(url):
+    """Get full SHA256 hashes of expressions of a URL.
+
+    :param url: a valid URL
+    :returns: a list of 32-byte hashes
+    """
+    return [sha256(e.encode('utf-8')).digest() for e in get_expressions(url)]
+
+
+def _parse_duration(value, default=0):
+    """Get a number of seconds represented by a duration string.
+
+    :param value: a string like "300.5s", or None
+    :param default: a value to be returned if the string is None
+    :returns: a float
+    """
+    return float(value.rstrip('s')) if value else default
+
+
+class _FixedWidthSequence(object):
+    """A sequence of byte strings of equal length stored in a buffer."""
+
+    def __init__(self, buffer, offset, count, length):
+        self._buffer = buffer
+        self._offset = offset
+        self._count = count
+        self._length = length
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        start = self._offset + index * self._length
+        return self._buffer[start:start + self._length]
+
+    def __iter__(self):
+        return (self[i] for i in range(self._count))
+
+
+class PrefixSet(object):
+    """A sorted set of hash prefixes of varying lengths.
+
+    Prefixes of each length are stored in a buffer containing all of
+    them sorted and concatenated, and are searched with bisection.
+
+    :ivar buffers: a dictionary mapping prefix lengths to tuples
+    containing a buffer (bytes or mmap), an offset of the prefixes in
+    the buffer and a number of the prefixes
+    """
+
+    def __init__(self, buffers=None):
+        """Initialize a new instance.
+
+        :param buffers: a dictionary of buffers, as described by
+        the buffers attribute
+        """
+        self.buffers = buffers or {}
+
+    @classmethod
+    def from_prefixes(cls, prefixes):
+        """Create a set containing given prefixes.
+
+        :param prefixes: an iterable of byte strings
+        :returns: a new instance
+        """
+        by_length = {}
+        for prefix in set(prefixes):
+            by_length.setdefault(len(prefix), []).append(prefix)
+        return cls({
+            length: (b''.join(sorted(values)), 0, len(values))
+            for length, values in by_length.items()
+        })
+
+    def __len__(self):
+        """Get the number of prefixes in the set."""
+        return sum(count for _, _, count in self.buffers.values())
+
+    def __iter__(self):
+        """Iterate over prefixes in lexicographic order."""
+        return iter(sorted(
+            prefix
+            for length, (buffer, offset, count) in self.buffers.items()
+            for prefix in _FixedWidthSequence(buffer, offset, count, length)
+        ))
+
+    def checksum(self):
+        """Get a SHA256 hash of all sorted prefixes concatenated."""
+        digest = sha256()
+        for prefix in self:
+            digest.update(prefix)
+        return digest.digest()
+
+    def match(self, full_hash):
+        """Get prefixes of a full hash that are in the set.
+
+        :param full_hash: a 32-byte hash
+        :returns: a list of the prefixes
+        """
+        matches = []
+        for length, (buffer, offset, count) in self.buffers.items():
+            prefix = full_hash[:length]
+            prefixes = _FixedWidthSequence(buffer, offset, count, length)
+            index = bisect_left(prefixes, prefix)
+            if index < count and prefixes[index] == prefix:
+                matches.append(prefix)
+        return matches
+
+
+ThreatList = namedtuple(
+    'ThreatList',
+    ['threat_type', 'platform_type', 'threat_entry_type']
+)
+
+THREAT_LISTS = tuple(
+    ThreatList(threat_type, 'ANY_PLATFORM', 'URL')
+    for threat_type in (
+        'MALWARE', 'SOCIAL_ENGINEERING', 'UNWANTED_SOFTWARE',
+        'POTENTIALLY_HARMFUL_APPLICATION'
+    )
+)
+
+
+class SafeBrowsingUpdateClient(object):
+    """Sends requests to Safe Browsing API.
+
+    :ivar api_url: a base URL of the API
+    :ivar api_key: a key of the API
+    :ivar client_id: a name of the application
+    :ivar client_version: a version of the application
+    :ivar timeout: a number of seconds after which requests time out
+    """
+
+    def __init__(
+            self,
+            api_url,
+            api_key,
+            client_id,
+            client_version,
+            timeout=5
+    ):
+        """Initialize a new instance.
+
+        :param api_url: a base URL of the API
+        :param api_key: a key of the API
+        :param client_id: a name of the application
+        :param client_version: a version of the application
+        :param timeout: a number of seconds after which requests
+        time out
+        """
+        self.api_url = api_url.rstrip('/') + '/'
+        self.api_key = api_key
+        self.client_id = client_id
+        self.client_version = client_version
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def _post(self, method, body):
+        body['client'] = {
+            'clientId': self.client_id,
+            'clientVersion': self.client_version
+        }
+        response = self._session.post(
+            self.api_url + method,
+            params={'key': self.api_key},
+            json=body,
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def fetch_updates(self, states):
+        """Request updates of threat lists.
+
+        :param states: a dictionary mapping instances of ThreatList to
+        their current states
+        :returns: a deserialized response
+        """
+        return self._post('threatListUpdates:fetch', {
+            'listUpdateRequests': [
+                {
+                    'threatType': threat_list.threat_type,
+                    'platformType': threat_list.platform_type,
+                    'threatEntryType': threat_list.threat_entry_type,
+                    'state': state,
+                    'constraints': {'supportedCompressions': ['RAW']}
+                }
+                for threat_list, state in states.items()
+            ]
+        })
+
+    def find_full_hashes(self, prefixes, states):
+        """Request full hashes matching hash prefixes.
+
+        :param prefixes: a sequence of hash prefixes
+        :param states: a dictionary mapping instances of ThreatList to
+        their current states
+        :returns: a deserialized response
+        """
+        threat_lists = list(states)
+        return self._post('fullHashes:find', {
+            'clientStates': [s for s in states.values() if s],
+            'threatInfo': {
+                'threatTypes': sorted({t.threat_type for t in threat_lists}),
+                'platformTypes': sorted(
+                    {t.platform_type for t in threat_lists}
+                ),
+                'threatEntryTypes': sorted(
+                    {t.threat_entry_type for t in threat_lists}
+                ),
+                'threatEntries': [
+                    {'hash': b64encode(p).decode('ascii')} for p in prefixes
+                ]
+            }
+        })
+
+
+_ListData = namedtuple('_ListData', ['state', 'prefixes'])
+
+
+class SafeBrowsingDatabase(object):
+    """A local database of hash prefixes of threat lists.
+
+    The database is replaced as a whole after each update, so it can be
+    read by many threads while it is updated.
+
+    :ivar client: an instance of SafeBrowsingUpdateClient
+    :ivar threat_lists: a sequence of ThreatList instances to be stored
+    :ivar path: a path to a file in which the database is stored, or
+    None if it is kept only in memory
+    :ivar logger: a logger used for reporting failed updates
+    """
+
+    _MAGIC = b'GSBPREFIXES1\n'
+
+    def __init__(self, client, threat_lists, logger, path=None):
+        """Initialize a new instance.
+
+        :param client: an instance of SafeBrowsingUpdateClient
+        :param threat_lists: a sequence of ThreatList instances
+        :param logger: a logger used for reporting failed updates
+        :param path: a path to a file in which the database is to be
+        stored, or None. If the file exists, the database is loaded
+        from it.
+        """
+        self.client = client
+        self.threat_lists = list(threat_lists)
+        self.logger = logger
+        self.path = path
+        self._lists = {t: _ListData('', PrefixSet()) for t in threat_lists}
+        self._lock = Lock()
+        self._pid = None
+        self._stopped = Event()
+        if path is not None and os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        """Get the number of stored prefixes."""
+        return sum(len(d.prefixes) for d in self._lists.values())
+
+    @property
+    def states(self):
+        """Get a dictionary mapping threat lists to their states."""
+        return {t: d.state for t, d in self._lists.items()}
+
+    def match(self, full_hash):
+        """Get stored prefixes of a full hash.
+
+        :param full_hash: a 32-byte hash
+        :returns: a set of matching prefixes from all threat lists
+        """
+        return {
+            prefix
+            for data in self._lists.values()
+            for prefix in data.prefixes.match(full_hash)
+        }
+
+    def update(self):
+        """Update all threat lists.
+
+        :returns: a minimum number of seconds to wait before the next
+        update, as requested by the API
+        """
+        response = self.client.fetch_updates(self.states)
+        lists = dict(self._lists)
+        for list_update in response.get('listUpdateResponses', []):
+            threat_list = ThreatList(
+                list_update['threatType'],
+                list_update['platformType'],
+                list_update['threatEntryType']
+            )
+            if threat_list in lists:
+                lists[threat_list] = self._apply(
+                    threat_list,
+                    lists[threat_list],
+                    list_update
+                )
+        self._lists = lists
+        if self.path is not None:
+            self._save()
+        return _parse_duration(response.get('minimumWaitDuration'))
+
+    def _apply(self, threat_list, data, list_update):
+        """Apply an update to a threat list.
+
+        :param threat_list: an instance of ThreatList being updated
+        :param data: current data of the list
+        :param list_update: a deserialized update of the list
+        :returns: updated data of the list. If its checksum doesn't
+        match the one sent by the API, the list is emptied so that
+        a full update is requested next time.
+        """
+        prefixes = []
+        if list_update.get('responseType') != 'FULL_UPDATE':
+            prefixes = list(data.prefixes)
+            removed = {
+                i
+                for removal in list_update.get('removals', [])
+                for i in removal['rawIndices']['indices']
+            }
+            prefixes = [p for i, p in enumerate(prefixes) if i not in removed]
+
+        for addition in list_update.get('additions', []):
+            raw = addition['rawHashes']
+            size = raw['prefixSize']
+            hashes = b64decode(raw['rawHashes'])
+            prefixes.extend(
+                hashes[i:i + size] for i in range(0, len(hashes), size)
+            )
+
+        prefix_set = PrefixSet.from_prefixes(prefixes)
+        checksum = list_update.get('checksum', {}).get('sha256')
+        if checksum and b64decode(checksum) != prefix_set.checksum():
+            self.logger.warning(
+                'Checksum mismatch for {} Safe Browsing list. It will be '
+                'downloaded again.'.format(threat_list.threat_type)
+            )
+            return _ListData('', PrefixSet())
+        return _ListData(list_update['newClientState'], prefix_set)
+
+    def _save(self):
+        """Save the database to its file, replacing it atomically."""
+        header = []
+        blobs = []
+        offset = 0
+        for threat_list, data in self._lists.items():
+            sizes = {}
+            buffers = data.prefixes.buffers
+            for length, (buffer, start, count) in buffers.items():
+                blob = buffer[start:start + length * count]
+                sizes[length] = (offset, count)
+                blobs.append(blob)
+                offset += len(blob)
+            header.append({
+                'list': list(threat_list),
+                'state': data.state,
+                'sizes': sizes
+            })
+        encoded = json.dumps(header).encode('utf-8')
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with NamedTemporaryFile(
+            dir=directory,
+            prefix='.tmp',
+            delete=False
+        ) as temporary:
+            temporary.write(self._MAGIC)
+            temporary.write(len(encoded).to_bytes(4, 'big'))
+            temporary.write(encoded)
+            for blob in blobs:
+                temporary.write(blob)
+        os.replace(temporary.name, self.path)
+
+    def _load(self):
+        """Load the database from its file, memory-mapping prefixes."""
+        with open(self.path, 'rb') as database_file:
+            buffer = mmap.mmap(
+                database_file.fileno(),
+                0,
+                access=mmap.ACCESS_READ
+            )
+        start = len(self._MAGIC)
+        if buffer[:start] != self._MAGIC:
+            self.logger.warning(
+                '{} is not a Safe Browsing database.'.format(self.path)
+            )
+            return
+        length = int.from_bytes(buffer[start:start + 4], 'big')
+        header = json.loads(buffer[start + 4:start + 4 + length].decode())
+        base = start + 4 + length
+        lists = dict(self._lists)
+        for item in header:
+            threat_list = ThreatList(*item['list'])
+            if threat_list in lists:
+                lists[threat_list] = _ListData(
+                    item['state'],
+                    PrefixSet({
+                        int(size): (buffer, base + offset, count)
+                        for size, (offset, count) in item['sizes'].items()
+                    })
+                )
+        self._lists = lists
+
+    def start(self, retry_interval=60):
+        """Start updating the database in a background thread.
+
+        The method does nothing if the thread has already been started
+        in the current process.
+
+        :param retry_interval: a number of seconds after which a failed
+        update is retried
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopped = Event()
+            Thread(
+                target=self._run,
+                args=(self._stopped, retry_interval),
+                name='safe-browsing-update',
+                daemon=True
+            ).start()
+
+    def stop(self):
+        """Stop updating the database."""
+        self._stopped.set()
+
+    def _run(self, stopped, retry_interval):
+        wait = 0
+        while not stopped.wait(wait):
+            try:
+                wait = self.update()
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception('Safe Browsing update failed.')
+                wait = retry_interval
+
+
+class SafeBrowsingUpdateTester(object):
+    """A URL tester using a local database of Safe Browsing prefixes.
+
+    :ivar database: an instance of SafeBrowsingDatabase
+    :ivar _full_hashes: an instance of caching.TTLCache mapping listed
+    full hashes to sets of threat types, each stored for its cache
+    duration
+    :ivar _negative: an instance of caching.TTLCache containing hash
+    prefixes known not to match any listed full hash, stored for
+    the negative cache duration
+    :ivar _requests: an instance of SingleFlight coalescing identical
+    full hash requests
+    """
+
+    def __init__(self, database, cache_size=10000):
+        """Initialize a new instance.
+
+        :param database: an instance of SafeBrowsingDatabase. It is
+        started when the tester is used for the first time in
+        a process.
+        :param cache_size: a maximum number of full hashes and
+        a maximum number of hash prefixes for which results of full
+        hash requests are cached
+        """
+        self.database = database
+        self._full_hashes = TTLCache(cache_size, 0)
+        self._negative = TTLCache(cache_size, 0)
+        self._requests = SingleFlight()
+
+    def __str__(self):
+        return 'Google Safe Browsing'
+
+    def _find_full_hashes(self, prefixes):
+        """Request full hashes and cache the results.
+
+        :param prefixes: a tuple of hash prefixes
+        :returns: a dictionary mapping listed full hashes matching
+        the prefixes to sets of their threat types
+        """
+        response = self.database.client.find_full_hashes(
+            prefixes,
+            self.database.states
+        )
+        threat_types = defaultdict(set)
+        durations = {}
+        for match in response.get('matches', []):
+            full_hash = b64decode(match['threat']['hash'])
+            threat_types[full_hash].add(match['threatType'])
+            durations[full_hash] = _parse_duration(match.get('cacheDuration'))
+        for full_hash, types in threat_types.items():
+            self._full_hashes.set(full_hash, types, ttl=durations[full_hash])
+        negative = _parse_duration(response.get('negativeCacheDuration'))
+        for prefix in prefixes:
+            self._negative.set(prefix, True, ttl=negative)
+        return threat_types
+
+    def _get_threat_types(self, url):
+        """Get threat types of lists containing a URL.
+
+        :param url: a valid URL
+        :returns: a set of threat types. It is empty if the URL is
+        not listed
+        """
+        hashes = get_hashes(url)
+        matches = {h: self.database.match(h) for h in hashes}
+        threat_types = set()
+        uncached = set()
+        for full_hash, prefixes in matches.items():
+            cached = self._full_hashes.get(full_hash)
+            if cached is not None:
+                threat_types |= cached
+            elif prefixes:
+                uncached.update(
+                    p for p in prefixes if self._negative.get(p) is None
+                )
+
+        if uncached:
+            key = tuple(sorted(uncached))
+            found = self._requests.do(key, self._find_full_hashes, key)
+            for full_hash, prefixes in matches.items():
+                if prefixes and full_hash in found:
+                    threat_types |= found[full_hash]
+        return threat_types
+
+    @accepts_valid_urls
+    def lookup_matching(self, urls):
+        """Get items for listed URLs.
+
+        :param urls: a sequence of URLs
+        :returns: instances of spam_lists.structures.AddressListItem
+        :raises InvalidURLError: if there are any invalid URLs
+        """
+        self.database.start()
+        for url in urls:
+            threat_types = self._get_threat_types(url)
+            if threat_types:
+                yield AddressListItem(url, self, threat_types)
+
+    def any_match(self, urls):
+        """Check if any of URLs is listed.
+
+        :param urls: a sequence of URLs
+        :returns: True if any of them is listed
+        :raises InvalidURLError: if there are any invalid URLs
+        """
+        return any(self.lookup_matching(urls))
+
+    def filter_matching(self, urls):
+        """Get listed URLs.
+
+        :param urls: a sequence of URLs
+        :returns: the listed URLs
+        :raises InvalidURLError: if there are any invalid URLs
+        """
+        for item in self.lookup_matching(urls):
+            yield item.value
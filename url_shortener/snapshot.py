@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""Snapshots of target URLs used when the database is unavailable.
+
+A snapshot is a read-only file mapping integers representing aliases
+to target URLs. It contains:
+
+* a header with a magic string, the byte order of the numbers and
+  the number of target URLs
+* a sorted array of 64 bit integers of aliases
+* an array of offsets of target URLs in a heap of strings, with one
+  more offset marking the end of the heap
+* the heap of UTF-8 encoded target URLs
+
+The file is mapped into memory and searched with binary search, so its
+pages are loaded by the operating system only when they are needed, and
+shared by all processes of the host. A new snapshot is written to
+a temporary file and moved in place of the old one, so readers always
+see a complete file.
+"""
+from array import array
+from bisect import bisect_left
+import heapq
+import mmap
+import os
+from tempfile import NamedTemporaryFile, TemporaryFile
+from threading import Lock
+from time import monotonic
+import shutil
+import struct
+import sys
+
+from flask import abort
+from sqlalchemy import sql
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError
+
+from .domain_and_persistence import TargetURLRecord
+
+
+MAGIC = b'URLSNAP1'
+HEADER = struct.Struct('<8s?7xQ')
+DATABASE_ERRORS = (OperationalError, InterfaceError, TimeoutError)
+
+
+class SnapshotError(Exception):
+    """An error raised for files that are not valid snapshots."""
+
+
+class Snapshot(object):
+    """A memory-mapped snapshot of target URLs.
+
+    :ivar path: a path to the file of the snapshot
+    :ivar keys: a sequence of integers of aliases, in ascending order
+    """
+
+    def __init__(self, path):
+        """Initialize a new instance.
+
+        :param path: a path to the file of the snapshot
+        :raises SnapshotError: if the file is not a valid snapshot
+        """
+        self.path = path
+        with open(path, 'rb') as snapshot_file:
+            if os.fstat(snapshot_file.fileno()).st_size < HEADER.size:
+                raise SnapshotError('The snapshot is truncated: ' + path)
+            self._mmap = mmap.mmap(
+                snapshot_file.fileno(),
+                0,
+                access=mmap.ACCESS_READ
+            )
+        magic, big_endian, count = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise SnapshotError('The file is not a snapshot: ' + path)
+        if big_endian != (sys.byteorder == 'big'):
+            raise SnapshotError(
+                'The snapshot was written on a host with another byte '
+                'order: ' + path
+            )
+        view = memoryview(self._mmap)
+        keys_end = HEADER.size + 8 * count
+        offsets_end = keys_end + 8 * (count + 1)
+        if len(self._mmap) < offsets_end:
+            raise SnapshotError('The snapshot is truncated: ' + path)
+        self.keys = view[HEADER.size:keys_end].cast('q')
+        self._offsets = view[keys_end:offsets_end].cast('Q')
+        self._heap_start = offsets_end
+        if len(self._mmap) < offsets_end + self._offsets[-1]:
+            raise SnapshotError('The snapshot is truncated: ' + path)
+
+    def __len__(self):
+        """Get the number of target URLs in the snapshot."""
+        return len(self.keys)
+
+    def value_at(self, index):
+        """Get a target URL with given position in the snapshot.
+
+        :param index: the position
+        :returns: the target URL
+        """
+        start = self._heap_start + self._offsets[index]
+        end = self._heap_start + self._offsets[index + 1]
+        return self._mmap[start:end].decode('utf-8')
+
+    def get(self, key):
+        """Get a target URL for an integer of an alias.
+
+        :param key: the integer
+        :returns: the target URL, or None if the snapshot doesn't
+        contain it
+        """
+        index = bisect_left(self.keys, key)
+        if index == len(self.keys) or self.keys[index] != key:
+            return None
+        return self.value_at(index)
+
+
+def write_snapshot(path, items):
+    """Write a snapshot, replacing the existing one atomically.
+
+    :param path: a path to the file of the snapshot
+    :param items: an iterable of tuples containing integers of aliases
+    and target URLs, in ascending order of the integers
+    :returns: a number of written target URLs
+    :raises ValueError: if the integers are not in ascending order
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    keys = array('q')
+    offsets = array('Q', [0])
+    with TemporaryFile(dir=directory) as heap:
+        for key, value in items:
+            if keys and key <= keys[-1]:
+                raise ValueError('Aliases must be in ascending order')
+            data = value.encode('utf-8')
+            heap.write(data)
+            keys.append(key)
+            offsets.append(offsets[-1] + len(data))
+        heap.seek(0)
+        with NamedTemporaryFile(
+            dir=directory,
+            prefix='.tmp',
+            delete=False
+        ) as temporary:
+            try:
+                temporary.write(
+                    HEADER.pack(MAGIC, sys.byteorder == 'big', len(keys))
+                )
+                temporary.write(keys.tobytes())
+                temporary.write(offsets.tobytes())
+                shutil.copyfileobj(heap, temporary)
+                temporary.flush()
+                os.fsync(temporary.fileno())
+            except BaseException:
+                os.unlink(temporary.name)
+                raise
+    os.replace(temporary.name, path)
+    return len(keys)
+
+
+def _scan_aliases(engine, table, batch_size):
+    """Get integers of aliases stored in a database, in order.
+
+    :param engine: an engine connected to the database
+    :param table: a table of target URLs
+    :param batch_size: a maximum number of aliases read at once
+    :returns: a generator of the integers
+    """
+    alias = sql.table(table.name, sql.column('alias')).c.alias
+    last_alias = None
+    while True:
+        query = sql.select([alias])
+        if last_alias is not None:
+            query = query.where(alias > last_alias)
+        rows = engine.execute(
+            query.order_by(alias).limit(batch_size)
+        ).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield row[0]
+        last_alias = rows[-1][0]
+
+
+def _select_values(engines, table, keys, batch_size):
+    """Select target URLs with given integers of aliases.
+
+    :param engines: engines connected to databases storing target URLs
+    :param table: a table of target URLs
+    :param keys: a list of integers of aliases
+    :param batch_size: a maximum number of aliases selected at once
+    :returns: a dictionary mapping the integers to target URLs
+    """
+    raw_table = sql.table(table.name, sql.column('alias'), sql.column('value'))
+    values = {}
+    for engine in engines:
+        for start in range(0, len(keys), batch_size):
+            batch = [k for k in keys[start:start + batch_size]
+                     if k not in values]
+            if not batch:
+                continue
+            values.update(engine.execute(
+                sql.select([raw_table.c.alias, raw_table.c.value]).where(
+                    raw_table.c.alias.in_(batch)
+                )
+            ).fetchall())
+    return values
+
+
+def export_snapshot(path, engines, table, batch_size=1000):
+    """Export target URLs stored in databases to a snapshot.
+
+    The snapshot is refreshed incrementally: only aliases are read from
+    all target URLs, and the target URLs missing from the existing
+    snapshot are selected in batches. Other target URLs are copied
+    from the existing snapshot.
+
+    :param path: a path to the file of the snapshot
+    :param engines: engines connected to databases storing target URLs,
+    for example: shards
+    :param table: a table of target URLs
+    :param batch_size: a maximum number of rows read at once
+    :returns: a tuple containing the number of exported target URLs
+    and the number of target URLs that were not included in
+    the existing snapshot
+    """
+    try:
+        old = Snapshot(path)
+    except (FileNotFoundError, SnapshotError):
+        old = None
+    old_keys = old.keys if old is not None else ()
+
+    keys = array('q', heapq.merge(
+        *(_scan_aliases(e, table, batch_size) for e in engines)
+    ))
+    missing = []
+    index = 0
+    for key in keys:
+        while index < len(old_keys) and old_keys[index] < key:
+            index += 1
+        if index == len(old_keys) or old_keys[index] != key:
+            missing.append(key)
+    values = _select_values(engines, table, missing, batch_size)
+
+    def get_items():
+        index = 0
+        for key in keys:
+            while index < len(old_keys) and old_keys[index] < key:
+                index += 1
+            if index < len(old_keys) and old_keys[index] == key:
+                yield key, old.value_at(index)
+            elif key in values:
+                yield key, values[key]
+
+    return write_snapshot(path, get_items()), len(values)
+
+
+class SnapshotReader(object):
+    """Provides lookups in the current version of a snapshot.
+
+    The file of the snapshot is checked for changes at most once in
+    a given interval. When it is replaced, the new version is mapped
+    into memory and used by subsequent lookups. The old version is
+    unmapped when it is no longer used.
+
+    :ivar path: a path to the file of the snapshot
+    :ivar check_interval: a number of seconds between checks
+    :ivar logger: a logger used for reporting invalid snapshots
+    """
+
+    def __init__(self, path, check_interval, logger, timer=monotonic):
+        """Initialize a new instance.
+
+        :param path: a path to the file of the snapshot
+        :param check_interval: a number of seconds between checks
+        :param logger: a logger used for reporting invalid snapshots
+        :param timer: a function returning current time in seconds
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self.logger = logger
+        self._timer = timer
+        self._lock = Lock()
+        self._next_check = None
+        self._identity = None
+        self._snapshot = None
+
+    def _refresh(self):
+        """Map the file again if it has been replaced."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._identity = self._snapshot = None
+            return
+        identity = stat.st_ino, stat.st_mtime_ns, stat.st_size
+        if identity == self._identity:
+            return
+        try:
+            self._snapshot = Snapshot(self.path)
+        except (OSError, SnapshotError) as error:
+            self.logger.warning(
+                'The snapshot of target URLs can not be used: {!r}'.format(
+                    error
+                )
+            )
+            self._snapshot = None
+        self._identity = identity
+
+    def get(self, key):
+        """Get a target URL for an integer of an alias.
+
+        :param key: the integer
+        :returns: the target URL, or None if the snapshot doesn't exist
+        or doesn't contain it
+        """
+        now = self._timer()
+        with self._lock:
+            if self._next_check is None or now >= self._next_check:
+                self._next_check = now + self.check_interval
+                self._refresh()
+            snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        return snapshot.get(key)
+
+
+class SnapshotFallback(object):
+    """Looks up target URLs in a snapshot when the database fails.
+
+    Lookups in the database are protected by a circuit breaker. Errors
+    of the database, including timeouts of statements and of waiting
+    for pooled connections, and lookups taking longer than the latency
+    budget are counted as failures. While the circuit is open, target
+    URLs are looked up only in the snapshot.
+
+    :ivar reader: an instance of SnapshotReader
+    :ivar alias_type: a column type of aliases of target URLs, used
+    for converting aliases to integers
+    :ivar breaker: an instance of circuit_breaker.CircuitBreaker
+    :ivar budget: a number of seconds after which a lookup in
+    the database is counted as a failure
+    :ivar logger: a logger used for reporting failures
+    """
+
+    def __init__(
+            self,
+            reader,
+            alias_type,
+            breaker,
+            budget,
+            logger,
+            timer=monotonic
+    ):
+        """Initialize a new instance.
+
+        :param reader: an instance of SnapshotReader
+        :param alias_type: a column type of aliases of target URLs
+        :param breaker: an instance of circuit_breaker.CircuitBreaker
+        :param budget: a number of seconds after which a lookup in
+        the database is counted as a failure
+        :param logger: a logger used for reporting failures
+        :param timer: a function returning current time in seconds
+        """
+        self.reader = reader
+        self.alias_type = alias_type
+        self.breaker = breaker
+        self.budget = budget
+        self.logger = logger
+        self._timer = timer
+
+    def _record_latency(self, start):
+        if self._timer() - start > self.budget:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def get_record_or_404(self, target_url_cls, alias):
+        """Get a record of a target URL with given alias.
+
+        :param target_url_cls: a subclass of BaseTargetURL
+        :param alias: the alias
+        :returns: an instance of TargetURLRecord
+        :raises werkzeug.exceptions.NotFound: if the database doesn't
+        contain a target URL with the alias
+        :raises werkzeug.exceptions.ServiceUnavailable: if
+        the database can't be used and the snapshot doesn't contain
+        the target URL
+        :raises AliasValueError: if the alias is invalid
+        """
+        if self.breaker.allow():
+            start = self._timer()
+            try:
+                record = target_url_cls.get_record_or_404(alias)
+            except DATABASE_ERRORS as error:
+                self.breaker.record_failure()
+                self.logger.warning(
+                    'Looking up a target URL in the database failed: '
+                    '{!r}'.format(error)
+                )
+            except Exception:
+                self._record_latency(start)
+                raise
+            else:
+                self._record_latency(start)
+                return record
+
+        key = self.alias_type.process_bind_param(alias, None)
+        value = self.reader.get(key)
+        if value is None:
+            abort(503)
+        return TargetURLRecord(
+            self.alias_type.process_result_value(key, None),
+            value
+        )
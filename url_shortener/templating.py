@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Compilation and caching of templates used by the application."""
+import os
+from tempfile import NamedTemporaryFile
+
+from jinja2 import FileSystemBytecodeCache
+
+
+class SharedFileSystemBytecodeCache(FileSystemBytecodeCache):
+    """A bytecode cache that can be shared by multiple processes.
+
+    Compiled templates are written to temporary files that are then
+    atomically renamed, so that a process loading bytecode from
+    the cache never reads a file that is only partially written by
+    another process.
+    """
+
+    def __init__(self, directory):
+        """Initialize a new instance.
+
+        :param directory: a path to a directory in which compiled
+        templates are to be stored. It is created if it doesn't exist.
+        """
+        os.makedirs(directory, exist_ok=True)
+        super(SharedFileSystemBytecodeCache, self).__init__(directory)
+
+    def dump_bytecode(self, bucket):
+        """Store bytecode of a compiled template.
+
+        :param bucket: an instance of jinja2.bccache.Bucket containing
+        the bytecode. If it can't be stored, its temporary file is
+        removed.
+        """
+        filename = self._get_cache_filename(bucket)
+        temporary = NamedTemporaryFile(
+            dir=self.directory,
+            prefix='.tmp',
+            delete=False
+        )
+        try:
+            with temporary:
+                bucket.write_bytecode(temporary)
+            os.replace(temporary.name, filename)
+        except BaseException:
+            os.unlink(temporary.name)
+            raise
+
+
+def set_up_bytecode_cache(app):
+    """Set up a shared bytecode cache for templates of the application.
+
+    The cache is used only if JINJA_BYTECODE_CACHE_DIR option is set.
+    This function must be called before the Jinja environment of
+    the application is created.
+
+    :param app: an application for which the function will set up
+    the cache
+    """
+    directory = app.config['JINJA_BYTECODE_CACHE_DIR']
+    if directory is not None:
+        app.jinja_options = dict(
+            app.jinja_options,
+            bytecode_cache=SharedFileSystemBytecodeCache(directory)
+        )
+
+
+def precompile_templates(app):
+    """Compile all HTML templates of the application and its blueprints.
+
+    The compiled templates are stored in the template cache of the Jinja
+    environment of the application, and in its bytecode cache, if
+    there is any.
+
+    :param app: an application whose templates are to be compiled
+    :returns: a list of names of compiled templates
+    """
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+
+    app.logger.info('{} templates precompiled.'.format(len(names)))
+
+    return names
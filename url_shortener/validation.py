@@ -1,24 +1,39 @@
 # -*- coding: utf-8 -*-
-"""Custom validators."""
+"""Custom validators.
+
+Importing spam-lists takes a significant part of the application
+startup time, so the library is imported only when blacklists are
+created or used for the first time.
+"""
 from injector import Module, singleton
-from spam_lists import (
-    GoogleSafeBrowsing, HpHosts, GeneralizedURLTester, URLTesterChain,
-    SPAMHAUS_DBL, SPAMHAUS_ZEN, SURBL_MULTI, SortedHostCollection
-)
-from spam_lists.exceptions import InvalidURLError
 from wtforms.validators import ValidationError
 
 from . import __version__, __title__
+from .caching import get_cache_registry
+from .circuit_breaker import reset_degraded
+from .coalescing import SingleFlight
 
 
 class BlacklistValidator(object):
     """A URL spam detector using configurable blacklists.
 
+    Concurrent tests of the same URL are coalesced, so that blacklists
+    are queried only once for all of them.
+
+    :cvar UNAVAILABLE_MESSAGE: a validation message for URLs treated as
+    listed because a fail-closed source couldn't be queried
     :ivar _msg_map: a dictionary mapping blacklists used by an instance
     of the class to validation messages associated with them
+    :ivar _verdicts: an instance of SingleFlight coalescing tests
+    :ivar guards: a sequence of circuit_breaker.SourceGuard instances
+    protecting external sources used by the blacklists
     """
 
-    def __init__(self, composite_blacklist, default_message):
+    UNAVAILABLE_MESSAGE = (
+        'The URL could not be checked for spam. Please try again later.'
+    )
+
+    def __init__(self, composite_blacklist, default_message, guards=()):
         """Initialize a new instance.
 
         :param composite_blacklist: an object representing multiple
@@ -40,10 +55,14 @@ class BlacklistValidator(object):
         :param default_message: a default validation message to be
         provided when a URL matches a blacklist that does not have its
         specific validation message
+        :param guards: a sequence of circuit_breaker.SourceGuard
+        instances protecting sources used by the blacklists
         """
         self._composite_blacklist = composite_blacklist
         self._msg_map = {}
+        self._verdicts = SingleFlight()
         self.default_message = default_message
+        self.guards = list(guards)
 
     def prepend(self, blacklist, message=None):
         """Add a blacklist to the beginning of the chain.
@@ -56,8 +75,38 @@ class BlacklistValidator(object):
         message is to be associated with the blacklist
         """
         self._composite_blacklist.url_tester.url_testers.insert(0, blacklist)
+        self.set_message(blacklist, message)
+
+    def set_message(self, source, message):
+        """Associate a validation message with a source of matches.
+
+        :param source: a blacklist object, or another object used as
+        a source of items returned by the composite blacklist
+        :param message: a custom validation message, or None if
+        the default message is to be used
+        """
         if message is not None:
-            self._msg_map[blacklist] = message
+            self._msg_map[source] = message
+
+    def get_source_metrics(self):
+        """Get the state and latency statistics of guarded sources.
+
+        :returns: a dictionary mapping names of the sources to their
+        metrics
+        """
+        return {g.name: g.as_dict() for g in self.guards}
+
+    def get_verdict(self, url):
+        """Get a message for a blacklisted URL and its reliability.
+
+        :param url: a URL address as a string
+        :returns: a tuple containing a string message if the URL or its
+        redirect addresses match content of any of the blacklists, or
+        None, and a boolean value signifying if any source couldn't be
+        queried and was replaced by its fallback result. Degraded
+        verdicts must not be cached.
+        """
+        return self._verdicts.do(url, self._get_verdict, url)
 
     def get_msg_if_blacklisted(self, url):
         """Get a message if any response has a blacklisted URL.
@@ -66,8 +115,15 @@ class BlacklistValidator(object):
         :returns: a string message if the URL or its redirect addresses
         match content of any of the blacklists, or None
         """
+        return self.get_verdict(url)[0]
+
+    def _get_verdict(self, url):
+        reset_degraded()
+        msg = None
         for match in self._composite_blacklist.lookup_matching([url]):
-            return self._msg_map.get(match.source, self.default_message)
+            msg = self._msg_map.get(match.source, self.default_message)
+            break
+        return msg, reset_degraded()
 
     def assert_not_blacklisted(self, form, field):
         """Assert the URL value from the field is not blacklisted.
@@ -81,6 +137,7 @@ class BlacklistValidator(object):
         :raises ValidationError: if the function returns a message
         for the data
         """
+        from spam_lists.exceptions import InvalidURLError
         try:
             msg = self.get_msg_if_blacklisted(field.data)
             if msg is not None:
@@ -89,13 +146,11 @@ class BlacklistValidator(object):
             pass
 
 
-hp_hosts = HpHosts(__title__)
-
-
 class ValidationModule(Module):
     """Configures an instance of BlacklistValidator as a dependency.
 
-    The instance is created eagerly.
+    The instance is created eagerly, unless LAZY_STARTUP option is set,
+    in which case it is created when it is needed for the first time.
     """
 
     def __init__(self, app):
@@ -105,6 +160,8 @@ class ValidationModule(Module):
         the dependency is to be provided.
         """
         self.app = app
+        self.guards = []
+        self.guarded_testers = []
 
     def configure(self, binder):
         """Configure dependencies.
@@ -112,14 +169,66 @@ class ValidationModule(Module):
         :param binder: an instance of injector.Binder used for binding
         interfaces to implementations
         """
-        binder.bind(
-            BlacklistValidator,
-            to=self.get_blacklist_url_validator(),
-            scope=singleton
+        validator = self.get_blacklist_url_validator
+        if not self.app.config['LAZY_STARTUP']:
+            validator = validator()
+        binder.bind(BlacklistValidator, to=validator, scope=singleton)
+
+    def get_guard(self, name):
+        """Get a guard protecting calls to an external source.
+
+        :param name: a name of the source
+        :returns: an instance of circuit_breaker.SourceGuard with its
+        own circuit breaker and a pool of threads
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from spam_lists.exceptions import InvalidURLError
+        from .circuit_breaker import CircuitBreaker, SourceGuard
+        config = self.app.config
+        guard = SourceGuard(
+            name,
+            CircuitBreaker(
+                config['BLACKLIST_FAILURE_THRESHOLD'],
+                config['BLACKLIST_RESET_TIMEOUT']
+            ),
+            config['BLACKLIST_TIMEOUT'],
+            ThreadPoolExecutor(
+                config['BLACKLIST_THREADS'],
+                thread_name_prefix=name
+            ),
+            self.app.logger,
+            (InvalidURLError,)
+        )
+        self.guards.append(guard)
+        return guard
+
+    def get_guarded_tester(self, name, tester):
+        """Get a URL tester protected by a guard.
+
+        :param name: a name of the source, also used in
+        BLACKLIST_FAIL_CLOSED option
+        :param tester: a URL tester to be protected
+        :returns: an instance of circuit_breaker.GuardedTester
+        """
+        from .circuit_breaker import GuardedTester
+        guarded_tester = GuardedTester(
+            tester,
+            self.get_guard(name),
+            name not in self.app.config['BLACKLIST_FAIL_CLOSED']
         )
+        self.guarded_testers.append(guarded_tester)
+        return guarded_tester
 
     def get_gsb_client(self):
-        """Get an instance of Google Safe Browsing Lookup API client."""
+        """Get an instance of Google Safe Browsing Lookup API client.
+
+        If GSB_UPDATE_API option is set, a tester using a local
+        database of hash prefixes is returned instead.
+        """
+        if self.app.config['GSB_UPDATE_API']:
+            return self.get_gsb_update_tester()
+
+        from spam_lists import GoogleSafeBrowsing
         gsb_client = GoogleSafeBrowsing(
             __title__,
             __version__,
@@ -130,6 +239,34 @@ class ValidationModule(Module):
 
         return gsb_client
 
+    def get_gsb_update_tester(self):
+        """Get a tester using Google Safe Browsing Update API."""
+        from .safe_browsing import (
+            SafeBrowsingDatabase, SafeBrowsingUpdateClient,
+            SafeBrowsingUpdateTester, THREAT_LISTS
+        )
+        database = SafeBrowsingDatabase(
+            SafeBrowsingUpdateClient(
+                self.app.config['GSB_API_URL'],
+                self.app.config['GOOGLE_SAFE_BROWSING_API_KEY'],
+                __title__,
+                __version__
+            ),
+            THREAT_LISTS,
+            self.app.logger,
+            self.app.config['GSB_DATABASE_FILE']
+        )
+
+        self.app.logger.info(
+            'Google Safe Browsing Update API client loaded. The number of '
+            'stored hash prefixes is: {}'.format(len(database))
+        )
+
+        return SafeBrowsingUpdateTester(
+            database,
+            self.app.config['GSB_CACHE_SIZE']
+        )
+
     def get_custom_host_list(self, name, classification, option):
         """Get a custom host blacklist or whitelist.
 
@@ -141,6 +278,7 @@ class ValidationModule(Module):
         :returns: an instance of SortedHostCollection containing sorted
         items provided in application config file
         """
+        from spam_lists import SortedHostCollection
         host_list = SortedHostCollection(name, classification, [])
         listed = self.app.config[option]
         for item in listed:
@@ -155,27 +293,76 @@ class ValidationModule(Module):
 
         return host_list
 
+    def get_dnsbl_tester(self):
+        """Get a tester querying DNSBL services concurrently."""
+        from dns.resolver import get_default_resolver
+        from spam_lists import SPAMHAUS_DBL, SPAMHAUS_ZEN, SURBL_MULTI
+        from .dnsbl import AsyncResolver, DNSBLTester
+        nameservers = (
+            self.app.config['DNSBL_NAMESERVERS'] or
+            get_default_resolver().nameservers
+        )
+        return DNSBLTester(
+            (SURBL_MULTI, SPAMHAUS_ZEN, SPAMHAUS_DBL),
+            AsyncResolver(nameservers),
+            self.app.config['DNSBL_TIMEOUT']
+        )
+
+    def get_host_verdict_tester(self):
+        """Get a tester caching verdicts of host blacklists per host."""
+        from spam_lists import HpHosts
+        from .host_verdicts import HostVerdictTester
+        return HostVerdictTester(
+            (
+                self.get_custom_host_list(
+                    'custom host blacklist',
+                    'blacklisted',
+                    'BLACKLISTED_HOSTS'
+                ),
+                self.get_guarded_tester('dnsbl', self.get_dnsbl_tester()),
+                self.get_guarded_tester('hphosts', HpHosts(__title__))
+            ),
+            get_cache_registry(self.app).get('host_verdicts')
+        )
+
     def get_blacklist_url_validator(self):
-        """Get a BlacklistValidator object to be provided."""
-        return BlacklistValidator(
+        """Get a BlacklistValidator object to be provided.
+
+        Host blacklists are queried first, through a tester caching
+        their verdicts per host. Google Safe Browsing, which tests
+        whole URLs, is queried next.
+
+        Each external source, including the resolver of redirects, is
+        called through a guard limiting the time spent waiting for it.
+        """
+        from spam_lists import GeneralizedURLTester, URLTesterChain
+        from spam_lists.composites import RedirectURLResolver
+        from .circuit_breaker import GuardedRedirectResolver
+        self.guards = []
+        self.guarded_testers = []
+        gsb_tester = self.get_guarded_tester(
+            'google_safe_browsing',
+            self.get_gsb_client()
+        )
+        validator = BlacklistValidator(
             GeneralizedURLTester(
                 URLTesterChain(
-                    self.get_custom_host_list(
-                        'custom host blacklist',
-                        'blacklisted',
-                        'BLACKLISTED_HOSTS'
-                    ),
-                    self.get_gsb_client(),
-                    SURBL_MULTI,
-                    SPAMHAUS_ZEN,
-                    SPAMHAUS_DBL,
-                    hp_hosts
+                    self.get_host_verdict_tester(),
+                    gsb_tester
                 ),
                 whitelist=self.get_custom_host_list(
                     'custom host whitelist',
                     'whitelisted',
                     'WHITELISTED_HOSTS'
+                ),
+                redirect_resolver=GuardedRedirectResolver(
+                    RedirectURLResolver(),
+                    self.get_guard('redirect_resolver')
                 )
             ),
-            'The URL has been recognized as spam.'
+            'The URL has been recognized as spam.',
+            self.guards
         )
+        for tester in self.guarded_testers:
+            validator.set_message(tester, validator.UNAVAILABLE_MESSAGE)
+        return validator
@@ -1,17 +1,31 @@
 # -*- coding: utf-8 -*-
 
 """View functions and classes for the URL shortener."""
+from collections import namedtuple
 import datetime
+from hashlib import sha1
+from hmac import compare_digest
+from time import time
 
 from flask import (
-    redirect, url_for, flash, render_template, Markup, Blueprint
+    redirect, url_for, flash, render_template, Markup, Blueprint,
+    make_response, request, current_app, escape, abort, jsonify
 )
 from flask.views import View
 from injector import inject
+from sqlalchemy.exc import StatementError
+from werkzeug.exceptions import NotFound
 
+from .analytics import ClickEvent, click_event_buffer
+from .caching import (
+    alias_cache, cache_registry, preview_cache, redirect_cache,
+    target_url_cache
+)
+from .coalescing import SingleFlight
 from .forms import url_form_class
 from .domain_and_persistence import (
-    AliasValueError, commit_changes, target_url_class
+    AliasValueError, SQLAlchemy, commit_changes, snapshot_fallback,
+    target_url_class
 )
 
 from .validation import BlacklistValidator
@@ -36,7 +50,8 @@ def inject_year():
 def shorten_url(
         target_url_cls: target_url_class,
         form_cls: url_form_class,
-        commit: commit_changes
+        commit: commit_changes,
+        cached_aliases: alias_cache
 ):
     """Display URL form and handle request for URL shortening.
 
@@ -45,6 +60,9 @@ def shorten_url(
     the database, the method prepares messages to be displayed to
     the user. After that, the method redirects to the same form page.
 
+    Short URLs are looked up in a cache of aliases first, and stored in
+    it after they are found or created.
+
     If there are any errors for data entered by the user into the input
     text field, they are displayed.
 
@@ -53,13 +71,19 @@ def shorten_url(
     :param form_class: a class of form to be displayed to the user
     :param commit_changes: a function responsible for saving new
     shortened URL to the database
+    :param cached_aliases: a cache mapping target URLs to instances of
+    TargetURLRecord
     :returns: a response generated by rendering the template, either
     directly or after redirection.
     """
     form = form_cls()
     if form.validate_on_submit():
-        target_url = target_url_cls.get_or_create(form.url.data)
-        commit()
+        target_url = cached_aliases.get(form.url.data)
+        if target_url is None:
+            target_url = target_url_cls.get_or_create(form.url.data)
+            commit()
+            target_url = target_url.to_record()
+            cached_aliases.set(form.url.data, target_url)
         url_tpl = Markup('{0}: <a href="{1}"{2}>{1}</a>')
         description_url_map = (
             ('Original URL', target_url, ' class=truncated'),
@@ -74,20 +98,116 @@ def shorten_url(
     return render_template('shorten_url.html', form=form)
 
 
+PreviewPage = namedtuple(
+    'PreviewPage',
+    ['target_url', 'warning', 'etag', 'body']
+)
+
+SerializedRedirect = namedtuple(
+    'SerializedRedirect',
+    ['status', 'headers', 'body']
+)
+
+
+def cache_redirect(cache, key, response):
+    """Offer a serialized redirect response to a cache.
+
+    :param cache: an instance of caching.AdmissionCache storing
+    serialized redirect responses
+    :param key: a tuple containing a host and an alias, used as a key
+    of the response in the cache
+    :param response: the redirect response
+    """
+    serialized = SerializedRedirect(
+        response.status_code,
+        response.headers.to_wsgi_list(),
+        response.get_data()
+    )
+    size = len(serialized.body) + sum(
+        len(name) + len(value) for name, value in serialized.headers
+    )
+    cache.set(key, serialized, size)
+
+
+def get_cached_record(cache, alias, lookup):
+    """Get a record of a target URL, looking it up after a cache miss.
+
+    Aliases without target URLs are stored in the cache as False, for
+    MISSING_ALIAS_CACHE_TIMEOUT seconds, so that repeated requests for
+    them cost one lookup.
+
+    :param cache: a cache mapping aliases to instances of
+    TargetURLRecord
+    :param alias: an alias of the target URL
+    :param lookup: a function receiving the alias and returning
+    the record, or raising NotFound
+    :returns: the record
+    :raises werkzeug.exceptions.NotFound: if there is no target URL
+    with the alias
+    """
+    record = cache.get(alias)
+    if record is False:
+        abort(404)
+    if record is None:
+        try:
+            record = lookup(alias)
+        except NotFound:
+            cache.set(
+                alias,
+                False,
+                ttl=current_app.config['MISSING_ALIAS_CACHE_TIMEOUT']
+            )
+            raise
+        cache.set(alias, record)
+    return record
+
+
 class ShowURL(View):
     """A class of views presenting existing target URLs.
 
     The target URLs can be presented either by redirecting to them or
     by showing a preview page containing the target URL and a short URL
     redirecting to it, provided by the application.
+
+    Preview pages are served with ETag headers, so clients can
+    revalidate them with conditional requests. Rendered previews are
+    also stored in a preview cache, so that repeated requests for them
+    don't require querying blacklists or rendering the template again
+    until the cached page expires.
+
+    Redirects to target URLs that are not recognized as spam are
+    stored as serialized responses in a redirect cache, which admits
+    only responses for the most frequently requested aliases.
+
+    Neither preview pages nor redirects are cached if any blacklist
+    source couldn't be queried and its fallback result was used, so
+    that incomplete verdicts are not served after the source recovers.
+
+    Target URLs, and aliases without them, are looked up in a cache of
+    records before querying the database. If a snapshot fallback is
+    configured, it is used for querying the database, so that target
+    URLs are served from the snapshot when the database fails.
+
+    Each request for an existing target URL is recorded as a click
+    event.
+
+    :cvar _lookups: an instance of SingleFlight coalescing concurrent
+    lookups of the same alias requested for the same host
     """
 
+    _lookups = SingleFlight()
+
     @inject
     def __init__(
             self,
             preview,
             target_url_cls: target_url_class,
-            blacklist_validator: BlacklistValidator
+            blacklist_validator: BlacklistValidator,
+            page_cache: preview_cache,
+            response_cache: redirect_cache,
+            record_cache: target_url_cache,
+            fallback: snapshot_fallback,
+            click_events: click_event_buffer
     ):
         """Initialize a new instance.
 
@@ -100,10 +220,34 @@ class ShowURL(View):
         to look up the URL
         :param blacklist_validator: an instance of BlacklistValidator
         used to test if the URL is recognized as spam
+        :param page_cache: a cache for rendered preview pages
+        :param response_cache: an instance of caching.AdmissionCache
+        storing serialized redirect responses
+        :param record_cache: a cache mapping aliases to instances of
+        TargetURLRecord
+        :param fallback: an instance of snapshot.SnapshotFallback used
+        for looking up the URL, or None
+        :param click_events: an instance of ClickEventBuffer receiving
+        click events
         """
         self.preview = preview
         self.target_url_cls = target_url_cls
         self.blacklist_validator = blacklist_validator
+        self.page_cache = page_cache
+        self.response_cache = response_cache
+        self.record_cache = record_cache
+        self.fallback = fallback
+        self.click_events = click_events
+
+    def _get_record(self, alias):
+        """Look up a record of a target URL with given alias.
+
+        :param alias: the alias
+        :returns: an instance of TargetURLRecord
+        """
+        if self.fallback is None:
+            return self.target_url_cls.get_record_or_404(alias)
+        return self.fallback.get_record_or_404(self.target_url_cls, alias)
 
     def dispatch_request(self, alias):
         """Show a target URL associated with given alias.
@@ -118,18 +262,112 @@ class ShowURL(View):
         :raises werkzeug.exception.HTTPException: with code 404, if
         it is raised by the target URL search call
         """
-        target_url = self.target_url_cls.query.get_or_404(alias)
-        spam_msg = self.blacklist_validator.get_msg_if_blacklisted(
+        key = request.host, alias
+        if not self.preview:
+            serialized = self.response_cache.get(key)
+            if serialized is not None:
+                self._record_click(alias)
+                return current_app.response_class(
+                    serialized.body,
+                    status=serialized.status,
+                    headers=serialized.headers
+                )
+
+        page = self.page_cache.get(key)
+        if page is not None:
+            self._record_click(alias)
+            if page.warning or self.preview:
+                return self._get_preview_response(page)
+            return redirect(page.target_url)
+
+        target_url = get_cached_record(
+            self.record_cache,
+            alias,
+            lambda a: self._lookups.do(key, self._get_record, a)
+        )
+        self._record_click(alias)
+        spam_msg, degraded = self.blacklist_validator.get_verdict(
             str(target_url)
         )
 
         if spam_msg or self.preview:
-            return render_template(
-                'preview.html',
-                target_url=target_url,
-                warning=spam_msg
+            page = PreviewPage(
+                str(target_url),
+                spam_msg,
+                self._get_etag(alias, target_url, spam_msg),
+                None
+            )
+            if request.if_none_match.contains(page.etag):
+                return self._get_preview_response(page)
+
+            page = page._replace(
+                body=render_template(
+                    'preview.html',
+                    target_url=target_url,
+                    warning=spam_msg
+                )
+            )
+            if not degraded:
+                self.page_cache.set(key, page)
+            return self._get_preview_response(page)
+        response = redirect(target_url)
+        if not degraded:
+            cache_redirect(self.response_cache, key, response)
+        return response
+
+    def _record_click(self, alias):
+        """Record a click on a short or preview URL.
+
+        :param alias: an alias of the target URL
+        """
+        self.click_events.push(
+            ClickEvent(
+                alias,
+                time(),
+                request.referrer,
+                request.user_agent.string
+            )
+        )
+
+    @staticmethod
+    def _get_etag(alias, target_url, spam_msg):
+        """Get an entity tag for a preview page.
+
+        :param alias: an alias of the previewed target URL
+        :param target_url: the previewed target URL
+        :param spam_msg: a message of the spam verdict for the URL,
+        or None if the URL is not recognized as spam
+        :returns: a string to be used as the tag. It changes whenever
+        the verdict or the content of the page changes, including
+        the scheme and the host of short URLs displayed on it.
+        """
+        content = '\n'.join(
+            str(v) for v in (
+                request.scheme, request.host, alias, target_url, spam_msg,
+                inject_year()['year']
             )
-        return redirect(target_url)
+        )
+        return sha1(content.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _get_preview_response(page):
+        """Get a response for a preview page.
+
+        :param page: an instance of PreviewPage. If it has no body,
+        the response has the status of 304 Not Modified.
+        :returns: a response with caching headers set for the page,
+        made conditional for the current request
+        """
+        if page.body is None:
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(page.body)
+        response.set_etag(page.etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config[
+            'PREVIEW_MAX_AGE'
+        ]
+        return response.make_conditional(request)
 
 
 url_shortener.add_url_rule(
@@ -143,12 +381,154 @@ url_shortener.add_url_rule(
 )
 
 
+@inject
+@url_shortener.route('/admin/metrics')
+def metrics(
+        caches: cache_registry,
+        blacklist_validator: BlacklistValidator,
+        db: SQLAlchemy
+):
+    """Serve statistics of caches, blacklists and connection pools.
+
+    The statistics are served only if METRICS_TOKEN option is set, and
+    only for requests sending it as a bearer token.
+
+    :param caches: an instance of caching.CacheRegistry
+    :param blacklist_validator: an instance of BlacklistValidator
+    providing statistics of external blacklist sources
+    :param db: an instance of ConfiguredSQLAlchemy providing statistics
+    of its connection pools
+    :returns: a JSON response with the statistics
+    :raises werkzeug.exceptions.HTTPException: with code 404 if
+    the statistics are not served, or 403 if the token is invalid
+    """
+    token = current_app.config['METRICS_TOKEN']
+    if token is None:
+        abort(404)
+    authorization = request.headers.get('Authorization', '')
+    # compare_digest accepts only ASCII strings, so headers with other
+    # characters are compared as bytes
+    if not compare_digest(
+            authorization.encode('utf-8'),
+            ('Bearer ' + token).encode('utf-8')
+    ):
+        abort(403)
+    return jsonify(
+        caches=caches.as_dict(),
+        blacklist_sources=blacklist_validator.get_source_metrics(),
+        connection_pools={
+            bind or 'default': m.as_dict()
+            for bind, m in db.pool_monitors.items()
+        }
+    )
+
+
+class ErrorPage(object):
+    """An error page served as pre-encoded bytes.
+
+    The page is rendered once and stored as bytes surrounding
+    the address of a request for which the error occured. The stored
+    content is rendered again only when the current year, displayed on
+    the page, changes.
+
+    :cvar _URL_PLACEHOLDER: a value passed to the template in place of
+    the requested URL
+    :ivar _content: a dictionary mapping a tuple of the year and
+    the root URL of the application for which the page was rendered
+    to parts of the page surrounding the requested URL
+    """
+
+    _URL_PLACEHOLDER = '\x00url\x00'
+
+    def __init__(self, template_name, status, cache_control):
+        """Initialize a new instance.
+
+        :param template_name: a name of a template of the page. It can
+        use "url" variable to display the requested URL
+        :param status: a status code of responses with the page
+        :param cache_control: a function setting cache control headers
+        of a response with the page
+        """
+        self.template_name = template_name
+        self.status = status
+        self.cache_control = cache_control
+        self._content = {}
+
+    def _get_parts(self):
+        """Get encoded parts of the page surrounding the requested URL.
+
+        :returns: a tuple of byte strings
+        """
+        year = inject_year()['year']
+        key = year, request.script_root
+        parts = self._content.get(key)
+        if parts is None:
+            content = render_template(
+                self.template_name,
+                url=self._URL_PLACEHOLDER,
+                year=year
+            )
+            parts = tuple(
+                content.encode('utf-8').split(
+                    self._URL_PLACEHOLDER.encode('utf-8')
+                )
+            )
+            self._content = {key: parts}
+        return parts
+
+    def get_response(self):
+        """Get a response with the page for the current request."""
+        url = escape(request.url).encode('utf-8')
+        response = current_app.response_class(
+            url.join(self._get_parts()),
+            status=self.status,
+            mimetype='text/html'
+        )
+        self.cache_control(response.cache_control)
+        return response
+
+
+def _not_found_cache_control(cache_control):
+    cache_control.public = True
+    cache_control.max_age = current_app.config['NOT_FOUND_MAX_AGE']
+
+
+def _server_error_cache_control(cache_control):
+    cache_control.no_store = True
+
+
+not_found_page = ErrorPage('not_found.html', 404, _not_found_cache_control)
+server_error_page = ErrorPage(
+    'server_error.html',
+    500,
+    _server_error_cache_control
+)
+
+
 @url_shortener.errorhandler(AliasValueError)
-@url_shortener.errorhandler(404)
+@url_shortener.app_errorhandler(404)
 def not_found(error):
-    return render_template('not_found.html')
+    return not_found_page.get_response()
+
+
+@url_shortener.errorhandler(StatementError)
+def statement_error(error):
+    """Handle an error occuring when preparing a database query.
+
+    An invalid alias string can't be converted to an integer in order
+    to be used in a query. The resulting AliasValueError is then
+    wrapped in an instance of StatementError.
+
+    :param error: an instance of StatementError
+    :returns: a response for a not found page, if the error wraps
+    AliasValueError
+    :raises StatementError: if it is caused by another error
+    """
+    if isinstance(error.orig, AliasValueError):
+        return not_found(error.orig)
+    raise error
 
 
 @url_shortener.errorhandler(500)
 def server_error(error):
-    return render_template('server_error.html')
+    return server_error_page.get_response()